@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Serve the hot public reads with the async views (ASYNC_PUBLIC_READS).
+os.environ.setdefault('DJANGO_ASYNC_PUBLIC_READS', '1')
 
 application = get_asgi_application()
@@ -37,8 +37,10 @@ MIDDLEWARE = [
 ]
 
 REST_FRAMEWORK = {
+    # Users come from the access token's claims, not a query per request
+    # (home/authentication.py).
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -63,8 +65,80 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'ALGORITHM': 'HS256',
     'TOKEN_OBTAIN_SERIALIZER': 'home.serializers.CustomTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'home.serializers.ClaimsTokenRefreshSerializer',
 }
 
+# Short-lived cache of the user rows views load for token users
+# (home/authentication.py); 'TIMEOUT': 0 turns it off.
+JWT_USER_CACHE = {
+    'TIMEOUT': 60,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'myblog-default',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Anonymous response cache for the public read endpoints (home/cache.py).
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'VERSION': 1,
+}
+
+# Seconds between write-behind flushes of buffered PostStats view/share
+# increments. 0 writes every increment straight through.
+POST_STATS_FLUSH_INTERVAL = 5
+# Buffered rows that trigger a flush before the interval is up.
+POST_STATS_FLUSH_MAX_PENDING = 1000
+
+# Batched background writer for ActivityLog; see home/activity.py for the keys.
+ACTIVITY_LOG_WRITER = {
+    'ASYNC': True,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,
+    'OVERFLOW': 'block',
+}
+
+# How long raw ActivityLog rows and their hourly/daily rollups are kept by
+# the prune_activity command; see home/rollups.py for the keys.
+ACTIVITY_LOG_RETENTION = {
+    'RAW_DAYS': 90,
+    'HOURLY_DAYS': 400,
+    'DAILY_DAYS': None,
+}
+
+# Activity time series endpoint (/api/activity-logs/analytics/); see
+# home/analytics.py for the keys.
+ACTIVITY_ANALYTICS = {
+    'MAX_BUCKETS': {'hour': 24 * 31, 'day': 3660, 'week': 520},
+    'NUMPY_MIN_ROWS': 2000,
+}
+
+# Resized WebP variants of uploaded post/category images, rendered by a
+# worker pool after the upload commits; see home/images.py for the keys.
+IMAGE_VARIANTS = {
+    'WIDTHS': (320, 640, 960, 1280),
+    'FORMATS': ('WEBP',),
+    'QUALITY': 80,
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+# Post search: 'fts5' (SQLite FTS5 table from migration 0009), 'memory'
+# (in-process BM25 index) or 'auto' to use FTS5 when the table exists.
+POST_SEARCH_BACKEND = 'auto'
+
+# Answer anonymous GETs of the post list/detail/discussion, categories and
+# post of the week with the async views in home/async_views.py. Only worth it
+# under ASGI: under WSGI every request to those routes, writes included,
+# would start its own event loop. core/asgi.py turns it on.
+ASYNC_PUBLIC_READS = os.environ.get('DJANGO_ASYNC_PUBLIC_READS') == '1'
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
@@ -93,9 +167,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock at BEGIN so read-then-write transactions
+            # (toggle_like, counter flushes) queue up instead of failing
+            # with "database is locked" when they try to upgrade.
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # A file-backed test database, so concurrency tests see real SQLite
+        # locking (shared-cache in-memory databases fail fast instead of waiting).
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# New passwords are hashed with the first hasher. The others only verify
+# older hashes, which check_password() rewrites with the first one on the
+# user's next login. Argon2 needs argon2-cffi; move it first once installed.
+PASSWORD_HASHERS = [
+    'home.hashers.ScryptPasswordHasher',
+    'home.hashers.Argon2PasswordHasher',
+    'home.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+# Hasher cost parameters and the cap on concurrent hashes; see
+# home/hashers.py for the keys. `manage.py benchmark_logins` measures them.
+PASSWORD_HASHING = {
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'MAX_CONCURRENT': None,
+    'WAIT_TIMEOUT': 5,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -120,6 +223,22 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are stored once per distinct content under media/blobs/; see
+# home/storage.py and `manage.py gc_media`.
+STORAGES = {
+    'default': {'BACKEND': 'home.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# How /media/ is served; see home/media.py for the keys. Behind nginx, set
+# ACCEL_REDIRECT to an `internal` location aliased to MEDIA_ROOT.
+MEDIA_SERVING = {
+    'MAX_AGE': 86400,
+    'IMMUTABLE_MAX_AGE': 31536000,
+    'ACCEL_REDIRECT': None,
+    'SENDFILE': False,
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'home.CustomUser'  # Added
\ No newline at end of file
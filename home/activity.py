@@ -0,0 +1,210 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from .models import ActivityLog
+from .rollups import roll_up
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Write from a background thread; False writes inline inside the request.
+    'ASYNC': True,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 200,
+    # Longest a queued entry waits before being written.
+    'FLUSH_INTERVAL': 1.0,
+    # What to do when the queue is full: 'block' (wait BLOCK_TIMEOUT, then
+    # drop the new entry), 'drop_newest' or 'drop_oldest'.
+    'OVERFLOW': 'block',
+    'BLOCK_TIMEOUT': 0.05,
+}
+
+
+def get_writer_settings():
+    return {**DEFAULTS, **getattr(settings, 'ACTIVITY_LOG_WRITER', {})}
+
+
+class ActivityLogWriter:
+    """
+    Batched ActivityLog sink.
+
+    Entries are queued once the surrounding transaction commits and written
+    with ``bulk_create`` by a single worker thread, so requests don't pay for
+    audit inserts. The queue is bounded; the OVERFLOW policy decides what
+    gets dropped under sustained overload. Whatever is queued at interpreter
+    exit is drained before the process goes away.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def log(self, action, **fields):
+        # Keep ids rather than instances: by the time the worker writes, a
+        # deleted instance has lost its pk and bulk_create would refuse it.
+        for name in ('user', 'post', 'comment'):
+            value = fields.pop(name, None)
+            if value is not None and not isinstance(value, int):
+                value = value.pk
+            fields[f'{name}_id'] = value
+        entry = ActivityLog(action=action, **fields)
+        conf = get_writer_settings()
+        if not conf['ASYNC']:
+            self._save(entry)
+            self.written += 1
+            return
+        transaction.on_commit(lambda: self.enqueue(entry))
+
+    def enqueue(self, entry):
+        conf = get_writer_settings()
+        self.start()
+        policy = conf['OVERFLOW']
+        try:
+            if policy == 'block':
+                self._queue.put(entry, timeout=conf['BLOCK_TIMEOUT'])
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            if policy != 'drop_oldest':
+                self.dropped += 1
+                return
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                self.dropped += 1
+                return
+        self.enqueued += 1
+
+    def stats(self):
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return {
+            'queue_depth': depth,
+            'queue_capacity': get_writer_settings()['QUEUE_SIZE'],
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'running': self._thread is not None and self._thread.is_alive(),
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._queue = queue.Queue(maxsize=get_writer_settings()['QUEUE_SIZE'])
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """Stop the worker and write out everything still queued."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=timeout)
+        self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Synchronously write everything currently queued."""
+        if self._queue is None:
+            return
+        batch_size = get_writer_settings()['BATCH_SIZE']
+        while True:
+            batch = self._drain(batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _drain(self, limit, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            conf = get_writer_settings()
+            try:
+                first = self._queue.get(timeout=conf['FLUSH_INTERVAL'])
+            except queue.Empty:
+                continue
+            # Give a burst a moment to accumulate so it lands in one insert.
+            deadline = time.monotonic() + conf['FLUSH_INTERVAL']
+            batch = self._drain(conf['BATCH_SIZE'], first)
+            while len(batch) < conf['BATCH_SIZE'] and time.monotonic() < deadline and not self._stop.is_set():
+                time.sleep(min(0.05, conf['FLUSH_INTERVAL']))
+                batch.extend(self._drain(conf['BATCH_SIZE'] - len(batch)))
+            close_old_connections()
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():
+                ActivityLog.objects.bulk_create(batch)
+                roll_up(batch)
+            self.written += len(batch)
+            self.batches += 1
+            return
+        except Exception:
+            logger.warning("ActivityLog batch of %d failed, retrying row by row", len(batch), exc_info=True)
+        # One bad row shouldn't sink the batch. Rows whose post/comment/user
+        # was deleted before the write get that reference nulled, which is
+        # what on_delete=SET_NULL would have done had they been written first.
+        for entry in batch:
+            try:
+                entry.pk = None
+                try:
+                    self._save(entry)
+                except IntegrityError:
+                    self._null_missing_references(entry)
+                    self._save(entry)
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Dropping ActivityLog entry %s", entry.action)
+
+    def _save(self, entry):
+        with transaction.atomic():
+            entry.save()
+            roll_up([entry])
+
+    def _null_missing_references(self, entry):
+        for name in ('user', 'post', 'comment'):
+            field = ActivityLog._meta.get_field(name)
+            value = getattr(entry, field.attname)
+            if value is not None and not field.related_model._default_manager.filter(pk=value).exists():
+                setattr(entry, field.attname, None)
+
+
+activity_writer = ActivityLogWriter()
+
+
+def log_activity(action, **fields):
+    activity_writer.log(action, **fields)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, PostCategory,Post, PostStats , Comment , Reply , Contact , NewsLetter, ActivityLog
+from .models import CustomUser, PostCategory,Post, PostStats , Comment , Reply , Contact , NewsLetter, ActivityLog, ActivityHourly, ActivityDaily
 
 # Register your models here.
 class CustomUserAdmin(admin.ModelAdmin):
@@ -14,7 +14,7 @@ class PostAdmin(admin.ModelAdmin):
     list_display = ('id','title', 'category', 'status', 'created_at', 'updated_at')
 admin.site.register(Post, PostAdmin)
 class PostStatsAdmin(admin.ModelAdmin):
-    list_display = ('id','post', 'views', 'likes', 'comments', 'shares')
+    list_display = ('id','post', 'views', 'likes', 'comments', 'replies', 'shares')
 admin.site.register(PostStats, PostStatsAdmin)
 
 class CommentAdmin(admin.ModelAdmin):
@@ -37,3 +37,9 @@ admin.site.register(NewsLetter, NewsletterAdmin)
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ('id','user', 'post', 'comment', 'action', 'created_at')
 admin.site.register(ActivityLog, ActivityLogAdmin)
+
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('id', 'bucket', 'action', 'post_id', 'count')
+    list_filter = ('action',)
+admin.site.register(ActivityHourly, ActivityRollupAdmin)
+admin.site.register(ActivityDaily, ActivityRollupAdmin)
@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from .models import ActivityDaily, ActivityHourly, ActivityLog, ActivityRollup
+from .rollups import day_start
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULTS = {
+    # Range served when the request names no ``since``, in days back from today.
+    'DEFAULT_DAYS': {'hour': 7, 'day': 90, 'week': 364},
+    # Longest series served per interval, in buckets. A series reads one
+    # rollup row per bucket and action, so a year of days or weeks costs a
+    # few thousand rows while a year of hours would cost over 100k.
+    'MAX_BUCKETS': {'hour': 24 * 31, 'day': 3660, 'week': 520},
+    # Fold rows into buckets with NumPy when it is installed and the range
+    # has at least this many rollup rows; None never uses it.
+    'NUMPY_MIN_ROWS': 2000,
+}
+
+ACTIONS = [action for action, _ in ActivityLog.ACTION_CHOICES]
+
+INTERVALS = ('hour', 'day', 'week')
+
+
+def get_analytics_settings():
+    return {**DEFAULTS, **getattr(settings, 'ACTIVITY_ANALYTICS', {})}
+
+
+def bucket_range(interval, since, until):
+    """
+    First bucket, bucket count and bucket width for the UTC days
+    ``since``..``until``. Weeks start on the Monday on or before ``since``.
+    """
+    if interval == 'hour':
+        return day_start(since), 24 * ((until - since).days + 1), timedelta(hours=1)
+    if interval == 'week':
+        start = since - timedelta(days=since.weekday())
+        return start, (until - start).days // 7 + 1, timedelta(weeks=1)
+    return since, (until - since).days + 1, timedelta(days=1)
+
+
+def time_series(interval, since, until, post_id=None, actions=None):
+    """
+    Counts per ``actions`` (default: all of ACTION_CHOICES) per hour, day
+    or week over the UTC days ``since``..``until``, for one post or, with
+    no ``post_id``, the whole site. Read from the rollups only: at most one
+    row per bucket and action, found with a range scan of their unique index.
+    """
+    actions = [action for action in ACTIONS if actions is None or action in actions]
+    start, size, width = bucket_range(interval, since, until)
+    if interval == 'hour':
+        rows = ActivityHourly.objects.filter(bucket__gte=start, bucket__lt=day_start(until + timedelta(days=1)))
+    else:
+        rows = ActivityDaily.objects.filter(bucket__gte=since, bucket__lte=until)
+    rows = rows.filter(post_id=post_id or ActivityRollup.SITE)
+    if len(actions) < len(ACTIONS):
+        rows = rows.filter(action__in=actions)
+    rows = list(rows.values_list('bucket', 'action', 'count').order_by())
+
+    # Row -> flat index into an actions x buckets grid.
+    slot = {action: index * size for index, action in enumerate(actions)}
+    step = width.total_seconds() if interval == 'hour' else width.days
+    if interval == 'hour':
+        offsets = [int((bucket - start).total_seconds() // step) for bucket, _, _ in rows]
+    else:
+        offsets = [(bucket - start).days // step for bucket, _, _ in rows]
+
+    conf = get_analytics_settings()
+    if numpy is not None and conf['NUMPY_MIN_ROWS'] is not None and len(rows) >= conf['NUMPY_MIN_ROWS']:
+        index = numpy.fromiter((slot[row[1]] for row in rows), dtype=numpy.int64, count=len(rows))
+        index += numpy.fromiter(offsets, dtype=numpy.int64, count=len(rows))
+        counts = numpy.fromiter((row[2] for row in rows), dtype=numpy.int64, count=len(rows))
+        grid = numpy.bincount(index, weights=counts, minlength=len(actions) * size).astype(numpy.int64)
+        series = {action: grid[slot[action]:slot[action] + size].tolist() for action in actions}
+    else:
+        grid = [0] * (len(actions) * size)
+        for (_, action, count), offset in zip(rows, offsets):
+            grid[slot[action] + offset] += count
+        series = {action: grid[slot[action]:slot[action] + size] for action in actions}
+
+    if interval == 'hour':
+        labels = [(start + i * width).strftime('%Y-%m-%dT%H:00:00Z') for i in range(size)]
+    else:
+        labels = [(start + i * width).isoformat() for i in range(size)]
+    return {
+        'interval': interval,
+        'since': since,
+        'until': until,
+        'post': post_id,
+        'buckets': labels,
+        'series': series,
+        'totals': {action: sum(values) for action, values in series.items()},
+    }
@@ -0,0 +1,271 @@
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.exceptions import APIException, NotFound, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .cache import _cache, acache_key, get_cache_settings, record
+from .conditional import make_etag
+from .models import Comment, Post, PostCategory, PostStats
+from .pagination import DiscussionPagination, KeysetPagination
+from .prefetch import plan_queryset
+from .serializers import CategorySerializer, DiscussionCommentSerializer, PostSerializer, PostStatsSerializer
+from .views import CategoryViewset, PostStatsViewset, PostViewset
+
+logger = logging.getLogger(__name__)
+
+# Columns the keyset paginators read off each row, kept loaded by the planner.
+POST_KEYSET_FIELDS = ('created_at', 'id')
+
+
+def serves_async(request, kwargs):
+    """
+    Whether the async path can answer ``request``: an anonymous JSON GET.
+    Anything that needs authentication (superusers see drafts), a write or
+    the browsable API goes through DRF as before.
+    """
+    return (
+        request.method == 'GET'
+        and 'HTTP_AUTHORIZATION' not in request.META
+        and getattr(request, '_force_auth_user', None) is None
+        and 'format' not in kwargs
+        and 'format' not in request.GET
+        and 'text/html' not in request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+def hybrid(async_view, sync_view):
+    """
+    One view for a router URL: ``async_view`` for the requests it can
+    serve, the router's DRF ``sync_view`` (on a worker thread, as Django
+    runs any sync view under ASGI) for the rest.
+    """
+    run_sync = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if settings.ASYNC_PUBLIC_READS and serves_async(request, kwargs):
+            return await async_view(request, *args, **kwargs)
+        return await run_sync(request, *args, **kwargs)
+
+    functools.update_wrapper(view, sync_view)
+    del view.__wrapped__
+    view.csrf_exempt = True
+    return view
+
+
+def async_reads(urlpatterns):
+    """
+    Swap the router patterns named in ``ASYNC_VIEWS`` for hybrid views; same
+    URLs, same names. With ASYNC_PUBLIC_READS off when the URLconf loads the
+    patterns are left alone, so WSGI doesn't pay for async views it can't use.
+    """
+    if not settings.ASYNC_PUBLIC_READS:
+        return urlpatterns
+    return [
+        URLPattern(pattern.pattern, hybrid(ASYNC_VIEWS[pattern.name], pattern.callback), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in ASYNC_VIEWS else pattern
+        for pattern in urlpatterns
+    ]
+
+
+def render(data, status=200):
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def public_read(view_class):
+    """
+    Wrap an async read with what DRF would have done around it for an
+    anonymous user: the view's throttles, then API errors as JSON bodies.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            request = Request(request)
+            try:
+                await check_throttles(request, view_class)
+                return await func(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+                response = render(detail, status=exc.status_code)
+                if isinstance(exc, Throttled) and exc.wait is not None:
+                    response['Retry-After'] = '%d' % exc.wait
+                return response
+        return view
+    return decorator
+
+
+def _refusals(request, throttles):
+    return [throttle.wait() for throttle in throttles if not throttle.allow_request(request, None)]
+
+
+async def check_throttles(request, view_class):
+    throttles = [throttle() for throttle in view_class.throttle_classes]
+    if not throttles:
+        return
+    # Throttle history lives in the cache through a synchronous API.
+    waits = await sync_to_async(_refusals)(request, throttles)
+    if waits:
+        raise Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+async def cached_response(scope, request, load):
+    """``CachedResponseMixin.cached_response_for`` for async loaders, sharing its entries."""
+    cache = _cache()
+    key = await acache_key(scope, request)
+    data = await cache.aget(key)
+    if data is not None:
+        record(scope, 'hit')
+        response = render(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    record(scope, 'miss')
+    data = await load()
+    await cache.aset(key, data, get_cache_settings()['TIMEOUT'])
+    response = render(data)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def conditional_response(request, validators, respond):
+    """``ConditionalGetMixin.conditional_response``; the tags are the same, so either path can revalidate."""
+    last_modified, extra = validators
+    if last_modified is None:
+        return await respond()
+    etag = make_etag(request, last_modified, extra)
+    timestamp = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await respond()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def serializer_context(request):
+    return {'request': request, 'format': None, 'view': None}
+
+
+async def published_posts(request):
+    """``PostViewset.get_queryset`` for an anonymous user."""
+    queryset = Post.objects.filter(status='publish').order_by('-created_at')
+    tags = request.query_params.getlist('tag')
+    if tags:
+        match = 'any' if request.query_params.get('tag_match') == 'any' else 'all'
+        # tagged() resolves the slugs with a query of its own.
+        queryset = await sync_to_async(queryset.tagged)(tags, match=match)
+    return queryset
+
+
+async def get_planned(queryset, serializer_class, pk):
+    try:
+        return await plan_queryset(queryset, serializer_class).aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise NotFound(f"No {queryset.model._meta.object_name} matches the given query.")
+    except (ValueError, TypeError, ValidationError):
+        raise NotFound()
+
+
+@public_read(PostViewset)
+async def post_list(request):
+    queryset = await published_posts(request)
+    summary = await queryset.order_by().aaggregate(last=Max('updated_at'), count=Count('pk'))
+
+    async def load():
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(
+            plan_queryset(queryset, PostSerializer, extra_fields=POST_KEYSET_FIELDS), request,
+        )
+        data = PostSerializer(page, many=True, context=serializer_context(request)).data
+        return paginator.get_paginated_response(data).data
+
+    return await conditional_response(
+        request, (summary['last'], f"{summary['count']}"), lambda: cached_response('posts', request, load),
+    )
+
+
+@public_read(PostViewset)
+async def post_detail(request, pk):
+    queryset = await published_posts(request)
+    try:
+        last = await queryset.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+    except (ValueError, TypeError, ValidationError):
+        last = None
+
+    async def load():
+        post = await get_planned(queryset, PostSerializer, pk)
+        return PostSerializer(post, context=serializer_context(request)).data
+
+    return await conditional_response(request, (last, f'{pk}'), lambda: cached_response('posts', request, load))
+
+
+@public_read(PostViewset)
+async def post_discussion(request, pk):
+    async def load():
+        queryset = await published_posts(request)
+        try:
+            found = await queryset.filter(pk=pk).aexists()
+        except (ValueError, TypeError, ValidationError):
+            found = False
+        if not found:
+            raise NotFound()
+        comments = plan_queryset(
+            Comment.objects.filter(post_id=pk), DiscussionCommentSerializer, extra_fields=POST_KEYSET_FIELDS,
+        )
+        paginator = DiscussionPagination()
+        page = await paginator.apaginate_queryset(comments, request)
+        data = DiscussionCommentSerializer(page, many=True, context=serializer_context(request)).data
+        return paginator.get_paginated_response(data).data
+
+    return await cached_response('discussions', request, load)
+
+
+@public_read(CategoryViewset)
+async def category_list(request):
+    async def load():
+        categories = [category async for category in plan_queryset(PostCategory.objects.all(), CategorySerializer)]
+        return CategorySerializer(categories, many=True, context=serializer_context(request)).data
+
+    return await cached_response('categories', request, load)
+
+
+@public_read(CategoryViewset)
+async def category_detail(request, pk):
+    async def load():
+        category = await get_planned(PostCategory.objects.all(), CategorySerializer, pk)
+        return CategorySerializer(category, context=serializer_context(request)).data
+
+    return await cached_response('categories', request, load)
+
+
+@public_read(PostStatsViewset)
+async def post_of_the_week(request):
+    year, week, _ = timezone.localdate().isocalendar()
+    leaderboard = plan_queryset(PostStats.objects.all(), PostStatsSerializer)
+    post_of_week = await leaderboard.leaderboard(week=(year, week)).afirst() or await leaderboard.leaderboard().afirst()
+    if post_of_week is None:
+        return render({"message": "No post found for this week"}, status=404)
+    return render(PostStatsSerializer(post_of_week, context=serializer_context(request)).data)
+
+
+# Router URL name -> async implementation of its anonymous GET.
+ASYNC_VIEWS = {
+    'post-list': post_list,
+    'post-detail': post_detail,
+    'post-discussion': post_discussion,
+    'category-list': category_list,
+    'category-detail': category_detail,
+    'poststats-post-of-the-week': post_of_the_week,
+}
@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    # Seconds a loaded user row is reused; 0 reads it from the database
+    # every time. Saves and deletes evict it (see home/signals.py).
+    'TIMEOUT': 60,
+    'KEY_PREFIX': 'authuser',
+}
+
+
+def get_user_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+def add_user_claims(token, user):
+    """
+    Stamp the flags permission checks read onto ``token``. Requests are
+    authenticated from the token alone (``JWTStatelessUserAuthentication``
+    hands views a ``TokenUser`` built from these claims), so
+    ``is_staff`` / ``is_superuser`` checks cost no query.
+    """
+    token['is_superuser'] = user.is_superuser
+    token['is_staff'] = user.is_staff
+    return token
+
+
+def _user_key(pk):
+    conf = get_user_cache_settings()
+    return f"{conf['KEY_PREFIX']}:{pk}"
+
+
+def load_user(pk):
+    """
+    The ``CustomUser`` row for a token user, for the few views that need
+    more than its id and flags. Kept in the cache for a short TTL.
+    """
+    conf = get_user_cache_settings()
+    cache = caches[conf['ALIAS']]
+    if conf['TIMEOUT']:
+        user = cache.get(_user_key(pk))
+        if user is not None:
+            return user
+    user = CustomUser.objects.filter(pk=pk).first()
+    if not jwt_settings.USER_AUTHENTICATION_RULE(user):
+        # Deleted or deactivated since the token was issued.
+        raise AuthenticationFailed("User not found", code='user_not_found')
+    if conf['TIMEOUT']:
+        cache.set(_user_key(pk), user, conf['TIMEOUT'])
+    return user
+
+
+def forget_user(pk):
+    conf = get_user_cache_settings()
+    caches[conf['ALIAS']].delete(_user_key(pk))
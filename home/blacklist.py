@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Seconds between pulls of tokens other processes blacklisted. A stale
+    # filter is still safe: rotation and logout insert the blacklist row,
+    # and the unique constraint rejects a token that is already in it.
+    'SYNC_INTERVAL': 30,
+    'ERROR_RATE': 0.01,
+    # Smallest filter built; it is rebuilt at twice the size once full.
+    'MIN_CAPACITY': 10000,
+}
+
+
+def get_blacklist_settings():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_BLACKLIST_FILTER', {})}
+
+
+class BloomFilter:
+    """Set membership with no false negatives and ``error_rate`` false positives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from two halves of one digest.
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationFilter:
+    """
+    Which refresh-token jtis might be blacklisted, kept in memory.
+
+    Built from the unexpired rows of ``BlacklistedToken``, then topped up
+    with rows past a high-water id every SYNC_INTERVAL seconds and with this
+    process's own revocations as they happen. A miss means the token is
+    certainly not revoked (as of the last sync) and skips the database; a
+    hit is confirmed with the usual query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._high_water = 0
+        self._synced_at = 0.0
+
+    def might_be_revoked(self, jti):
+        conf = get_blacklist_settings()
+        with self._lock:
+            if self._bloom is None or time.monotonic() - self._synced_at > conf['SYNC_INTERVAL']:
+                self._sync(conf)
+            return jti in self._bloom
+
+    def add(self, jti):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+                if self._bloom.count > self._bloom.capacity:
+                    # Past capacity the false-positive rate climbs; rebuild
+                    # from the table, which also drops expired tokens.
+                    self._bloom = None
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+
+    def _sync(self, conf):
+        if self._bloom is None:
+            high_water = BlacklistedToken.objects.aggregate(last=Max('id'))['last'] or 0
+            jtis = list(
+                BlacklistedToken.objects.filter(id__lte=high_water, token__expires_at__gt=aware_utcnow())
+                .values_list('token__jti', flat=True)
+            )
+            bloom = BloomFilter(max(2 * len(jtis), conf['MIN_CAPACITY']), conf['ERROR_RATE'])
+            logger.debug("Building token blacklist filter: %d live tokens, %d bits", len(jtis), bloom.size)
+        else:
+            bloom, high_water = self._bloom, self._high_water
+            rows = list(BlacklistedToken.objects.filter(id__gt=high_water).values_list('id', 'token__jti'))
+            jtis = [jti for _, jti in rows]
+            if rows:
+                high_water = max(row_id for row_id, _ in rows)
+        for jti in jtis:
+            bloom.add(jti)
+        self._bloom, self._high_water, self._synced_at = bloom, high_water, time.monotonic()
+        if bloom.count > bloom.capacity:
+            self._bloom = None
+
+revocation_filter = RevocationFilter()
+
+
+class TokenBlacklisted(TokenError):
+    """The token was revoked: blacklisted by logout or rotation."""
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    Refresh token whose blacklist check goes through ``revocation_filter``
+    and whose blacklist/outstanding writes skip simplejwt's user lookups.
+    """
+
+    def check_blacklist(self):
+        jti = self.payload[jwt_settings.JTI_CLAIM]
+        if revocation_filter.might_be_revoked(jti) and BlacklistedToken.objects.filter(token__jti=jti).exists():
+            raise TokenBlacklisted(_("Token is blacklisted"))
+
+    def blacklist(self):
+        """
+        Blacklist this token, failing if it already was: the insert is the
+        authoritative check, so a token replayed before the filter heard of
+        its revocation (or raced by two refreshes) still can't rotate twice.
+        """
+        jti = self.payload[jwt_settings.JTI_CLAIM]
+        token_id = OutstandingToken.objects.filter(jti=jti).values_list('id', flat=True).first()
+        if token_id is None:
+            # Issued before outstanding tokens were tracked: record it now.
+            token_id = self._record_outstanding(jti)
+        try:
+            with transaction.atomic():
+                # The jti rides along on the unsaved row so the post_save
+                # receiver can add it to the filter without a query.
+                blacklisted = BlacklistedToken.objects.create(token=OutstandingToken(id=token_id, jti=jti))
+        except IntegrityError:
+            raise TokenBlacklisted(_("Token is blacklisted"))
+        return blacklisted, True
+
+    def _record_outstanding(self, jti):
+        try:
+            with transaction.atomic():
+                return OutstandingToken.objects.create(
+                    jti=jti,
+                    user_id=self.payload.get(jwt_settings.USER_ID_CLAIM),
+                    created_at=datetime_from_epoch(self.payload['iat']) if 'iat' in self.payload else self.current_time,
+                    token=str(self),
+                    expires_at=datetime_from_epoch(self.payload['exp']),
+                ).id
+        except IntegrityError:
+            # Recorded by a concurrent request, or its user is gone.
+            token_id = OutstandingToken.objects.filter(jti=jti).values_list('id', flat=True).first()
+            if token_id is None:
+                raise
+            return token_id
+
+    def outstand(self):
+        # Called right after set_jti(), so the jti is new: insert, don't look up.
+        token = OutstandingToken.objects.create(
+            jti=self.payload[jwt_settings.JTI_CLAIM],
+            user_id=self.payload.get(jwt_settings.USER_ID_CLAIM),
+            created_at=self.current_time,
+            token=str(self),
+            expires_at=datetime_from_epoch(self.payload['exp']),
+        )
+        return token, True
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'KEY_PREFIX': 'resp',
+    # Bump to orphan every cached response at once, e.g. when a serializer's
+    # output shape changes in a deploy.
+    'VERSION': 1,
+}
+
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def get_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def _cache():
+    return caches[get_cache_settings()['ALIAS']]
+
+
+def _generation_key(scope):
+    conf = get_cache_settings()
+    return f"{conf['KEY_PREFIX']}:{conf['VERSION']}:gen:{scope}"
+
+
+def get_generation(scope):
+    cache = _cache()
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock rather than 1 so an evicted generation can't
+        # come back as a number that older entries are still stored under.
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+async def aget_generation(scope):
+    """``get_generation`` through the cache's async API, for async views."""
+    cache = _cache()
+    key = _generation_key(scope)
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, int(time.time() * 1000), timeout=None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def invalidate(*scopes):
+    """Move each scope to a new generation; its old entries are never read again."""
+    cache = _cache()
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+def _response_key(scope, generation, request):
+    conf = get_cache_settings()
+    digest = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f"{conf['KEY_PREFIX']}:{conf['VERSION']}:{scope}:{generation}:{digest}"
+
+
+def cache_key(scope, request):
+    return _response_key(scope, get_generation(scope), request)
+
+
+async def acache_key(scope, request):
+    return _response_key(scope, await aget_generation(scope), request)
+
+
+def record(scope, outcome):
+    with _stats_lock:
+        _stats[(scope, outcome)] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    scopes = sorted({scope for scope, _ in snapshot})
+    return {
+        scope: {'hits': snapshot.get((scope, 'hit'), 0), 'misses': snapshot.get((scope, 'miss'), 0)}
+        for scope in scopes
+    }
+
+
+class CachedResponseMixin:
+    """
+    Cache list/retrieve responses for anonymous requests.
+
+    Entries are keyed by ``cache_scope``, that scope's current generation
+    and the full request URL. Model signals move the generation forward
+    (see ``home/signals.py``), so a write invalidates exactly the scopes
+    whose output it can change. The serialized data is cached, not the
+    rendered bytes, so content negotiation still happens per request.
+    """
+    cache_scope = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def is_cacheable(self, request):
+        return (
+            self.cache_scope is not None
+            and request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        return self.cached_response_for(self.cache_scope, handler, request, *args, **kwargs)
+
+    def cached_response_for(self, scope, handler, request, *args, **kwargs):
+        """Like ``cached_response`` but under ``scope``, for extra actions whose output other models feed."""
+        if scope is None or not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+        key = cache_key(scope, request)
+        cached = _cache().get(key)
+        if cached is not None:
+            record(scope, 'hit')
+            response = Response(cached)
+            response['X-Cache'] = 'HIT'
+            return response
+        record(scope, 'miss')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            _cache().set(key, response.data, get_cache_settings()['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,242 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, connections, models
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .activity import log_activity
+from .models import Comment, Post, PostStats, PostTag, Reply, Tag
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """
+    Write-behind buffer for the hot PostStats counters.
+
+    Increments are coalesced per PostStats row in memory and written out by
+    a background thread every ``POST_STATS_FLUSH_INTERVAL`` seconds with one
+    ``UPDATE ... SET views = views + CASE id WHEN ... END`` statement (which
+    also moves engagement_score), so a burst of views on one post costs one
+    row write instead of one per hit.
+    An interval of 0 writes through on every increment; once
+    ``POST_STATS_FLUSH_MAX_PENDING`` rows are buffered the increment that
+    got there flushes them itself, which bounds both memory and what a
+    crash can lose.
+    """
+    fields = ('views', 'shares')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held from taking a batch until it is written, so snapshot() never
+        # sees a batch that has left the buffer but not reached the row.
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def interval(self):
+        return getattr(settings, 'POST_STATS_FLUSH_INTERVAL', 5)
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'POST_STATS_FLUSH_MAX_PENDING', 1000)
+
+    def increment(self, stats_id, **amounts):
+        unknown = set(amounts) - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unsupported counters: {', '.join(sorted(unknown))}")
+        with self._lock:
+            self._pending[stats_id].update({f: n for f, n in amounts.items() if n})
+            backlog = len(self._pending)
+        if self.interval <= 0 or backlog >= self.max_pending:
+            self.flush()
+        if self.interval > 0:
+            self.start()
+
+    def pending(self, stats_id):
+        with self._lock:
+            counts = self._pending.get(stats_id)
+            return {f: counts[f] if counts else 0 for f in self.fields}
+
+    def snapshot(self, stats_id):
+        """
+        The row's counters as written plus whatever is still buffered for it,
+        or None if there is no such row. Read while no flush is under way,
+        so every increment is counted exactly once.
+        """
+        with self._flush_lock:
+            row = PostStats.objects.filter(pk=stats_id).values(*self.fields).first()
+            if row is None:
+                return None
+            pending = self.pending(stats_id)
+        return {f: row[f] + pending[f] for f in self.fields}
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, defaultdict(Counter)
+            if not batch:
+                return 0
+            try:
+                updated = self._write(batch)
+            except Exception:
+                # Put the deltas back so the next flush retries them.
+                with self._lock:
+                    for stats_id, counts in batch.items():
+                        self._pending[stats_id].update(counts)
+                logger.exception("PostStats counter flush failed, %d rows kept for retry", len(batch))
+                raise
+        logger.debug("Flushed buffered counters for %d PostStats rows", updated)
+        self._log(batch)
+        return updated
+
+    def _write(self, batch):
+        updates = {}
+        for field in self.fields:
+            whens = [When(pk=pk, then=Value(counts[field])) for pk, counts in batch.items() if counts[field]]
+            if whens:
+                updates[field] = F(field) + Case(*whens, default=Value(0), output_field=models.PositiveIntegerField())
+        if not updates:
+            return 0
+        weights = PostStats.ENGAGEMENT_WEIGHTS
+        score_whens = [
+            When(pk=pk, then=Value(sum(weights[f] * counts[f] for f in self.fields)))
+            for pk, counts in batch.items()
+        ]
+        updates['engagement_score'] = F('engagement_score') + Case(*score_whens, default=Value(0.0), output_field=models.FloatField())
+        return PostStats.objects.filter(pk__in=list(batch)).update(**updates)
+
+    def _log(self, batch):
+        # The UPDATE sends no post_save, so log the flushed deltas here, one
+        # entry per post and counter. The counts are already written; a
+        # failure here must not put them back in the buffer.
+        try:
+            post_ids = dict(PostStats.objects.filter(pk__in=list(batch)).values_list('id', 'post_id'))
+            for stats_id, counts in batch.items():
+                for field, action in (('views', 'VIEW_POST'), ('shares', 'SHARE_POST')):
+                    if counts[field] and stats_id in post_ids:
+                        log_activity(action, post=post_ids[stats_id], count=counts[field])
+        except Exception:
+            logger.exception("Logging flushed PostStats counters failed")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='poststats-counter-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and drain whatever is still buffered."""
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join(timeout=max(self.interval, 1) * 2)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass
+        connections.close_all()
+
+
+counter_buffer = CounterBuffer()
+
+
+# Discussion counters: PostStats.comments and PostStats.replies (per post)
+# and Comment.reply_count. The Comment/Reply save and delete signals call
+# these, and Django sends those signals for cascaded deletes too, so every
+# row moves the counters exactly once for itself however it was removed.
+
+def _deleted_with_post(origin):
+    # When the post itself is going, its stats row goes with it.
+    return isinstance(origin, Post) or getattr(origin, 'model', None) is Post
+
+
+def comment_added(comment):
+    if not PostStats.objects.filter(post_id=comment.post_id).bump(comments=1):
+        PostStats.objects.create(post_id=comment.post_id, comments=1)
+
+
+def comment_removed(comment, origin=None):
+    if not _deleted_with_post(origin):
+        PostStats.objects.filter(post_id=comment.post_id, comments__gt=0).bump(comments=-1)
+
+
+def reply_added(reply):
+    # updated_at moves with reply_count, which comments are served with, so
+    # their ETags change too.
+    Comment.objects.filter(pk=reply.comment_id).update(reply_count=F('reply_count') + 1, updated_at=timezone.now())
+    # Subquery on the comment instead of loading it for its post_id.
+    PostStats.objects.filter(post__comments=reply.comment_id).bump(replies=1)
+
+
+def reply_removed(reply, origin=None):
+    if _deleted_with_post(origin):
+        return
+    Comment.objects.filter(pk=reply.comment_id, reply_count__gt=0).update(
+        reply_count=F('reply_count') - 1, updated_at=timezone.now(),
+    )
+    PostStats.objects.filter(post__comments=reply.comment_id, replies__gt=0).bump(replies=-1)
+
+
+def _count(model, column, outer='pk', **filters):
+    counted = (
+        model.objects.filter(**{column: OuterRef(outer)}, **filters)
+        .order_by().values(column).annotate(n=Count('pk')).values('n')
+    )
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def recount(dry_run=False):
+    """
+    Recompute every denormalized counter from the source rows with
+    set-based UPDATEs, touching only the rows that drifted. Returns the
+    number of drifted rows per counter.
+    """
+    drifted = {}
+
+    comments = Comment.objects.alias(actual=_count(Reply, 'comment')).exclude(reply_count=F('actual'))
+    drifted['comment.reply_count'] = comments.count() if dry_run else comments.update(reply_count=_count(Reply, 'comment'))
+
+    comment_count = _count(Comment, 'post', 'post_id')
+    reply_count = _count(Reply, 'comment__post', 'post_id')
+    likes = _count(PostStats.liked_by.through, 'poststats')
+    stats = PostStats.objects.alias(
+        actual_comments=comment_count, actual_replies=reply_count, actual_likes=likes,
+    ).exclude(comments=F('actual_comments'), replies=F('actual_replies'), likes=F('actual_likes'))
+    drifted['poststats.comments/replies/likes'] = (
+        stats.count() if dry_run else stats.update(comments=comment_count, replies=reply_count, likes=likes)
+    )
+
+    score = sum(weight * F(field) for field, weight in PostStats.ENGAGEMENT_WEIGHTS.items())
+    # Compared with a tolerance: the incremental updates accumulate float error.
+    scores = PostStats.objects.alias(expected=score).exclude(
+        engagement_score__gte=F('expected') - 1e-6, engagement_score__lte=F('expected') + 1e-6,
+    )
+    drifted['poststats.engagement_score'] = scores.count() if dry_run else scores.update(engagement_score=score)
+
+    # Queryset .update(status=...) bypasses Post.save() and so PostTag.sync.
+    post_count = _count(PostTag, 'tag', post__status='publish')
+    tags = Tag.objects.alias(actual=post_count).exclude(post_count=F('actual'))
+    drifted['tag.post_count'] = tags.count() if dry_run else tags.update(post_count=post_count)
+    return drifted
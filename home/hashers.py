@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # scrypt cost: N, r, p. Django's defaults: ~60ms and 16 MiB per hash.
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'SCRYPT_BLOCK_SIZE': 8,
+    'SCRYPT_PARALLELISM': 1,
+    # Argon2id cost (needs argon2-cffi): OWASP's baseline of 19 MiB, 2 passes, 1 lane.
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 19456,
+    'ARGON2_PARALLELISM': 1,
+    # Hashes computed at once in this process; None for one per CPU.
+    # Requests beyond that queue for up to WAIT_TIMEOUT seconds, then fail
+    # with HashingBusy instead of piling more CPU work onto the box.
+    'MAX_CONCURRENT': None,
+    'WAIT_TIMEOUT': 5,
+}
+
+
+def get_hashing_settings():
+    return {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING', {})}
+
+
+class HashingBusy(APIException):
+    """
+    No hashing slot came free within WAIT_TIMEOUT. An APIException, so any
+    view that ends up hashing (login, register, the user endpoints through
+    set_password) sheds the request with a 503; DRF's exception handler
+    turns ``wait`` into Retry-After.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-ins right now, please retry shortly"
+    default_code = 'hashing_busy'
+    wait = 1
+
+
+class HashingGate:
+    """
+    Caps how many password hashes run at once. Each hash is a fixed slab of
+    CPU (and, for scrypt/Argon2, memory), so during a login storm running
+    more of them than there are cores only slows every one down and starves
+    the other requests on the worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self._size = None
+        self._local = threading.local()
+
+    def _slots(self, conf):
+        size = conf['MAX_CONCURRENT'] or os.cpu_count() or 1
+        with self._lock:
+            if self._size != size:
+                self._semaphore, self._size = threading.BoundedSemaphore(size), size
+            return self._semaphore
+
+    @contextmanager
+    def slot(self):
+        # Reentrant per thread: Django's verify() calls encode().
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        conf = get_hashing_settings()
+        semaphore = self._slots(conf)
+        if not semaphore.acquire(timeout=conf['WAIT_TIMEOUT']):
+            logger.warning("Password hashing saturated: no slot within %ss", conf['WAIT_TIMEOUT'])
+            raise HashingBusy()
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            semaphore.release()
+
+
+hashing_gate = HashingGate()
+
+
+class BoundedHasherMixin:
+    """Run a hasher's encode/verify inside ``hashing_gate``."""
+
+    def encode(self, *args, **kwargs):
+        with hashing_gate.slot():
+            return super().encode(*args, **kwargs)
+
+    def verify(self, *args, **kwargs):
+        with hashing_gate.slot():
+            return super().verify(*args, **kwargs)
+
+
+class ScryptPasswordHasher(BoundedHasherMixin, hashers.ScryptPasswordHasher):
+    """scrypt with its cost taken from PASSWORD_HASHING; changing it rehashes on next login."""
+
+    def __init__(self):
+        conf = get_hashing_settings()
+        self.work_factor = conf['SCRYPT_WORK_FACTOR']
+        self.block_size = conf['SCRYPT_BLOCK_SIZE']
+        self.parallelism = conf['SCRYPT_PARALLELISM']
+        # scrypt needs 128 * N * r * p bytes; OpenSSL refuses anything over
+        # 32 MiB unless told otherwise. Leave room to verify hashes made
+        # with a costlier setting than the current one.
+        self.maxmem = max(2 * 128 * self.work_factor * self.block_size * self.parallelism, 64 * 1024 * 1024)
+
+
+class Argon2PasswordHasher(BoundedHasherMixin, hashers.Argon2PasswordHasher):
+    """Argon2id with its cost taken from PASSWORD_HASHING; changing it rehashes on next login."""
+
+    def __init__(self):
+        conf = get_hashing_settings()
+        self.time_cost = conf['ARGON2_TIME_COST']
+        self.memory_cost = conf['ARGON2_MEMORY_COST']
+        self.parallelism = conf['ARGON2_PARALLELISM']
+
+
+class PBKDF2PasswordHasher(BoundedHasherMixin, hashers.PBKDF2PasswordHasher):
+    """Django's default, kept to verify (and then upgrade) existing hashes."""
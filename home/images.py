@@ -0,0 +1,172 @@
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Variant widths in pixels; widths at or above the original's are skipped.
+    'WIDTHS': (320, 640, 960, 1280),
+    # Pillow format names. Formats this Pillow build can't encode are skipped.
+    'FORMATS': ('WEBP',),
+    'QUALITY': 80,
+    # Run generation on a thread pool after commit; False generates inline.
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+MIME_TYPES = {'WEBP': 'image/webp', 'AVIF': 'image/avif', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+# Formats without an alpha channel; transparent sources are flattened onto white.
+OPAQUE_FORMATS = {'JPEG'}
+# Formats whose encoder takes a lossy ``quality``; PNG is lossless.
+LOSSY_FORMATS = {'WEBP', 'AVIF', 'JPEG'}
+
+
+# Sent with the model as sender once a row's image_meta is recorded. That
+# write is a queryset update(), so post_save doesn't fire for it.
+variants_generated = Signal()
+
+
+def get_image_settings():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_VARIANTS', {})}
+
+
+def encodable_formats():
+    formats = []
+    for fmt in get_image_settings()['FORMATS']:
+        if fmt in ('WEBP', 'AVIF') and not features.check(fmt.lower()):
+            logger.warning("Pillow can't encode %s here; skipping those variants", fmt)
+            continue
+        formats.append(fmt)
+    return formats
+
+
+def variant_name(source_name, width, fmt):
+    """``post_images/a.jpg`` -> ``post_images/variants/a-640w.webp``."""
+    folder, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, 'variants', f'{stem}-{width}w.{fmt.lower()}')
+
+
+def build_variants(field_file):
+    """
+    Render every configured width and format of ``field_file`` into its
+    storage and return the metadata stored in ``image_meta``.
+    """
+    conf = get_image_settings()
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    width, height = image.size
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    variants = []
+    for fmt in encodable_formats():
+        source = image
+        if fmt in OPAQUE_FORMATS and image.mode == 'RGBA':
+            source = Image.new('RGB', image.size, 'white')
+            source.paste(image, mask=image.getchannel('A'))
+        options = {'quality': conf['QUALITY']} if fmt in LOSSY_FORMATS else {'optimize': True}
+        for target in sorted(set(conf['WIDTHS'])):
+            if target >= width:
+                continue
+            resized = source.resize((target, max(round(height * target / width), 1)), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, fmt, **options)
+            name = variant_name(field_file.name, target, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(buffer.getvalue()))
+            variants.append({'name': name, 'width': resized.width, 'height': resized.height, 'type': MIME_TYPES.get(fmt, '')})
+    return {'source': field_file.name, 'width': width, 'height': height, 'variants': variants}
+
+
+def needs_variants(instance, field='image'):
+    image = getattr(instance, field)
+    meta = instance.image_meta or {}
+    return bool(image) and meta.get('source') != image.name
+
+
+def delete_variants(storage, meta, keep=()):
+    for variant in (meta or {}).get('variants', ()):
+        if variant['name'] not in keep:
+            try:
+                storage.delete(variant['name'])
+            except OSError:
+                logger.warning("Couldn't delete image variant %s", variant['name'])
+
+
+def generate(model, pk, field='image'):
+    """
+    Build variants for one row and record them, unless the row's image
+    changed again (or the row went away) while the job was running.
+    """
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None or not needs_variants(instance, field):
+        return None
+    field_file = getattr(instance, field)
+    meta = build_variants(field_file)
+    changes = {'image_meta': meta}
+    if any(f.name == 'updated_at' for f in model._meta.concrete_fields):
+        # Moves the ETag/Last-Modified the conditional GETs are built from.
+        changes['updated_at'] = timezone.now()
+    updated = model._default_manager.filter(pk=pk, **{field: field_file.name}).update(**changes)
+    if updated:
+        delete_variants(field_file.storage, instance.image_meta, keep={v['name'] for v in meta['variants']})
+        variants_generated.send(sender=model, pk=pk, meta=meta)
+    else:
+        delete_variants(field_file.storage, meta)
+    return meta
+
+
+class VariantWorker:
+    """Thread pool that renders image variants off the request thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=get_image_settings()['WORKERS'], thread_name_prefix='image-variants',
+                )
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def submit(self, model, pk, field='image'):
+        if not get_image_settings()['ASYNC']:
+            return generate(model, pk, field)
+        transaction.on_commit(lambda: self._pool().submit(self._run, model, pk, field))
+
+    def _run(self, model, pk, field):
+        close_old_connections()
+        try:
+            generate(model, pk, field)
+        except Exception:
+            logger.exception("Image variant generation failed for %s %s", model.__name__, pk)
+        finally:
+            close_old_connections()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+variant_worker = VariantWorker()
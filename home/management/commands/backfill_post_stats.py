@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home.models import PostStats
+
+
+class Command(BaseCommand):
+    help = "Create the missing PostStats row for every post that has none (one anti-join, batched inserts)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows inserted per statement.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        started = time.monotonic()
+        created = PostStats.objects.create_missing(batch_size=options['batch_size'])
+        self.stderr.write(self.style.SUCCESS(
+            f"Created {created} PostStats rows in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+PASSWORD = 'correct horse battery staple 42'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password verifications (the CPU cost of a login) per second "
+        "and per core for Django's stock PBKDF2 and for each configured "
+        "hasher that can run here."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3.0, help="How long to run each hasher.")
+        parser.add_argument('--threads', type=int, default=None, help="Concurrent logins (default: one per CPU).")
+
+    def handle(self, *args, **options):
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+        threads = options['threads'] or cores
+        self.stdout.write(f"{cores} cores, {threads} threads, {options['seconds']:.0f}s per hasher")
+        self.stdout.write(f"{'hasher':<62} {'logins/s':>9} {'per core':>9} {'latency ms':>10}")
+
+        candidates = [('before: django PBKDF2 (default)', PBKDF2PasswordHasher())]
+        for path in settings.PASSWORD_HASHERS:
+            hasher = import_string(path)()
+            try:
+                # Only probes that the hasher's backend is installed.
+                hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as exc:
+                # Argon2 without argon2-cffi, for one.
+                self.stderr.write(self.style.WARNING(f"Skipping {path}: {exc}"))
+                continue
+            candidates.append((f"{'after' if path == settings.PASSWORD_HASHERS[0] else 'also'}: {path}", hasher))
+
+        baseline = None
+        for label, hasher in candidates:
+            rate = self.measure(hasher, threads, options['seconds'])
+            baseline = baseline or rate
+            self.stdout.write(
+                f"{label:<62} {rate:>9.1f} {rate / min(threads, cores):>9.1f} {1000 * threads / rate:>10.1f}"
+                f"  (x{rate / baseline:.1f})"
+            )
+
+    def measure(self, hasher, threads, seconds):
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+        assert hasher.verify(PASSWORD, encoded)
+        counts = [0] * threads
+        deadline = time.perf_counter() + seconds
+
+        def run(slot):
+            while time.perf_counter() < deadline:
+                hasher.verify(PASSWORD, encoded)
+                counts[slot] += 1
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=run, args=(slot,)) for slot in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return sum(counts) / (time.perf_counter() - started)
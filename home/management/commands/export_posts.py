@@ -0,0 +1,63 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.models import Post
+
+EXPORT_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'content': 'content',
+    'status': 'status',
+    'tags': 'tags',
+    'image': 'image',
+    'category': 'category__slug',
+    'author': 'author__email',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class Command(BaseCommand):
+    help = "Stream every post to a JSONL file (one JSON object per line) in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows fetched per database round trip.")
+        parser.add_argument('--status', choices=[choice for choice, _ in Post.STATUS_CHOICES], help="Only export posts with this status.")
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.order_by('pk')
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+        rows = queryset.values(*EXPORT_FIELDS.values()).iterator(chunk_size=options['batch_size'])
+
+        out = sys.stdout if options['path'] == '-' else open(options['path'], 'w', encoding='utf-8')
+        started = time.monotonic()
+        count = 0
+        try:
+            for row in rows:
+                record = {key: row[source] for key, source in EXPORT_FIELDS.items()}
+                out.write(json.dumps(record, default=_default, ensure_ascii=False))
+                out.write('\n')
+                count += 1
+                if count % options['batch_size'] == 0:
+                    self._progress(count, started)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        self._progress(count, started, done=True)
+
+    def _progress(self, count, started, done=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        message = f"{'Exported' if done else 'Exporting'}: {count} posts in {elapsed:.1f}s ({count / elapsed:.0f} rows/s)"
+        self.stderr.write(self.style.SUCCESS(message) if done else message)
@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home.models import Post, PostCategory
+
+MODELS = (Post, PostCategory)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete content-addressed media blobs that no post or category image "
+        "(or image variant) refers to. With --adopt, first move images saved "
+        "under their old upload names into the blob store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be removed without deleting anything.")
+        parser.add_argument('--grace', type=int, default=3600, help="Keep unreferenced blobs younger than this many seconds (uploads not yet committed).")
+        parser.add_argument('--adopt', action='store_true', help="Re-store legacy (non-blob) image files as blobs and repoint the rows.")
+
+    def handle(self, *args, **options):
+        self.storage = Post._meta.get_field('image').storage
+        if not hasattr(self.storage, 'iter_blobs'):
+            raise CommandError("The image storage isn't content-addressed; check STORAGES['default'].")
+        started = time.monotonic()
+        if options['adopt']:
+            self.adopt(dry_run=options['dry_run'])
+
+        referenced = self.referenced_names()
+        cutoff = time.time() - options['grace']
+        kept = removed = freed = 0
+        for name, size, mtime in self.storage.iter_blobs():
+            if name in referenced or mtime > cutoff:
+                kept += 1
+                continue
+            if not options['dry_run']:
+                self.storage.purge(name)
+            removed += 1
+            freed += size
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stderr.write(self.style.SUCCESS(
+            f"{verb} {removed} blobs ({freed / 1024 / 1024:.1f} MiB), kept {kept}, "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
+
+    def referenced_names(self):
+        names = set()
+        for model in MODELS:
+            for image, meta in model.objects.exclude(image='').values_list('image', 'image_meta').iterator():
+                if image:
+                    names.add(image)
+                names.update(variant['name'] for variant in (meta or {}).get('variants', ()))
+        return names
+
+    def adopt(self, dry_run=False):
+        """Copy each legacy file into the blob store once and repoint every row using it."""
+        moved = {}
+        rows = 0
+        for model in MODELS:
+            for pk, image, meta in model.objects.exclude(image='').values_list('pk', 'image', 'image_meta').iterator():
+                meta = dict(meta or {})
+                new_image = self.adopt_file(image, moved, dry_run)
+                variants = [
+                    {**variant, 'name': self.adopt_file(variant['name'], moved, dry_run)}
+                    for variant in meta.get('variants', ())
+                ]
+                if new_image == image and all(v['name'] == o['name'] for v, o in zip(variants, meta.get('variants', ()))):
+                    continue
+                if meta:
+                    meta['variants'] = variants
+                    if meta.get('source') == image:
+                        meta['source'] = new_image
+                rows += 1
+                if not dry_run:
+                    model.objects.filter(pk=pk, image=image).update(image=new_image, image_meta=meta)
+
+        if not dry_run:
+            for old in moved:
+                self.storage.delete(old)
+        verb = "Would adopt" if dry_run else "Adopted"
+        self.stderr.write(f"{verb} {len(moved)} legacy files into {len(set(moved.values()))} blobs across {rows} rows")
+
+    def adopt_file(self, name, moved, dry_run):
+        if not name or self.storage.is_blob(name):
+            return name
+        if name not in moved:
+            if not self.storage.exists(name):
+                self.stderr.write(self.style.WARNING(f"Missing file {name}, left as is"))
+                return name
+            with self.storage.open(name, 'rb') as content:
+                moved[name] = self.storage.blob_name_for(content, name) if dry_run else self.storage.save(name, content)
+        return moved[name]
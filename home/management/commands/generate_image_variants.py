@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.images import generate
+from home.models import Post, PostCategory
+
+
+class Command(BaseCommand):
+    help = "Render resized variants for post and category images that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Re-render variants that already exist (e.g. after changing IMAGE_VARIANTS).")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = failed = 0
+        for model in (PostCategory, Post):
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True)
+            if options['force']:
+                queryset.update(image_meta={})
+            for pk in queryset.values_list('pk', flat=True).iterator():
+                try:
+                    if generate(model, pk) is not None:
+                        done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(self.style.WARNING(f"{model.__name__} {pk}: {e}"))
+        self.stderr.write(self.style.SUCCESS(
+            f"Rendered variants for {done} images ({failed} failed) in {time.monotonic() - started:.1f}s"
+        ))
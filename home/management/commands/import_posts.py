@@ -0,0 +1,201 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from home import search
+from home.cache import invalidate
+from home.models import ActivityLog, CustomUser, Post, PostCategory, PostStats, PostTag
+from home.rollups import roll_up
+from home.slugs import allocate_slugs
+from home.tags import format_tags, parse_tags
+
+STATUSES = {choice for choice, _ in Post.STATUS_CHOICES}
+
+# Times a batch is retried when a concurrent writer takes one of its slugs.
+SLUG_ATTEMPTS = 5
+
+
+def parse_timestamp(record, key):
+    """``record[key]`` as an aware datetime, or None if absent; ValueError if malformed."""
+    value = record.get(key)
+    if not value:
+        return None
+    moment = parse_datetime(value) if isinstance(value, str) else None
+    if moment is None:
+        raise ValueError(f"{key} is not a datetime: {value!r}")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream posts from a JSONL file (the export_posts format) into the database "
+        "with bulk inserts. PostStats rows, tag links and CREATE_POST activity "
+        "entries are created per batch instead of through per-row save() signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Posts inserted per transaction.")
+        parser.add_argument('--skip-activity', action='store_true', help="Don't write CREATE_POST activity entries.")
+        parser.add_argument('--create-categories', action='store_true', help="Create categories that don't exist yet instead of leaving the post uncategorized.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        self.options = options
+        self.authors = {}
+        self.categories = {}
+        self.imported = self.skipped = 0
+        self.started = time.monotonic()
+
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        batch = []
+        try:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("not a JSON object")
+                    if not record.get('title') or 'content' not in record:
+                        raise ValueError("title and content are required")
+                    record['created_at'] = parse_timestamp(record, 'created_at')
+                    record['updated_at'] = parse_timestamp(record, 'updated_at')
+                except ValueError as e:
+                    self.skipped += 1
+                    self.stderr.write(self.style.WARNING(f"Line {line_number}: skipped ({e})"))
+                    continue
+                batch.append(record)
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        if self.imported:
+            invalidate('posts', 'tags')
+            search.mark_stale()
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stderr.write(self.style.SUCCESS(
+            f"Imported {self.imported} posts ({self.skipped} skipped) in {elapsed:.1f}s "
+            f"({self.imported / elapsed:.0f} rows/s)"
+        ))
+
+    def import_batch(self, records):
+        self.resolve_authors(records)
+        self.resolve_categories(records)
+        now = timezone.now()
+        texts = [record.get('slug') or record['title'] for record in records]
+        slugs = allocate_slugs(Post, texts)
+
+        posts = []
+        timestamps = []
+        for record, slug in zip(records, slugs):
+            status = record.get('status') if record.get('status') in STATUSES else 'draft'
+            posts.append(Post(
+                title=record['title'][:255],
+                slug=slug,
+                content=record['content'],
+                status=status,
+                tags=format_tags(parse_tags(record.get('tags')), 255)[0],
+                image=record.get('image') or None,
+                category_id=self.categories.get(record.get('category')),
+                author_id=self.authors.get(record.get('author')),
+            ))
+            timestamps.append((record['created_at'], record['updated_at']))
+
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                self.insert(posts, timestamps, now)
+                break
+            except IntegrityError:
+                # Another writer may have taken some of the slugs since they
+                # were allocated; allocate them again and retry the batch.
+                taken = Post.objects.filter(slug__in=[post.slug for post in posts]).exists()
+                if not taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+                for post, slug in zip(posts, allocate_slugs(Post, texts)):
+                    post.pk = None
+                    post.slug = slug
+
+        self.imported += len(posts)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stderr.write(f"Importing: {self.imported} posts in {elapsed:.1f}s ({self.imported / elapsed:.0f} rows/s)")
+
+    def insert(self, posts, timestamps, now):
+        with transaction.atomic():
+            Post.objects.bulk_create(posts)
+            self.restore_timestamps(posts, timestamps)
+
+            stats = []
+            for post in posts:
+                iso_year, iso_week, _ = timezone.localtime(post.created_at).isocalendar()
+                stats.append(PostStats(post_id=post.pk, iso_year=iso_year, iso_week=iso_week))
+            PostStats.objects.bulk_create(stats)
+            PostTag.objects.attach(posts)
+
+            if not self.options['skip_activity']:
+                roll_up(ActivityLog.objects.bulk_create([
+                    ActivityLog(user_id=post.author_id, post_id=post.pk, action='CREATE_POST', created_at=now)
+                    for post in posts
+                ]))
+
+    def restore_timestamps(self, posts, timestamps):
+        """
+        auto_now/auto_now_add overwrite timestamps on insert, so put exported
+        ones back. A plain executemany UPDATE keeps this linear; bulk_update's
+        CASE expression grows quadratically with the batch.
+        """
+        created_field = Post._meta.get_field('created_at')
+        updated_field = Post._meta.get_field('updated_at')
+        params = []
+        for post, (created_at, updated_at) in zip(posts, timestamps):
+            if created_at or updated_at:
+                post.created_at = created_at or post.created_at
+                post.updated_at = updated_at or post.updated_at
+                params.append((
+                    created_field.get_db_prep_value(post.created_at, connection),
+                    updated_field.get_db_prep_value(post.updated_at, connection),
+                    post.pk,
+                ))
+        if not params:
+            return
+        qn = connection.ops.quote_name
+        sql = (
+            f"UPDATE {qn(Post._meta.db_table)} SET {qn(created_field.column)} = %s, "
+            f"{qn(updated_field.column)} = %s WHERE {qn(Post._meta.pk.column)} = %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    def resolve_authors(self, records):
+        emails = {record.get('author') for record in records} - set(self.authors) - {None, ''}
+        if emails:
+            found = dict(CustomUser.objects.filter(email__in=emails).values_list('email', 'id'))
+            for email in emails:
+                self.authors[email] = found.get(email)
+
+    def resolve_categories(self, records):
+        keys = {record.get('category') for record in records} - set(self.categories) - {None, ''}
+        if not keys:
+            return
+        for slug, pk in PostCategory.objects.filter(slug__in=keys).values_list('slug', 'id'):
+            self.categories[slug] = pk
+        missing = keys - set(self.categories)
+        if missing:
+            for name, pk in PostCategory.objects.filter(name__in=missing).values_list('name', 'id'):
+                self.categories.setdefault(name, pk)
+        for key in keys - set(self.categories):
+            if self.options['create_categories']:
+                self.categories[key] = PostCategory.objects.create(name=key).pk
+            else:
+                self.categories[key] = None
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from home.cache import get_cache_settings
+from home.models import Post, PostCategory
+
+MODES = ('sync', 'async')
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the public read endpoints through the ASGI application, "
+        "in-process, once through the DRF views and once through the async "
+        "views (ASYNC_PUBLIC_READS), and report throughput and p50/p99 latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="URL paths to hit (default: the endpoints with async views).")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint and mode.")
+        parser.add_argument('--concurrency', type=int, default=32, help="Requests in flight at once.")
+        parser.add_argument('--no-cache', action='store_true', help="Bypass the response cache, so every request queries the database.")
+
+    def handle(self, *args, **options):
+        if not settings.ASYNC_PUBLIC_READS:
+            # The hybrid views are only routed when it is on at startup.
+            raise CommandError("Run with DJANGO_ASYNC_PUBLIC_READS=1 so the async views are routed.")
+        paths = options['paths'] or self.default_paths()
+        app = get_asgi_application()
+        response_cache = get_cache_settings()
+        if options['no_cache']:
+            response_cache['TIMEOUT'] = 0
+
+        self.stdout.write(f"{'endpoint':<44} {'mode':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for path in paths:
+            results = {}
+            for mode in MODES:
+                with override_settings(ASYNC_PUBLIC_READS=mode == 'async', RESPONSE_CACHE=response_cache):
+                    # Fresh throttle history and response cache for each run.
+                    caches[response_cache['ALIAS']].clear()
+                    results[mode] = asyncio.run(self.run(app, path, options['requests'], options['concurrency']))
+                rate, p50, p99, errors = results[mode]
+                self.stdout.write(f"{path:<44} {mode:<6} {rate:>8.0f} {p50:>8.2f} {p99:>8.2f} {errors:>7}")
+            sync, async_ = results['sync'], results['async']
+            self.stdout.write(
+                f"{'':<44} async/sync throughput x{async_[0] / sync[0]:.2f}, p99 x{async_[2] / sync[2]:.2f}"
+            )
+
+    def default_paths(self):
+        post = Post.objects.filter(status='publish').order_by('-created_at').values_list('pk', flat=True).first()
+        category = PostCategory.objects.values_list('pk', flat=True).first()
+        if post is None or category is None:
+            raise CommandError("Needs at least one published post and one category to request.")
+        return [
+            reverse('post-list'),
+            reverse('post-detail', args=[post]),
+            reverse('post-discussion', args=[post]),
+            reverse('category-list'),
+            reverse('category-detail', args=[category]),
+            reverse('poststats-post-of-the-week'),
+        ]
+
+    async def run(self, app, path, total, concurrency):
+        path, _, query = path.partition('?')
+        latencies = []
+        errors = 0
+        issued = 0
+
+        async def worker():
+            nonlocal errors, issued
+            while issued < total:
+                # Spread the load over a few clients so the anonymous
+                # throttles stay out of the way, as with real traffic.
+                client = f'10.0.0.{issued % 64}'
+                issued += 1
+                started = time.perf_counter()
+                status = await self.request(app, path, query, client)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors += 1
+
+        # One request per worker first, so neither mode pays for warming up.
+        await asyncio.gather(*(self.request(app, path, query, '10.0.1.0') for _ in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+        return len(latencies) / elapsed, p50, p99, errors
+
+    async def request(self, app, path, query, client):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'accept', b'application/json')],
+            'client': (client, 40000),
+            'server': ('localhost', 80),
+        }
+        finished = asyncio.Event()
+        received = False
+        status = None
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Django listens for a disconnect while the view runs.
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                finished.set()
+
+        await app(scope, receive, send)
+        return status
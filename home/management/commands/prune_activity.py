@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from home.models import ActivityDaily, ActivityHourly, ActivityLog
+from home.rollups import day_bucket, day_start, get_retention_settings
+
+ARCHIVED_FIELDS = ('id', 'created_at', 'action', 'user_id', 'post_id', 'comment_id', 'ip_address', 'time_spent', 'count')
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete ActivityLog rows older than the retention window one UTC day "
+        "at a time, in short batches, optionally archiving them first. Their "
+        "counts stay in the hourly/daily rollups, which are trimmed too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Keep this many days of raw rows (default: RAW_DAYS).")
+        parser.add_argument('--archive', metavar='DIR', help="Append each day's rows to DIR/activitylog-<day>.jsonl.gz before deleting them.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0, help="Seconds to pause between batches, to let other writers in.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        conf = get_retention_settings()
+        if options['archive'] and not os.path.isdir(options['archive']):
+            raise CommandError(f"Archive directory {options['archive']} does not exist")
+        today = day_bucket(timezone.now())
+        days = conf['RAW_DAYS'] if options['days'] is None else options['days']
+        cutoff = today - timedelta(days=days)
+
+        if options['dry_run']:
+            raw = ActivityLog.objects.filter(created_at__lt=day_start(cutoff)).count()
+            self.stdout.write(f"Would delete {raw} activity log rows from before {cutoff}")
+            for model, keep in ((ActivityHourly, conf['HOURLY_DAYS']), (ActivityDaily, conf['DAILY_DAYS'])):
+                if keep is not None:
+                    stale = model.objects.filter(bucket__lt=self.bucket_cutoff(model, today - timedelta(days=keep))).count()
+                    self.stdout.write(f"Would delete {stale} {model._meta.verbose_name} rows")
+            return
+
+        deleted = batches = 0
+        oldest = ActivityLog.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        day = day_bucket(oldest) if oldest else cutoff
+        while day < cutoff:
+            # A day at a time keeps each scan on a narrow created_at range
+            # and gives the archive one file per day.
+            rows = ActivityLog.objects.filter(created_at__gte=day_start(day), created_at__lt=day_start(day + timedelta(days=1)))
+            last_id = 0
+            while True:
+                batch = list(rows.filter(id__gt=last_id).order_by('id').values(*ARCHIVED_FIELDS)[:options['batch_size']])
+                if not batch:
+                    break
+                if options['archive']:
+                    self.archive(options['archive'], day, batch)
+                ids = [row['id'] for row in batch]
+                with transaction.atomic():
+                    deleted += ActivityLog.objects.filter(id__in=ids).delete()[0]
+                batches += 1
+                last_id = ids[-1]
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            day += timedelta(days=1)
+
+        rollups = 0
+        for model, keep in ((ActivityHourly, conf['HOURLY_DAYS']), (ActivityDaily, conf['DAILY_DAYS'])):
+            if keep is not None:
+                rollups += self.prune_rollups(model, self.bucket_cutoff(model, today - timedelta(days=keep)), options)
+
+        self.stderr.write(self.style.SUCCESS(
+            f"Deleted {deleted} activity log rows from before {cutoff} in {batches} batches "
+            f"and {rollups} rollup rows, {time.monotonic() - started:.1f}s"
+        ))
+
+    def bucket_cutoff(self, model, day):
+        return day if model is ActivityDaily else day_start(day)
+
+    def prune_rollups(self, model, cutoff, options):
+        deleted = 0
+        while True:
+            ids = list(model.objects.filter(bucket__lt=cutoff).values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                return deleted
+            with transaction.atomic():
+                deleted += model.objects.filter(id__in=ids).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+    def archive(self, directory, day, rows):
+        # Appending adds a gzip member per batch; readers see one stream.
+        path = os.path.join(directory, f'activitylog-{day:%Y-%m-%d}.jsonl.gz')
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in rows:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
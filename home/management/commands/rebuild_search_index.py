@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the post search index from the posts table. The FTS5 index is "
+        "kept current by triggers, so this is only needed after writing to "
+        "home_post behind SQLite's back (a restored dump, a schema change)."
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        backend = search.rebuild()
+        self.stderr.write(self.style.SUCCESS(f"Rebuilt {backend} search index in {time.monotonic() - started:.1f}s"))
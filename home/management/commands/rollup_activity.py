@@ -0,0 +1,37 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from home.models import ActivityLog
+from home.rollups import day_bucket, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the hourly/daily ActivityLog rollups from the raw log for a "
+        "range of UTC days. The writer keeps them current; this repairs them "
+        "after a bulk load or manual edits to the log."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help="First day, YYYY-MM-DD (default: oldest logged day).")
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day, YYYY-MM-DD (default: today).")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        since = options['since']
+        if since is None:
+            oldest = ActivityLog.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if oldest is None:
+                self.stdout.write("No activity logged")
+                return
+            since = day_bucket(oldest)
+        until = options['until'] or day_bucket(timezone.now())
+        if since > until:
+            raise CommandError(f"--since {since} is after --until {until}")
+        rows = rebuild(since, until)
+        self.stderr.write(self.style.SUCCESS(
+            f"Rebuilt {(until - since).days + 1} days of rollups ({rows} rows), {time.monotonic() - started:.1f}s"
+        ))
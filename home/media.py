@@ -0,0 +1,162 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+DEFAULTS = {
+    # Cache lifetime for files whose name doesn't pin their content.
+    'MAX_AGE': 86400,
+    # Content-addressed blobs never change under the same name.
+    'IMMUTABLE_MAX_AGE': 31536000,
+    # Hand the body off to the front server instead of streaming it from
+    # Python: an internal location prefix for nginx's X-Accel-Redirect, or
+    # True to send X-Sendfile (Apache mod_xsendfile, lighttpd).
+    'ACCEL_REDIRECT': None,
+    'SENDFILE': False,
+    'CHUNK_SIZE': 64 * 1024,
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOB_RE = re.compile(r'^blobs/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+
+
+def get_media_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+def make_etag(path, st):
+    # A blob's name is its content hash, which is the best validator there is;
+    # other files get one from size and mtime, without reading them.
+    blob = BLOB_RE.match(path)
+    if blob:
+        return f'"{blob.group(1)}"'
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    The ``(start, end)`` (inclusive) of a single-range ``Range`` header;
+    None to send the whole file (no header, or a form we don't serve, like
+    multiple ranges); ``False`` if the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or (last and int(last) < start):
+            return False
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        start, end = max(size - suffix, 0), size - 1
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def read_range(path, start, length, chunk_size):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT.
+
+    Validators come from ``stat()`` (or the blob hash in the name), so
+    conditional requests are answered with a 304 before the file is opened.
+    Single byte ranges are honoured; full bodies go out through
+    ``FileResponse``, which WSGI servers turn into ``sendfile()``, or are
+    delegated to the front server when ACCEL_REDIRECT / SENDFILE is set.
+    """
+    conf = get_media_settings()
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, ValueError, OSError):
+        raise Http404("File not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("File not found")
+
+    etag = make_etag(path, st)
+    last_modified = int(st.st_mtime)
+    immutable = BLOB_RE.match(path) is not None
+    if immutable:
+        cache_control = f"public, max-age={conf['IMMUTABLE_MAX_AGE']}, immutable"
+    else:
+        cache_control = f"public, max-age={conf['MAX_AGE']}"
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build_response(request, path, fullpath, st, etag, last_modified, conf)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def build_response(request, path, fullpath, st, etag, last_modified, conf):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    size = st.st_size
+
+    byte_range = None
+    if request.method == 'GET' and if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if conf['ACCEL_REDIRECT'] or conf['SENDFILE']:
+        # The front server reads the file and handles Range itself.
+        response = HttpResponse(content_type=content_type)
+        if conf['ACCEL_REDIRECT']:
+            response['X-Accel-Redirect'] = conf['ACCEL_REDIRECT'].rstrip('/') + '/' + quote(path)
+        else:
+            response['X-Sendfile'] = fullpath
+        return response
+
+    if byte_range is not None:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            read_range(fullpath, start, length, conf['CHUNK_SIZE']), status=206, content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_activitylog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['-created_at', '-id'], name='home_activity_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created_at', '-id'], name='home_comment_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='home_post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['-created_at', '-id'], name='home_reply_created_id_idx'),
+        ),
+    ]
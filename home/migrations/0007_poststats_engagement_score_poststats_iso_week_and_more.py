@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:57
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def populate_leaderboard(apps, schema_editor):
+    PostStats = apps.get_model('home', 'PostStats')
+    PostStats.objects.update(
+        engagement_score=0.2 * F('views') + 0.3 * F('likes') + 0.3 * F('comments') + 0.2 * F('shares')
+    )
+    batch = []
+    for stats in PostStats.objects.select_related('post').only('id', 'post__created_at').iterator(chunk_size=2000):
+        stats.iso_year, stats.iso_week, _ = timezone.localtime(stats.post.created_at).isocalendar()
+        batch.append(stats)
+        if len(batch) >= 2000:
+            PostStats.objects.bulk_update(batch, ['iso_year', 'iso_week'])
+            batch = []
+    if batch:
+        PostStats.objects.bulk_update(batch, ['iso_year', 'iso_week'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0006_alter_activitylog_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poststats',
+            name='engagement_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='poststats',
+            name='iso_week',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='poststats',
+            name='iso_year',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='poststats',
+            index=models.Index(fields=['-engagement_score', '-id'], name='home_stats_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='poststats',
+            index=models.Index(fields=['iso_year', 'iso_week', '-engagement_score', '-id'], name='home_stats_week_score_idx'),
+        ),
+        migrations.RunPython(populate_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# External content FTS5 table over home_post: the index lives here, the text
+# stays in home_post. The triggers keep it in step with every write,
+# including bulk_create() and queryset.update(), which skip model signals.
+FORWARD = [
+    """
+    CREATE VIRTUAL TABLE home_post_fts USING fts5(
+        title, content, tags,
+        content='home_post', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER home_post_fts_insert AFTER INSERT ON home_post BEGIN
+        INSERT INTO home_post_fts(rowid, title, content, tags)
+        VALUES (new.id, new.title, new.content, new.tags);
+    END
+    """,
+    """
+    CREATE TRIGGER home_post_fts_delete AFTER DELETE ON home_post BEGIN
+        INSERT INTO home_post_fts(home_post_fts, rowid, title, content, tags)
+        VALUES ('delete', old.id, old.title, old.content, old.tags);
+    END
+    """,
+    """
+    CREATE TRIGGER home_post_fts_update AFTER UPDATE OF title, content, tags ON home_post BEGIN
+        INSERT INTO home_post_fts(home_post_fts, rowid, title, content, tags)
+        VALUES ('delete', old.id, old.title, old.content, old.tags);
+        INSERT INTO home_post_fts(rowid, title, content, tags)
+        VALUES (new.id, new.title, new.content, new.tags);
+    END
+    """,
+    "INSERT INTO home_post_fts(home_post_fts) VALUES ('rebuild')",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS home_post_fts_update",
+    "DROP TRIGGER IF EXISTS home_post_fts_delete",
+    "DROP TRIGGER IF EXISTS home_post_fts_insert",
+    "DROP TABLE IF EXISTS home_post_fts",
+]
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_index(apps, schema_editor):
+    # Other backends (and SQLite builds without FTS5) use the in-memory
+    # index in home/search.py instead.
+    if fts5_supported(schema_editor.connection):
+        for statement in FORWARD:
+            schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in BACKWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_comment_updated_at_reply_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
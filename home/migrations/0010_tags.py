@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:16
+
+import django.db.models.deletion
+import re
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def parse_tags(value):
+    # Same rules as home.tags.parse_tags at the time of writing.
+    seen = {}
+    for raw in (value or '').split(','):
+        name = re.sub(r'\s+', ' ', raw).strip()[:50]
+        slug = slugify(name)[:50]
+        if slug and slug not in seen:
+            seen[slug] = name
+    return list(seen.items())
+
+
+def populate_tags(apps, schema_editor):
+    Post = apps.get_model('home', 'Post')
+    Tag = apps.get_model('home', 'Tag')
+    PostTag = apps.get_model('home', 'PostTag')
+
+    tag_ids = {}
+    counts = {}
+    rows = []
+    changed = []
+    for post in Post.objects.only('id', 'tags', 'status').iterator(chunk_size=2000):
+        tags = parse_tags(post.tags)
+        canonical = ', '.join(name for _, name in tags)
+        if len(canonical) <= 255 and canonical != post.tags:
+            post.tags = canonical
+            changed.append(post)
+        for slug, name in tags:
+            if slug not in tag_ids:
+                tag_ids[slug] = Tag.objects.create(slug=slug, name=name).pk
+            rows.append(PostTag(post_id=post.pk, tag_id=tag_ids[slug]))
+            if post.status == 'publish':
+                counts[tag_ids[slug]] = counts.get(tag_ids[slug], 0) + 1
+        if len(rows) >= 2000:
+            PostTag.objects.bulk_create(rows)
+            rows = []
+    PostTag.objects.bulk_create(rows)
+    Post.objects.bulk_update(changed, ['tags'], batch_size=500)
+    for tag_id, count in counts.items():
+        Tag.objects.filter(pk=tag_id).update(post_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0009_post_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(unique=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-post_count', 'slug'], name='home_tag_count_slug_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='home.post')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='home.tag')),
+            ],
+        ),
+        # State only: the through table already exists and the M2M has no
+        # column, but on SQLite a real AddField rebuilds home_post, which
+        # drops the FTS5 triggers from 0009.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='post',
+                    name='tag_set',
+                    field=models.ManyToManyField(blank=True, related_name='posts', through='home.PostTag', to='home.tag'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', 'post'], name='home_posttag_tag_post_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('post', 'tag'), name='home_posttag_unique'),
+        ),
+        migrations.RunPython(populate_tags, migrations.RunPython.noop),
+    ]
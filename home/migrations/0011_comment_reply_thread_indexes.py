@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_tags'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='reply',
+            options={'ordering': ['created_at', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at', 'id'], name='home_comment_post_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['comment', 'created_at', 'id'], name='home_reply_comment_thread_idx'),
+        ),
+    ]
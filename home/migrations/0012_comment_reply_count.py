@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:19
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, column, outer='pk'):
+    counted = (
+        model.objects.filter(**{column: OuterRef(outer)})
+        .order_by().values(column).annotate(n=Count('pk')).values('n')
+    )
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    # Replies get their own PostStats counter; comments counts top-level
+    # comments only, so the score is recomputed from the recounted value.
+    Comment = apps.get_model('home', 'Comment')
+    Reply = apps.get_model('home', 'Reply')
+    PostStats = apps.get_model('home', 'PostStats')
+    Comment.objects.update(reply_count=_count(Reply, 'comment'))
+    PostStats.objects.update(
+        comments=_count(Comment, 'post', 'post_id'),
+        replies=_count(Reply, 'comment__post', 'post_id'),
+    )
+    PostStats.objects.update(
+        engagement_score=0.2 * F('views') + 0.3 * F('likes') + 0.3 * F('comments') + 0.2 * F('shares')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_comment_reply_thread_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='poststats',
+            name='replies',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_stats(apps, schema_editor):
+    """
+    Fold duplicate PostStats rows into the oldest one per post before the
+    unique constraint goes on. Views and shares were buffered per row, so
+    they are summed; comment and reply bumps updated every row of the post,
+    so the largest value is kept; likes are rebuilt from the merged liked_by.
+    """
+    PostStats = apps.get_model('home', 'PostStats')
+    duplicated = (
+        PostStats.objects.values('post_id').annotate(rows=Count('id'), keep=Min('id')).filter(rows__gt=1)
+    )
+    for group in duplicated:
+        rows = list(PostStats.objects.filter(post_id=group['post_id']).order_by('id'))
+        keep, extra = rows[0], rows[1:]
+        keep.views = sum(row.views for row in rows)
+        keep.shares = sum(row.shares for row in rows)
+        keep.comments = max(row.comments for row in rows)
+        keep.replies = max(row.replies for row in rows)
+        for row in extra:
+            keep.liked_by.add(*row.liked_by.all())
+        keep.likes = keep.liked_by.count()
+        keep.engagement_score = 0.2 * keep.views + 0.3 * keep.likes + 0.3 * keep.comments + 0.2 * keep.shares
+        keep.save()
+        PostStats.objects.filter(id__in=[row.id for row in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stats, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='poststats',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='home.post'),
+        ),
+        migrations.AddConstraint(
+            model_name='poststats',
+            constraint=models.UniqueConstraint(fields=('post',), name='home_poststats_one_per_post'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_poststats_one_per_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcategory',
+            name='image_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:51
+
+import django.db.models.deletion
+from django.conf import settings
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate, TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Count the existing log into the hourly and daily rollups; from here on
+    the ActivityLog writer keeps them current. Site-wide rows use post_id 0.
+    """
+    ActivityLog = apps.get_model('home', 'ActivityLog')
+    logs = ActivityLog.objects.order_by()
+    for name, trunc in (('ActivityHourly', TruncHour), ('ActivityDaily', TruncDate)):
+        model = apps.get_model('home', name)
+        bucketed = logs.annotate(bucket=trunc('created_at', tzinfo=timezone.utc))
+        rows = [
+            model(post_id=0, bucket=row['bucket'], action=row['action'], count=row['n'])
+            for row in bucketed.values('bucket', 'action').annotate(n=Count('id'))
+        ]
+        rows += [
+            model(post_id=row['post_id'], bucket=row['bucket'], action=row['action'], count=row['n'])
+            for row in bucketed.filter(post_id__isnull=False).values('post_id', 'bucket', 'action').annotate(n=Count('id'))
+        ]
+        model.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_image_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.PositiveIntegerField(default=0)),
+                ('action', models.CharField(choices=[('VIEW_POST', 'View Post'), ('LIKE_POST', 'Like Post'), ('COMMENT', 'Comment'), ('REPLY', 'Reply'), ('SHARE_POST', 'Share Post'), ('LOGIN', 'Login'), ('LOGOUT', 'Logout'), ('ADMIN_LOGIN', 'Admin Login'), ('CREATE_POST', 'Create Post'), ('EDIT_POST', 'Edit Post'), ('DELETE_POST', 'Delete Post'), ('SUBSCRIBE_NEWSLETTER', 'Subscribe to Newsletter'), ('CONTACT_SUBMISSION', 'Contact Form Submission')], max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('bucket', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ActivityHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.PositiveIntegerField(default=0)),
+                ('action', models.CharField(choices=[('VIEW_POST', 'View Post'), ('LIKE_POST', 'Like Post'), ('COMMENT', 'Comment'), ('REPLY', 'Reply'), ('SHARE_POST', 'Share Post'), ('LOGIN', 'Login'), ('LOGOUT', 'Logout'), ('ADMIN_LOGIN', 'Admin Login'), ('CREATE_POST', 'Create Post'), ('EDIT_POST', 'Edit Post'), ('DELETE_POST', 'Delete Post'), ('SUBSCRIBE_NEWSLETTER', 'Subscribe to Newsletter'), ('CONTACT_SUBMISSION', 'Contact Form Submission')], max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('bucket', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='post',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activity_logs', to='home.post'),
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activity_logs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['action', 'created_at'], name='home_activity_action_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['post', 'created_at'], name='home_activity_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['user', 'created_at'], name='home_activity_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activitydaily',
+            constraint=models.UniqueConstraint(fields=('post_id', 'bucket', 'action'), name='home_activity_daily_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityhourly',
+            constraint=models.UniqueConstraint(fields=('post_id', 'bucket', 'action'), name='home_activity_hourly_key'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
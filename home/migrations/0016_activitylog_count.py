@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_activity_indexes_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitylog',
+            name='count',
+            field=models.PositiveIntegerField(default=1, help_text='Events this row stands for, e.g. views since the last flush'),
+        ),
+    ]
@@ -1,10 +1,12 @@
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.utils.text import slugify
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.core import validators
 
+from .slugs import save_with_slug
+from .tags import TAG_MAX_LENGTH, format_tags, parse_tags
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -48,17 +50,12 @@ class PostCategory(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     image = models.ImageField(upload_to='category_images/', null=True, blank=True)
+    # Dimensions and resized variants of ``image``; filled in by home/images.py.
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            with transaction.atomic():
-                base_slug = slugify(self.name)
-                slug = base_slug
-                counter = 1
-                while PostCategory.objects.filter(slug=slug).exists():
-                    slug = f"{base_slug}-{counter}"
-                    counter += 1
-                self.slug = slug
+            return save_with_slug(self, self.name, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def clean(self):
@@ -71,6 +68,70 @@ class PostCategory(models.Model):
     def __str__(self):
         return self.name
 
+class TagQuerySet(models.QuerySet):
+    def ensure(self, tags):
+        """
+        Map each ``(slug, name)`` pair to a tag id, creating the tags that
+        don't exist yet. Costs one lookup, plus an insert and a re-read
+        when something is new.
+        """
+        wanted = {}
+        for slug, name in tags:
+            wanted.setdefault(slug, name)
+        if not wanted:
+            return {}
+        ids = dict(self.filter(slug__in=list(wanted)).values_list('slug', 'id'))
+        missing = [Tag(slug=slug, name=name) for slug, name in wanted.items() if slug not in ids]
+        if missing:
+            # ignore_conflicts: a concurrent writer may create the same tag.
+            self.bulk_create(missing, ignore_conflicts=True)
+            ids.update(self.filter(slug__in=[tag.slug for tag in missing]).values_list('slug', 'id'))
+        return ids
+
+    def adjust_counts(self, deltas):
+        """Apply ``{tag_id: delta}`` to post_count, one UPDATE per distinct delta."""
+        by_delta = {}
+        for tag_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(tag_id)
+        for delta, tag_ids in by_delta.items():
+            self.filter(pk__in=tag_ids).update(post_count=models.F('post_count') + delta)
+
+class Tag(models.Model):
+    name = models.CharField(max_length=TAG_MAX_LENGTH)
+    slug = models.SlugField(max_length=TAG_MAX_LENGTH, unique=True)
+    # Published posts carrying this tag, moved incrementally whenever a
+    # post's tags or status change, so a tag cloud is an index scan;
+    # repaired by `manage.py recount_stats`.
+    post_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TagQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count', 'slug'], name='home_tag_count_slug_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class PostQuerySet(models.QuerySet):
+    def tagged(self, slugs, match='all'):
+        """
+        Posts carrying all (or, with ``match='any'``, at least one) of the
+        tag ``slugs``. Resolves the slugs first, then filters through the
+        (tag, post) index of the through table.
+        """
+        slugs = set(slugs)
+        tag_ids = list(Tag.objects.filter(slug__in=slugs).values_list('id', flat=True))
+        if not tag_ids or (match == 'all' and len(tag_ids) < len(slugs)):
+            return self.none()
+        through = PostTag.objects.filter(tag_id__in=tag_ids)
+        if match == 'all' and len(tag_ids) > 1:
+            through = through.values('post_id').annotate(matched=models.Count('tag_id')).filter(matched=len(tag_ids))
+        return self.filter(pk__in=through.values('post_id'))
+
 class Post(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -82,22 +143,38 @@ class Post(models.Model):
     content = models.TextField()
     category = models.ForeignKey(PostCategory, on_delete=models.SET_NULL, null=True, blank=True)
     tags = models.CharField(max_length=255, blank=True, help_text="Enter tags separated by commas")
+    # Normalized copy of ``tags``; kept in step by save().
+    tag_set = models.ManyToManyField('Tag', through='PostTag', related_name='posts', blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
     image = models.ImageField(upload_to='post_images/', null=True, blank=True)
+    # Dimensions and resized variants of ``image``; filled in by home/images.py.
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
     author = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='posts')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='home_post_created_id_idx'),
+        ]
+
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'tags', 'status'} & set(update_fields):
+            return self._save_row(*args, **kwargs)
+        self.tags, tags = format_tags(parse_tags(self.tags), self._meta.get_field('tags').max_length)
+        with transaction.atomic():
+            previous_status = None
+            if not self._state.adding:
+                previous_status = Post.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+            self._save_row(*args, **kwargs)
+            PostTag.objects.sync(self, tags, previous_status)
+
+    def _save_row(self, *args, **kwargs):
         if not self.slug:
-            with transaction.atomic():
-                base_slug = slugify(self.title)
-                slug = base_slug
-                counter = 1
-                while Post.objects.filter(slug=slug).exists():
-                    slug = f"{base_slug}-{counter}"
-                    counter += 1
-                self.slug = slug
+            return save_with_slug(self, self.title, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def clean(self):
@@ -110,11 +187,86 @@ class Post(models.Model):
     def __str__(self):
         return self.title
 
+class PostTagQuerySet(models.QuerySet):
+    def sync(self, post, tags, previous_status=None):
+        """
+        Make ``post``'s through rows match the parsed ``tags`` and move each
+        affected tag's post_count by what changed: tags added or removed,
+        and the post entering or leaving the published state.
+        ``previous_status`` is None for a post that was just created.
+        """
+        new = set(Tag.objects.ensure(tags).values())
+        old = set()
+        if previous_status is not None:
+            old = set(self.filter(post=post).values_list('tag_id', flat=True))
+        if old - new:
+            self.filter(post=post, tag_id__in=old - new).delete()
+        if new - old:
+            self.bulk_create([PostTag(post=post, tag_id=tag_id) for tag_id in new - old], ignore_conflicts=True)
+        was_published = previous_status == 'publish'
+        is_published = post.status == 'publish'
+        Tag.objects.adjust_counts({
+            tag_id: int(is_published and tag_id in new) - int(was_published and tag_id in old)
+            for tag_id in old | new
+        })
+
+    def attach(self, posts):
+        """
+        Bulk variant of ``sync`` for freshly bulk-created posts (imports),
+        whose ``tags`` strings are already canonical.
+        """
+        parsed = [(post, parse_tags(post.tags)) for post in posts]
+        ids = Tag.objects.ensure(pair for _, tags in parsed for pair in tags)
+        rows = []
+        deltas = {}
+        for post, tags in parsed:
+            for slug, _ in tags:
+                rows.append(PostTag(post_id=post.pk, tag_id=ids[slug]))
+                if post.status == 'publish':
+                    deltas[ids[slug]] = deltas.get(ids[slug], 0) + 1
+        self.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+        Tag.objects.adjust_counts(deltas)
+
+    def release(self, post):
+        """Take a published post that is about to be deleted out of its tags' counts."""
+        if post.status == 'publish':
+            tag_ids = self.filter(post=post).values_list('tag_id', flat=True)
+            Tag.objects.adjust_counts({tag_id: -1 for tag_id in tag_ids})
+
+class PostTag(models.Model):
+    # Neither FK gets its own index: the unique (post, tag) constraint
+    # serves lookups by post, the (tag, post) index serves lookups by tag.
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags', db_index=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags', db_index=False)
+
+    objects = PostTagQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'tag'], name='home_posttag_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'post'], name='home_posttag_tag_post_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} on {self.post}"
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='comments', blank=True, null=True)
     content = models.TextField()
+    # Maintained by home/counters.py; repaired by `manage.py recount_stats`.
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='home_comment_created_id_idx'),
+            # A post's thread, oldest first (see PostViewset.discussion).
+            models.Index(fields=['post', 'created_at', 'id'], name='home_comment_post_thread_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.user.email} on {self.post.title}"
@@ -124,21 +276,179 @@ class Reply(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='replies', null=True, blank=True)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Chronological, so replies nested under a comment read as a thread.
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='home_reply_created_id_idx'),
+            models.Index(fields=['comment', 'created_at', 'id'], name='home_reply_comment_thread_idx'),
+        ]
 
     def __str__(self):
         return f"Reply by {self.user.email} to {self.comment}"
 
+class PostStatsQuerySet(models.QuerySet):
+    def bump(self, **deltas):
+        """
+        Atomically add ``deltas`` to the counters with F() expressions and move
+        engagement_score by the same weighted amount, so the leaderboard never
+        needs a recompute.
+        """
+        updates = {field: models.F(field) + delta for field, delta in deltas.items()}
+        score = sum(PostStats.ENGAGEMENT_WEIGHTS.get(field, 0) * delta for field, delta in deltas.items())
+        if score:
+            updates['engagement_score'] = models.F('engagement_score') + score
+        return self.update(**updates)
+
+    def create_missing(self, batch_size=2000):
+        """
+        Create the stats row for every post that lacks one: a single
+        anti-join finds them, then bulk inserts in ``batch_size`` chunks.
+        Returns how many rows were created.
+        """
+        missing = Post.objects.filter(stats__isnull=True).values_list('id', 'created_at').order_by()
+        created = 0
+        batch = []
+        for post_id, created_at in missing.iterator(chunk_size=batch_size):
+            iso_year, iso_week, _ = timezone.localtime(created_at).isocalendar()
+            batch.append(PostStats(post_id=post_id, iso_year=iso_year, iso_week=iso_week))
+            if len(batch) >= batch_size:
+                created += len(self.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        if batch:
+            created += len(self.bulk_create(batch, ignore_conflicts=True))
+        return created
+
+    def leaderboard(self, week=None):
+        """Highest engagement first; ``week`` is an ``(iso_year, iso_week)`` pair."""
+        queryset = self
+        if week is not None:
+            queryset = queryset.filter(iso_year=week[0], iso_week=week[1])
+        return queryset.order_by('-engagement_score', '-id')
+
 class PostStats(models.Model):
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='stats')
+    ENGAGEMENT_WEIGHTS = {'views': 0.2, 'likes': 0.3, 'comments': 0.3, 'shares': 0.2}
+    # Counters whose increases are logged as activity (see counter_increases).
+    TRACKED_COUNTERS = ('views', 'shares')
+
+    # One row per post (see the constraint below); the unique index also
+    # serves lookups by post, so the FK doesn't get its own.
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='stats', db_index=False)
     views = models.PositiveIntegerField(default=0, db_index=True)
     likes = models.PositiveIntegerField(default=0, db_index=True)
     liked_by = models.ManyToManyField(CustomUser, blank=True, related_name='liked_posts')
+    # Top-level comments only; replies are counted apart so they don't
+    # move engagement_score (and the leaderboard).
     comments = models.PositiveIntegerField(default=0)
+    replies = models.PositiveIntegerField(default=0)
     shares = models.PositiveIntegerField(default=0)
+    # Materialized leaderboard: the weighted score is kept in step with the
+    # counters, and the ISO week of the post's creation is denormalized so a
+    # week's top posts are an index range scan.
+    engagement_score = models.FloatField(default=0)
+    iso_year = models.PositiveSmallIntegerField(null=True, blank=True)
+    iso_week = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    objects = PostStatsQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post'], name='home_poststats_one_per_post'),
+        ]
+        indexes = [
+            models.Index(fields=['-engagement_score', '-id'], name='home_stats_score_idx'),
+            models.Index(fields=['iso_year', 'iso_week', '-engagement_score', '-id'], name='home_stats_week_score_idx'),
+        ]
 
     def __str__(self):
         return f"Post Stats for -> {self.post.title}"
 
+    def compute_engagement_score(self):
+        return sum(weight * getattr(self, field) for field, weight in self.ENGAGEMENT_WEIGHTS.items())
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_counters()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_counters(kwargs.get('fields'))
+
+    def _remember_counters(self, fields=None):
+        deferred = self.get_deferred_fields()
+        saved = self.__dict__.setdefault('_saved_counters', {})
+        for field in self.TRACKED_COUNTERS:
+            if field not in deferred and (fields is None or field in fields):
+                saved[field] = getattr(self, field)
+
+    def counter_increases(self, update_fields=None):
+        """
+        How much each of TRACKED_COUNTERS has grown since the row was loaded
+        or last saved, limited to ``update_fields``. The post_save receivers
+        log these, so a save that only touches likes or comments logs nothing.
+        """
+        saved = self.__dict__.get('_saved_counters', {})
+        increases = {}
+        for field in self.TRACKED_COUNTERS:
+            if update_fields is not None and field not in update_fields:
+                continue
+            if field in self.get_deferred_fields():
+                continue
+            delta = getattr(self, field) - saved.get(field, 0)
+            if delta > 0:
+                increases[field] = delta
+        return increases
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(self.ENGAGEMENT_WEIGHTS):
+            self.engagement_score = self.compute_engagement_score()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'engagement_score'}
+        if self.iso_week is None and self.post_id and update_fields is None:
+            self.iso_year, self.iso_week, _ = timezone.localtime(self.post.created_at).isocalendar()
+        super().save(*args, **kwargs)
+        # After post_save, whose receivers read the increases.
+        self._remember_counters(update_fields)
+
+    def toggle_like(self, user):
+        """
+        Like or unlike for ``user``. Returns ``(liked, changed)``: whether the
+        post is now liked, and whether this call is what changed it.
+
+        Membership is an indexed lookup on the through table's unique
+        (poststats, user) pair and ``likes`` moves by an atomic F() update
+        only when a through row was really inserted or deleted, so the
+        counter stays equal to ``liked_by`` under concurrent toggles. The
+        rows bypass ``liked_by.add()``, so the LIKE_POST entry is logged
+        here rather than by an m2m_changed receiver.
+        """
+        # Imported here: home.activity imports this module.
+        from .activity import log_activity
+
+        through = PostStats.liked_by.through
+        field = PostStats.liked_by.field
+        row = {f'{field.m2m_field_name()}_id': self.pk, f'{field.m2m_reverse_field_name()}_id': user.pk}
+        with transaction.atomic():
+            if through.objects.filter(**row).exists():
+                deleted, _ = through.objects.filter(**row).delete()
+                if deleted:
+                    PostStats.objects.filter(pk=self.pk, likes__gt=0).bump(likes=-1)
+                return False, bool(deleted)
+            try:
+                with transaction.atomic():
+                    through.objects.create(**row)
+            except IntegrityError:
+                # A concurrent toggle inserted the same row first.
+                return True, False
+            PostStats.objects.filter(pk=self.pk).bump(likes=1)
+            log_activity("LIKE_POST", user=user, post=self.post_id)
+            return True, True
+
 class Contact(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="contacts")
     name = models.CharField(max_length=100)
@@ -176,13 +486,66 @@ class ActivityLog(models.Model):
         ('CONTACT_SUBMISSION', 'Contact Form Submission'),
     ]
     
-    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="activity_logs")
-    post = models.ForeignKey('Post', on_delete=models.SET_NULL, null=True, blank=True, related_name="activity_logs")
+    # The (user, created_at) and (post, created_at) indexes below also serve
+    # plain lookups by user or post, so these FKs don't get their own.
+    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="activity_logs", db_index=False)
+    post = models.ForeignKey('Post', on_delete=models.SET_NULL, null=True, blank=True, related_name="activity_logs", db_index=False)
     comment = models.ForeignKey('Comment', on_delete=models.SET_NULL, null=True, blank=True, related_name="activity_logs")  # ✅ Added for replies
     action = models.CharField(max_length=50, choices=ACTION_CHOICES)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Stamped when the event happens, not when the batched writer inserts it.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     time_spent = models.PositiveIntegerField(null=True, blank=True, help_text="Time spent in seconds")
+    count = models.PositiveIntegerField(default=1, help_text="Events this row stands for, e.g. views since the last flush")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='home_activity_created_id_idx'),
+            models.Index(fields=['action', 'created_at'], name='home_activity_action_idx'),
+            models.Index(fields=['post', 'created_at'], name='home_activity_post_idx'),
+            models.Index(fields=['user', 'created_at'], name='home_activity_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.action} - {self.post if self.post else ''}"
+
+class ActivityRollup(models.Model):
+    """
+    Event counts per action, post and time bucket, kept in step with
+    ActivityLog by its writer (see home/rollups.py) so dashboards read a
+    few rows per bucket instead of scanning the log.
+    """
+    # Rows for post SITE count every event of the action, with or without a post.
+    SITE = 0
+
+    # A plain id rather than a foreign key: counts outlive the post (and the
+    # raw rows, which retention deletes) so site-wide history stays whole.
+    post_id = models.PositiveIntegerField(default=SITE)
+    action = models.CharField(max_length=50, choices=ActivityLog.ACTION_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class ActivityHourly(ActivityRollup):
+    bucket = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # Leads with post_id so a post's (or the site's) series is one range scan.
+            models.UniqueConstraint(fields=['post_id', 'bucket', 'action'], name='home_activity_hourly_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} x{self.count} @ {self.bucket:%Y-%m-%d %H:00} (post {self.post_id or 'site'})"
+
+class ActivityDaily(ActivityRollup):
+    bucket = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post_id', 'bucket', 'action'], name='home_activity_daily_key'),
+        ]
 
     def __str__(self):
-        return f"{self.user} - {self.action} - {self.post if self.post else ''}"
\ No newline at end of file
+        return f"{self.action} x{self.count} @ {self.bucket} (post {self.post_id or 'site'})"
\ No newline at end of file
@@ -0,0 +1,191 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the ordering columns instead of counting
+    rows, so every page costs the same no matter how deep the client scrolls.
+
+    The default ordering is the indexed ``(created_at, id)`` pair. A viewset
+    can override it with a ``keyset_ordering`` attribute; the last field must
+    be unique so the ordering is total.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views: the page is read with the async ORM."""
+        return self.finish_page([obj async for obj in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The (lazy) queryset holding this page's rows, plus one to detect more."""
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request)
+        self.fields = [queryset.model._meta.get_field(f.lstrip('-')) for f in self.ordering]
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor.reverse)
+        ordering = [_flip(f) for f in self.ordering] if self.reverse else list(self.ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self.seek_filter(self.cursor.position, ordering))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, results):
+        cursor, reverse = self.cursor, self.reverse
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if cursor is None:
+            has_next, has_previous = has_more, False
+        elif reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, True
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_next:
+                self.next_position = self.get_position(results[-1])
+            if has_previous:
+                self.previous_position = self.get_position(results[0])
+        elif cursor is not None:
+            # Everything past the cursor went away; point back at where we were.
+            if reverse:
+                self.next_position = cursor.position
+            else:
+                self.previous_position = cursor.position
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_position(self, obj):
+        return [getattr(obj, field.attname) for field in self.fields]
+
+    def serialize_position(self, position):
+        # Full precision isoformat; DjangoJSONEncoder drops microseconds,
+        # which would make the seek skip or repeat rows.
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+
+    def seek_filter(self, position, ordering):
+        """
+        Build the lexicographic "row comes after position" condition, e.g.
+        ``created_at < t OR (created_at = t AND id < n)`` for descending order.
+        """
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': position[i]})
+            for prev_field, value in zip(ordering[:i], position[:i]):
+                clause &= Q(**{prev_field.lstrip('-'): value})
+            condition |= clause
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(self.fields, values)]
+            return Cursor(position=position, reverse=bool(payload.get('r')))
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        payload = {'p': self.serialize_position(cursor.position)}
+        if cursor.reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':'))
+        encoded = urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(Cursor(position=self.next_position, reverse=False))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(Cursor(position=self.previous_position, reverse=True))
+
+
+class DiscussionPagination(KeysetPagination):
+    """
+    A post's comments oldest first. Pages are allowed to be large so a
+    whole discussion can come back in one request; the replies are
+    prefetched in one query per page however many comments it holds.
+    """
+    ordering = ('created_at', 'id')
+    page_size = 100
+    max_page_size = 2000
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Offset paging for ranked search results. Relevance scores aren't a
+    stable column to seek on, and nobody reads page 500 of a search, so the
+    offset cost stays small.
+    """
+    default_limit = 20
+    max_limit = 100
@@ -0,0 +1,201 @@
+from functools import lru_cache
+
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+
+
+class QueryPlan:
+    """
+    The joins, prefetches and column list a serializer needs from its model.
+
+    ``prefetch`` maps a lookup path to ``(related_model, spec)`` where spec is
+    a nested plan (nested list serializers), ``'pk'`` (primary-key-only
+    relations) or ``None`` (plain prefetch). ``full`` holds the path prefixes
+    whose rows must be loaded whole because some field reads something we
+    can't see; ``''`` in it means no ``only()`` at all.
+    """
+
+    def __init__(self):
+        self.select = set()
+        self.prefetch = {}
+        self.only = set()
+        self.full = set()
+
+    def apply(self, queryset, only=True):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.build_prefetches())
+        if only and '' not in self.full:
+            queryset = queryset.only(*self.only_fields())
+        return queryset
+
+    def build_prefetches(self):
+        lookups = []
+        for path, (model, spec) in sorted(self.prefetch.items()):
+            if spec is None:
+                lookups.append(path)
+            elif spec == 'pk':
+                lookups.append(Prefetch(path, queryset=model._default_manager.only('pk')))
+            else:
+                lookups.append(Prefetch(path, queryset=spec.apply(model._default_manager.all())))
+        return lookups
+
+    def only_fields(self):
+        # A relation whose serializer needs every column is named on its own,
+        # which makes Django load it whole; drop the narrower paths beneath it.
+        full = {prefix.rstrip('_') for prefix in self.full}
+        fields = set(full)
+        for path in self.only:
+            if not any(path.startswith(f'{prefix}__') for prefix in full):
+                fields.add(path)
+        return sorted(fields)
+
+
+def _get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except Exception:
+        return None
+
+
+def _walk_source(model, attrs, prefix, plan):
+    """Follow a dotted ``source`` through forward relations, joining as we go."""
+    for i, attr in enumerate(attrs):
+        field = _get_model_field(model, attr)
+        if field is None:
+            plan.full.add(prefix)
+            return
+        if field.is_relation and (field.many_to_one or field.one_to_one) and i < len(attrs) - 1:
+            plan.select.add(f'{prefix}{attr}')
+            model, prefix = field.related_model, f'{prefix}{attr}__'
+            continue
+        if field.concrete:
+            plan.only.add(f'{prefix}{attr}')
+        else:
+            plan.full.add(prefix)
+        return
+
+
+def _plan_serializer(serializer, model, prefix, plan):
+    meta = getattr(serializer, 'Meta', None)
+    # SerializerMethodFields can't be introspected, so serializers declare the
+    # relations their methods touch in Meta.select_related / prefetch_related.
+    for path in getattr(meta, 'select_related', ()):
+        plan.select.add(f'{prefix}{path}')
+        hops = path.split('__')
+        for i in range(1, len(hops) + 1):
+            plan.full.add(f"{prefix}{'__'.join(hops[:i])}__")
+    for path in getattr(meta, 'prefetch_related', ()):
+        plan.prefetch[f'{prefix}{path}'] = (None, None)
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+            plan.full.add(prefix)
+            continue
+        attrs = field.source_attrs
+        if isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.ModelSerializer):
+            _plan_many(field.child, model, attrs, prefix, plan)
+        elif isinstance(field, serializers.ModelSerializer):
+            _plan_one(field, model, attrs, prefix, plan)
+        elif isinstance(field, ManyRelatedField):
+            relation = _get_model_field(model, attrs[0]) if len(attrs) == 1 else None
+            if relation is None or not relation.is_relation:
+                plan.full.add(prefix)
+                continue
+            spec = 'pk' if isinstance(field.child_relation, PrimaryKeyRelatedField) else None
+            plan.prefetch[f'{prefix}{attrs[0]}'] = (relation.related_model, spec)
+        elif isinstance(field, RelatedField) and not isinstance(field, PrimaryKeyRelatedField):
+            # String/slug/hyperlinked relations render from the related row.
+            relation = _get_model_field(model, attrs[0]) if len(attrs) == 1 else None
+            if relation is None or not (relation.many_to_one or relation.one_to_one):
+                plan.full.add(prefix)
+                continue
+            plan.select.add(f'{prefix}{attrs[0]}')
+            plan.full.add(f'{prefix}{attrs[0]}__')
+        else:
+            _walk_source(model, attrs, prefix, plan)
+
+
+def _plan_one(serializer, model, attrs, prefix, plan):
+    relation = _get_model_field(model, attrs[0]) if len(attrs) == 1 else None
+    if relation is None or not relation.is_relation:
+        plan.full.add(prefix)
+        return
+    if relation.many_to_one or relation.one_to_one:
+        path = f'{prefix}{attrs[0]}'
+        plan.select.add(path)
+        _plan_serializer(serializer, relation.related_model, f'{path}__', plan)
+    else:
+        _plan_many(serializer, model, attrs, prefix, plan)
+
+
+def _plan_many(serializer, model, attrs, prefix, plan):
+    relation = _get_model_field(model, attrs[0]) if len(attrs) == 1 else None
+    if relation is None or not relation.is_relation:
+        plan.full.add(prefix)
+        return
+    child = _plan_for(type(serializer), relation.related_model)
+    if relation.one_to_many:
+        # Prefetching a reverse FK matches rows on the child's FK column,
+        # so it must not be deferred.
+        child = _copy_plan(child)
+        child.only.add(relation.field.name)
+    plan.prefetch[f'{prefix}{attrs[0]}'] = (relation.related_model, child)
+
+
+def _copy_plan(plan):
+    copy = QueryPlan()
+    copy.select, copy.prefetch = set(plan.select), dict(plan.prefetch)
+    copy.only, copy.full = set(plan.only), set(plan.full)
+    return copy
+
+
+@lru_cache(maxsize=None)
+def _plan_for(serializer_class, model):
+    plan = QueryPlan()
+    _plan_serializer(serializer_class(), model, '', plan)
+    return plan
+
+
+def plan_queryset(queryset, serializer_class, only=True, extra_fields=()):
+    """
+    Apply the select_related / prefetch_related / only() that
+    ``serializer_class`` needs to ``queryset``.
+
+    ``extra_fields`` are columns the caller reads itself (pagination keys,
+    filters on the instance) and must stay loaded when ``only`` is on.
+    """
+    plan = _plan_for(serializer_class, queryset.model)
+    if extra_fields:
+        plan = _copy_plan(plan)
+        plan.only.update(extra_fields)
+    return plan.apply(queryset, only=only)
+
+
+class QueryPlanMixin:
+    """
+    Viewset mixin that plans the queryset from the serializer, so list and
+    detail responses run a fixed number of queries however many rows they hold.
+    Columns are only narrowed with ``only()`` on read requests.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return self.plan_queryset(queryset)
+
+    def plan_queryset(self, queryset, serializer_class=None):
+        read_only = self.request is None or self.request.method in ('GET', 'HEAD', 'OPTIONS')
+        return plan_queryset(
+            queryset,
+            serializer_class or self.get_serializer_class(),
+            only=read_only,
+            extra_fields=self.get_keyset_fields(),
+        )
+
+    def get_keyset_fields(self):
+        ordering = getattr(self, 'keyset_ordering', None) or getattr(self.pagination_class, 'ordering', ())
+        return tuple(field.lstrip('-') for field in ordering)
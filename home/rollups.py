@@ -0,0 +1,139 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate, TruncHour
+
+from .models import ActivityDaily, ActivityHourly, ActivityLog, ActivityRollup
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Days of raw ActivityLog rows kept by ``prune_activity``; older rows
+    # survive only in the rollups (and the archive, if one is written).
+    'RAW_DAYS': 90,
+    # Days of hourly rollups kept; None keeps them all.
+    'HOURLY_DAYS': 400,
+    'DAILY_DAYS': None,
+}
+
+
+def get_retention_settings():
+    return {**DEFAULTS, **getattr(settings, 'ACTIVITY_LOG_RETENTION', {})}
+
+
+# Buckets are UTC hours and days, whatever TIME_ZONE says.
+def hour_bucket(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment):
+    return moment.astimezone(dt_timezone.utc).date()
+
+
+def day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+ROLLUPS = (
+    (ActivityHourly, hour_bucket, TruncHour),
+    (ActivityDaily, day_bucket, TruncDate),
+)
+
+
+def roll_up(entries):
+    """
+    Add freshly written ActivityLog ``entries`` to the hourly and daily
+    rollups. Call it in the transaction that inserted them, so the counts
+    and the log can't drift apart.
+    """
+    for model, bucket_of, _ in ROLLUPS:
+        counts = Counter()
+        for entry in entries:
+            bucket = bucket_of(entry.created_at)
+            counts[(ActivityRollup.SITE, bucket, entry.action)] += entry.count
+            if entry.post_id:
+                counts[(entry.post_id, bucket, entry.action)] += entry.count
+        _add(model, counts)
+
+
+def _add(model, counts):
+    # One read finds which keys already have a row; those are bumped with
+    # one UPDATE per distinct increment (nearly always just +1), the rest
+    # go in with one INSERT.
+    existing = {}
+    rows = model.objects.filter(
+        post_id__in={key[0] for key in counts},
+        bucket__in={key[1] for key in counts},
+        action__in={key[2] for key in counts},
+    ).values_list('id', 'post_id', 'bucket', 'action')
+    for row_id, *key in rows:
+        existing[tuple(key)] = row_id
+    by_increment = defaultdict(list)
+    for key, row_id in existing.items():
+        if key in counts:
+            by_increment[counts[key]].append(row_id)
+    for increment, ids in by_increment.items():
+        model.objects.filter(id__in=ids).update(count=F('count') + increment)
+
+    missing = {key: n for key, n in counts.items() if key not in existing}
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([
+                model(post_id=post_id, bucket=bucket, action=action, count=n)
+                for (post_id, bucket, action), n in missing.items()
+            ])
+    except IntegrityError:
+        # Another process created some of these rows since the read.
+        for key, n in missing.items():
+            _add_one(model, key, n)
+
+
+def _add_one(model, key, n):
+    post_id, bucket, action = key
+    while not model.objects.filter(post_id=post_id, bucket=bucket, action=action).update(count=F('count') + n):
+        try:
+            with transaction.atomic():
+                model.objects.create(post_id=post_id, bucket=bucket, action=action, count=n)
+            return
+        except IntegrityError:
+            continue
+
+
+def rebuild(first_day, last_day):
+    """
+    Recount the rollups for the UTC days ``first_day``..``last_day`` from
+    the raw log, one day per transaction. Only days whose raw rows are all
+    still there (newer than the retention cutoff) come out right.
+    Returns how many rollup rows were written.
+    """
+    written = 0
+    day = first_day
+    while day <= last_day:
+        start, end = day_start(day), day_start(day + timedelta(days=1))
+        logs = ActivityLog.objects.filter(created_at__gte=start, created_at__lt=end).order_by()
+        with transaction.atomic():
+            for model, _, trunc in ROLLUPS:
+                bucketed = logs.annotate(bucket=trunc('created_at', tzinfo=dt_timezone.utc))
+                rows = [
+                    model(post_id=ActivityRollup.SITE, bucket=row['bucket'], action=row['action'], count=row['n'])
+                    for row in bucketed.values('bucket', 'action').annotate(n=Sum('count'))
+                ]
+                rows += [
+                    model(post_id=row['post_id'], bucket=row['bucket'], action=row['action'], count=row['n'])
+                    for row in bucketed.filter(post_id__isnull=False).values('post_id', 'bucket', 'action').annotate(n=Sum('count'))
+                ]
+                if model is ActivityDaily:
+                    model.objects.filter(bucket=day).delete()
+                else:
+                    model.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+                model.objects.bulk_create(rows, batch_size=1000)
+                written += len(rows)
+        day += timedelta(days=1)
+    logger.info("Rebuilt activity rollups for %s..%s: %d rows", first_day, last_day, written)
+    return written
@@ -0,0 +1,395 @@
+import heapq
+import html
+import logging
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'home_post_fts'
+
+# Relative weight of a match in each indexed column.
+FIELD_WEIGHTS = {'title': 10.0, 'content': 1.0, 'tags': 5.0}
+
+HIGHLIGHT = ('<mark>', '</mark>')
+# FTS5 wraps matches in these control characters, which survive HTML
+# escaping, and they are swapped for HIGHLIGHT after the text is escaped.
+FTS_MARKS = ('\x02', '\x03')
+SNIPPET_WORDS = 24
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def query_terms(query):
+    # Deduplicated, order kept; every term has to match (implicit AND).
+    return list(dict.fromkeys(tokenize(query)))
+
+
+class FTS5Backend:
+    """
+    SQLite FTS5 index over home_post. The virtual table is an external
+    content table, so it stores only the index and reads the text back from
+    home_post; triggers created in migration 0009 keep it in step with every
+    insert, update and delete, including bulk_create and queryset.update().
+    SQLite drops the triggers whenever a migration rebuilds home_post, so
+    they are re-created after every migrate (``ensure_fts_triggers``).
+    Ranking is FTS5's built-in bm25() with FIELD_WEIGHTS per column.
+    """
+    name = 'fts5'
+
+    def match_expression(self, terms):
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def _where(self, published_only):
+        where = f'{FTS_TABLE} MATCH %s'
+        if published_only:
+            where += " AND p.status = 'publish'"
+        return where
+
+    def count(self, terms, published_only):
+        sql = (
+            f'SELECT COUNT(*) FROM {FTS_TABLE} JOIN home_post p ON p.id = {FTS_TABLE}.rowid '
+            f'WHERE {self._where(published_only)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.match_expression(terms)])
+            return cursor.fetchone()[0]
+
+    def search(self, terms, published_only, offset, limit):
+        weights = ', '.join(str(FIELD_WEIGHTS[f]) for f in ('title', 'content', 'tags'))
+        opening, closing = FTS_MARKS
+        sql = (
+            f'SELECT p.id, -bm25({FTS_TABLE}, {weights}) AS score, '
+            f"highlight({FTS_TABLE}, 0, %s, %s), "
+            f"snippet({FTS_TABLE}, 1, %s, %s, '…', {SNIPPET_WORDS}) "
+            f'FROM {FTS_TABLE} JOIN home_post p ON p.id = {FTS_TABLE}.rowid '
+            f'WHERE {self._where(published_only)} '
+            f'ORDER BY score DESC, p.id DESC LIMIT %s OFFSET %s'
+        )
+        params = [opening, closing, opening, closing, self.match_expression(terms), limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [
+                {'id': pk, 'score': score, 'title': escape_marked(title), 'snippet': escape_marked(snippet)}
+                for pk, score, title, snippet in cursor.fetchall()
+            ]
+
+
+class InvertedIndexBackend:
+    """
+    In-process inverted index with BM25 ranking, for databases without FTS5.
+
+    Built lazily from the posts table on the first search and kept current
+    by the Post save/delete signals (see ``home/signals.py``). Each process
+    holds its own copy, so writes made by another process are only seen
+    after that process's index is rebuilt; bulk writes that skip signals
+    should call ``mark_stale()``.
+    """
+    name = 'memory'
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(dict)  # term -> {post_id: weighted tf}
+        self._doc_terms = {}                # post_id -> terms it was indexed under
+        self._doc_length = {}               # post_id -> weighted length
+        self._status = {}
+        self._total_length = 0.0
+
+    def rebuild(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._doc_terms = {}
+            self._doc_length = {}
+            self._status = {}
+            self._total_length = 0.0
+            rows = Post.objects.values_list('id', 'title', 'content', 'tags', 'status').iterator(chunk_size=2000)
+            for pk, title, content, tags, status in rows:
+                self._add(pk, title, content, tags, status)
+            self._built = True
+        logger.info("Built in-memory search index over %d posts", len(self._doc_length))
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def mark_stale(self):
+        """Drop the index; the next search rebuilds it from the table."""
+        with self._lock:
+            self._built = False
+            self._postings = defaultdict(dict)
+            self._doc_terms = {}
+            self._doc_length = {}
+            self._status = {}
+            self._total_length = 0.0
+
+    def _add(self, pk, title, content, tags, status):
+        frequencies = defaultdict(float)
+        length = 0.0
+        for field, text in (('title', title), ('content', content), ('tags', tags)):
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                frequencies[token] += weight
+                length += weight
+        for term, tf in frequencies.items():
+            self._postings[term][pk] = tf
+        self._doc_terms[pk] = tuple(frequencies)
+        self._doc_length[pk] = length
+        self._status[pk] = status
+        self._total_length += length
+
+    def _remove(self, pk):
+        for term in self._doc_terms.pop(pk, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_length.pop(pk, 0.0)
+        self._status.pop(pk, None)
+
+    def update(self, post):
+        with self._lock:
+            if self._built:
+                self._remove(post.pk)
+                self._add(post.pk, post.title, post.content, post.tags, post.status)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._built:
+                self._remove(pk)
+
+    def _ranked(self, terms, published_only, top=None):
+        self._ensure_built()
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not terms or not all(postings):
+                return 0, []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for other in postings[1:]:
+                candidates.intersection_update(other)
+            if published_only:
+                candidates = {pk for pk in candidates if self._status.get(pk) == 'publish'}
+            if top is None:
+                return len(candidates), []
+
+            documents = len(self._doc_length)
+            average = self._total_length / documents if documents else 1.0
+            idf = [
+                math.log(1 + (documents - len(p) + 0.5) / (len(p) + 0.5))
+                for p in postings
+            ]
+            scored = []
+            for pk in candidates:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_length[pk] / average)
+                score = sum(w * p[pk] * (self.k1 + 1) / (p[pk] + norm) for w, p in zip(idf, postings))
+                scored.append((score, pk))
+        return len(scored), heapq.nlargest(top, scored)
+
+    def count(self, terms, published_only):
+        return self._ranked(terms, published_only)[0]
+
+    def search(self, terms, published_only, offset, limit):
+        _, ranked = self._ranked(terms, published_only, top=offset + limit)
+        page = ranked[offset:offset + limit]
+        texts = Post.objects.in_bulk([pk for _, pk in page])
+        hits = []
+        for score, pk in page:
+            post = texts.get(pk)
+            if post is None:
+                continue
+            hits.append({
+                'id': pk,
+                'score': score,
+                'title': highlight(post.title, terms),
+                'snippet': make_snippet(post.content, terms),
+            })
+        return hits
+
+
+def escape_marked(text):
+    """HTML-escape FTS5 output, then turn its FTS_MARKS into HIGHLIGHT tags."""
+    escaped = html.escape(text or '')
+    for mark, tag in zip(FTS_MARKS, HIGHLIGHT):
+        escaped = escaped.replace(mark, tag)
+    return escaped
+
+
+def highlight(text, terms):
+    """``text`` HTML-escaped, with the tokens in ``terms`` wrapped in HIGHLIGHT."""
+    wanted = set(terms)
+    opening, closing = HIGHLIGHT
+    text = text or ''
+    pieces = []
+    position = 0
+    for match in TOKEN_RE.finditer(text):
+        if match.group(0).lower() in wanted:
+            pieces.append(html.escape(text[position:match.start()]))
+            pieces.append(f'{opening}{html.escape(match.group(0))}{closing}')
+            position = match.end()
+    pieces.append(html.escape(text[position:]))
+    return ''.join(pieces)
+
+
+def make_snippet(text, terms, words=SNIPPET_WORDS):
+    """A window of ``words`` tokens around the first matching term, highlighted."""
+    text = text or ''
+    matches = list(TOKEN_RE.finditer(text))
+    wanted = set(terms)
+    if not matches:
+        return ''
+    first = next((i for i, m in enumerate(matches) if m.group(0).lower() in wanted), 0)
+    start = max(first - words // 4, 0)
+    end = min(start + words, len(matches))
+    fragment = text[matches[start].start():matches[end - 1].end()]
+    return ''.join([
+        '…' if start > 0 else '',
+        highlight(fragment, terms),
+        '…' if end < len(matches) else '',
+    ])
+
+
+_fts5 = FTS5Backend()
+_memory = InvertedIndexBackend()
+
+
+_fts5_ready = False
+
+
+def fts5_available():
+    # Only a positive answer is remembered: the table can appear later
+    # (migrate in a running shell) but is never dropped at runtime.
+    global _fts5_ready
+    if _fts5_ready:
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        _fts5_ready = cursor.fetchone() is not None
+    return _fts5_ready
+
+
+def get_backend():
+    choice = getattr(settings, 'POST_SEARCH_BACKEND', 'auto')
+    if choice == 'memory' or (choice == 'auto' and not fts5_available()):
+        return _memory
+    return _fts5
+
+
+class SearchResults:
+    """
+    Lazy, sliceable search result set, so LimitOffsetPagination can page it
+    like a queryset: ``count()`` and ``[offset:offset + limit]`` each run
+    one query against the backend.
+    """
+
+    def __init__(self, query, published_only=True, backend=None):
+        self.terms = query_terms(query)
+        self.published_only = published_only
+        self.backend = backend or get_backend()
+
+    def count(self):
+        if not self.terms:
+            return 0
+        return self.backend.count(self.terms, self.published_only)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("SearchResults only supports [start:stop] slicing")
+        if not self.terms:
+            return []
+        offset = index.start or 0
+        return self.backend.search(self.terms, self.published_only, offset, index.stop - offset)
+
+
+def post_saved(post):
+    if get_backend() is _memory:
+        transaction.on_commit(lambda: _memory.update(post))
+
+
+def post_deleted(pk):
+    if get_backend() is _memory:
+        transaction.on_commit(lambda: _memory.remove(pk))
+
+
+def mark_stale():
+    """
+    Call after writing posts without their signals (bulk_create, update()).
+    The FTS5 triggers see those writes; the in-memory index of this process
+    is rebuilt on its next search instead.
+    """
+    if get_backend() is _memory:
+        _memory.mark_stale()
+
+
+# The statements of migration 0009, made idempotent.
+FTS_TRIGGERS = {
+    'home_post_fts_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS home_post_fts_insert AFTER INSERT ON home_post BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, content, tags)
+            VALUES (new.id, new.title, new.content, new.tags);
+        END
+    """,
+    'home_post_fts_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS home_post_fts_delete AFTER DELETE ON home_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content, tags)
+            VALUES ('delete', old.id, old.title, old.content, old.tags);
+        END
+    """,
+    'home_post_fts_update': f"""
+        CREATE TRIGGER IF NOT EXISTS home_post_fts_update AFTER UPDATE OF title, content, tags ON home_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content, tags)
+            VALUES ('delete', old.id, old.title, old.content, old.tags);
+            INSERT INTO {FTS_TABLE}(rowid, title, content, tags)
+            VALUES (new.id, new.title, new.content, new.tags);
+        END
+    """,
+}
+
+
+def ensure_fts_triggers():
+    """
+    Re-create whichever FTS5 triggers are missing. Django's SQLite schema
+    editor rebuilds home_post (copy, drop, rename) for most ALTERs and the
+    triggers go with the old table; the index is then rebuilt, since writes
+    made without them never reached it. Returns the re-created names.
+    """
+    if not fts5_available():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'home_post'")
+        present = {name for name, in cursor.fetchall()}
+        missing = [name for name in FTS_TRIGGERS if name not in present]
+        for name in missing:
+            cursor.execute(FTS_TRIGGERS[name])
+        if missing:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    if missing:
+        logger.warning("Re-created FTS5 triggers %s and rebuilt the search index", ', '.join(missing))
+    return missing
+
+
+def rebuild():
+    """Rebuild whichever index is active; returns its name."""
+    backend = get_backend()
+    if backend is _fts5:
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    else:
+        backend.rebuild()
+    return backend.name
@@ -1,15 +1,52 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import CustomUser, PostCategory, Post, PostStats, Reply, Comment, Contact, NewsLetter
-from django.utils.text import slugify
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .models import CustomUser, PostCategory, Post, PostStats, Reply, Comment, Contact, NewsLetter, ActivityLog, Tag
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .authentication import add_user_claims
+from .blacklist import FilteredRefreshToken
+from .analytics import INTERVALS, bucket_range, get_analytics_settings
+from .rollups import day_bucket
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = FilteredRefreshToken
+
     @classmethod
     def get_token(cls, user):
-        token = super().get_token(user)
-        token['is_superuser'] = user.is_superuser
-        token['is_staff'] = user.is_staff
-        return token
+        return add_user_claims(super().get_token(user), user)
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that re-reads the user's flags into the new tokens.
+    Requests trust the claims without touching the user row, so without this
+    a demoted admin would keep ``is_staff`` through every rotated refresh
+    token; with it the change lands within one access token lifetime.
+    """
+    token_class = FilteredRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user = CustomUser.objects.filter(
+            **{jwt_settings.USER_ID_FIELD: refresh.payload.get(jwt_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        add_user_claims(refresh, user)
+
+        data = {"access": str(refresh.access_token)}
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            if jwt_settings.BLACKLIST_AFTER_ROTATION:
+                # Raises if it already was: a replayed token doesn't rotate.
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data["refresh"] = str(refresh)
+        return data
     
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -71,24 +108,57 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+class ImageVariantsField(serializers.Field):
+    """
+    Renders ``image_meta`` as what an ``<img srcset>`` / ``<picture>`` needs:
+    the original's dimensions, a srcset per format, and the variants.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image_meta')
+        super().__init__(**kwargs)
+
+    def url(self, name):
+        url = self.parent.Meta.model._meta.get_field('image').storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def to_representation(self, meta):
+        if not meta or not meta.get('source'):
+            return None
+        variants = [{**variant, 'url': self.url(variant['name'])} for variant in meta.get('variants', ())]
+        sources = {}
+        for variant in variants:
+            sources.setdefault(variant['type'], []).append(f"{variant['url']} {variant['width']}w")
+        return {
+            'width': meta['width'],
+            'height': meta['height'],
+            'srcset': [{'type': mime, 'srcset': ', '.join(candidates)} for mime, candidates in sources.items()],
+            'variants': [{key: v[key] for key in ('url', 'width', 'height', 'type')} for v in variants],
+        }
+
 class PostSerializer(serializers.ModelSerializer):
     categoryName = serializers.CharField(source="category.name", read_only=True)
     author = UserSerializer(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'content', 'status', 'category', 'tags', 'image', 'author', 'slug', 'created_at', 'updated_at', 'categoryName']
+        fields = ['id', 'title', 'content', 'status', 'category', 'tags', 'image', 'image_variants', 'author', 'slug', 'created_at', 'updated_at', 'categoryName']
         read_only_fields = ['author', 'slug', 'created_at', 'updated_at', 'categoryName']
-    
-    def create(self, validated_data):
-        if 'slug' not in validated_data or not validated_data['slug']:
-            validated_data['slug'] = slugify(validated_data['title'])
-        return super().create(validated_data)
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ['id', 'name', 'slug', 'post_count']
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = PostCategory
-        fields = '__all__'
+        exclude = ['image_meta']
 
 class CommentSerializer(serializers.ModelSerializer):
     user = serializers.SerializerMethodField()
@@ -98,6 +168,7 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
         fields = "__all__"
         read_only_fields = ["id", "created_at", "user"]
+        select_related = ["user"]
 
     def get_user(self, obj):
         if obj.user:
@@ -114,6 +185,7 @@ class ReplySerializer(serializers.ModelSerializer):
         model = Reply
         fields = "__all__"
         read_only_fields = ["id", "created_at", "user"]
+        select_related = ["user"]
 
     def get_user(self, obj):
         if obj.user:
@@ -123,13 +195,46 @@ class ReplySerializer(serializers.ModelSerializer):
             }
         return {"email": "Anonymous", "username": "Anonymous"}
 
+class DiscussionCommentSerializer(CommentSerializer):
+    replies = ReplySerializer(many=True, read_only=True)
+
 class PostStatsSerializer(serializers.ModelSerializer):
     post = PostSerializer(read_only=True)
     liked_by = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     class Meta:
         model = PostStats
         fields = '__all__'
-        read_only_fields = ['id']
+        read_only_fields = ['id', 'engagement_score', 'iso_year', 'iso_week']
+
+class CounterIncrementSerializer(serializers.Serializer):
+    views = serializers.IntegerField(min_value=0, max_value=1000, default=0)
+    shares = serializers.IntegerField(min_value=0, max_value=1000, default=0)
+
+    def validate(self, attrs):
+        if not attrs['views'] and not attrs['shares']:
+            raise serializers.ValidationError("Provide views and/or shares to increment.")
+        return attrs
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    interval = serializers.ChoiceField(choices=INTERVALS, default='day')
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    post = serializers.IntegerField(min_value=1, required=False)
+    action = serializers.MultipleChoiceField(choices=ActivityLog.ACTION_CHOICES, required=False)
+
+    def validate(self, attrs):
+        conf = get_analytics_settings()
+        attrs.setdefault('until', day_bucket(timezone.now()))
+        attrs.setdefault('since', attrs['until'] - timedelta(days=conf['DEFAULT_DAYS'][attrs['interval']] - 1))
+        if attrs['since'] > attrs['until']:
+            raise serializers.ValidationError("since must not be after until.")
+        _, size, _ = bucket_range(attrs['interval'], attrs['since'], attrs['until'])
+        limit = conf['MAX_BUCKETS'][attrs['interval']]
+        if size > limit:
+            raise serializers.ValidationError(
+                f"That range is {size} {attrs['interval']} buckets; at most {limit} are served."
+            )
+        return attrs
 
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
@@ -144,6 +249,7 @@ class NewsletterSerializer(serializers.ModelSerializer):
         model = NewsLetter
         fields = '__all__'
         read_only_fields = ['id', 'subscribed_at']
+        select_related = ['user']
 
     def get_user(self, obj):
         if obj.user:
@@ -153,4 +259,9 @@ class NewsletterSerializer(serializers.ModelSerializer):
                 "lname": obj.user.lname,  # Explicitly include lname
                 "username": f"{obj.user.fname} {obj.user.lname}"
             }
-        return {"email": obj.email, "username": "N/A"}
\ No newline at end of file
+        return {"email": obj.email, "username": "N/A"}
+
+class ActivityLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ActivityLog
+        fields = '__all__'
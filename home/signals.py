@@ -2,8 +2,18 @@ from django.db.models.signals import post_save
 from django.db.models.signals import *
 from django.db.models.signals import post_migrate
 from django.dispatch import receiver
-from .models import Post, PostStats, ActivityLog, Comment, NewsLetter, Contact, Reply
+from django.db import transaction
+from .models import Post, PostCategory, PostStats, PostTag, Tag, Comment, NewsLetter, Contact, Reply
+from .activity import log_activity
+from .cache import invalidate
+from . import counters, search
+from .images import delete_variants, needs_variants, variant_worker, variants_generated
+from .authentication import forget_user
+from .blacklist import revocation_filter
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.contrib.auth.hashers import get_hashers, get_hashers_by_algorithm
+from django.core.signals import setting_changed
 from django.contrib.auth import get_user_model
 
 CustomUser = get_user_model()
@@ -16,24 +26,22 @@ def create_post_stats(sender, instance, created, **kwargs):
 @receiver(post_migrate)
 def create_missing_post_stats(sender, **kwargs):
     if sender.name == "home":  # Ensure it runs only for 'home' app
-        posts = Post.objects.all()
-        for post in posts:
-            if not PostStats.objects.filter(post=post).exists():
-                PostStats.objects.create(post=post)
+        PostStats.objects.create_missing()
 
 
 
 @receiver(post_save, sender=PostStats)
-def log_post_view(sender, instance, **kwargs):
+def log_post_view(sender, instance, update_fields=None, **kwargs):
     """
-    Logs when a user views a post. The frontend should send the time spent per post.
+    Logs views added by this save, as one entry counting them. Buffered
+    increments are logged when they are flushed (home/counters.py).
     """
-    if instance.views > 0:  # Check if view count increased
-        ActivityLog.objects.create(
-            user=instance.post.author,
-            post=instance.post,
-            action="VIEW_POST",
-            time_spent=instance.views,  # Assuming view count equals seconds spent
+    views = instance.counter_increases(update_fields).get('views')
+    if views:
+        log_activity(
+            "VIEW_POST",
+            post=instance.post_id,
+            count=views,
         )
 
 
@@ -41,69 +49,82 @@ def log_post_view(sender, instance, **kwargs):
 @receiver(post_save, sender=Post)
 def log_admin_post_activity(sender, instance, created, **kwargs):
     action = "CREATE_POST" if created else "EDIT_POST"
-    ActivityLog.objects.create(
+    log_activity(
+        action,
         user=instance.author,
-        action=action,
         post=instance
     )
 
 @receiver(post_delete, sender=Post)
 def log_admin_post_deletion(sender, instance, **kwargs):
-    ActivityLog.objects.create(
+    # The post row is gone by now, so the entry can't point at it.
+    log_activity(
+        "DELETE_POST",
         user=instance.author,
-        action="DELETE_POST",
-        post=instance
     )
 
 
 ### 3️⃣ Log Likes ###
-@receiver(m2m_changed, sender=PostStats.liked_by.through)
-def log_like_activity(sender, instance, action, pk_set, **kwargs):
-    if action == "post_add":
-        user = CustomUser.objects.get(pk=list(pk_set)[0])
-        ActivityLog.objects.create(
-            user=user,
-            action="LIKE_POST",
-            post=instance.post
-        )
+# Logged by PostStats.toggle_like, which writes the through rows itself.
 
 
 ### 4️⃣ Log Comments ###
 @receiver(post_save, sender=Comment)
 def log_comment_activity(sender, instance, created, **kwargs):
     if created:
-        ActivityLog.objects.create(
+        log_activity(
+            "COMMENT",
             user=instance.user,
-            action="COMMENT",
             post=instance.post
         )
 
 
+### Discussion counters (PostStats.comments/replies, Comment.reply_count) ###
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.comment_added(instance)
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    counters.comment_removed(instance, origin)
+
+@receiver(post_save, sender=Reply)
+def count_reply(sender, instance, created, **kwargs):
+    if created:
+        counters.reply_added(instance)
+
+@receiver(post_delete, sender=Reply)
+def uncount_reply(sender, instance, origin=None, **kwargs):
+    counters.reply_removed(instance, origin)
+
+
 ### 5️⃣ Log Shares ###
 @receiver(post_save, sender=PostStats)
-def log_share_activity(sender, instance, **kwargs):
-    if instance.shares > 0:
-        ActivityLog.objects.create(
-            user=instance.post.author,
-            action="SHARE_POST",
-            post=instance.post
+def log_share_activity(sender, instance, update_fields=None, **kwargs):
+    shares = instance.counter_increases(update_fields).get('shares')
+    if shares:
+        log_activity(
+            "SHARE_POST",
+            post=instance.post_id,
+            count=shares,
         )
 
 
 ### 6️⃣ Log Login & Logout ###
 @receiver(user_logged_in)
 def log_user_login(sender, request, user, **kwargs):
-    ActivityLog.objects.create(
+    log_activity(
+        "LOGIN",
         user=user,
-        action="LOGIN",
         ip_address=request.META.get('REMOTE_ADDR')
     )
 
 @receiver(user_logged_out)
 def log_user_logout(sender, request, user, **kwargs):
-    ActivityLog.objects.create(
+    log_activity(
+        "LOGOUT",
         user=user,
-        action="LOGOUT",
         ip_address=request.META.get('REMOTE_ADDR')
     )
 
@@ -112,9 +133,9 @@ def log_user_logout(sender, request, user, **kwargs):
 @receiver(user_logged_in)
 def log_admin_login(sender, request, user, **kwargs):
     if user.is_staff or user.is_superuser:
-        ActivityLog.objects.create(
+        log_activity(
+            "ADMIN_LOGIN",
             user=user,
-            action="ADMIN_LOGIN",
             ip_address=request.META.get('REMOTE_ADDR')
         )
 
@@ -123,9 +144,9 @@ def log_admin_login(sender, request, user, **kwargs):
 @receiver(post_save, sender=NewsLetter)
 def log_newsletter_subscription(sender, instance, created, **kwargs):
     if created:
-        ActivityLog.objects.create(
-            user=instance.user,
-            action="SUBSCRIBE_NEWSLETTER"
+        log_activity(
+            "SUBSCRIBE_NEWSLETTER",
+            user=instance.user
         )
 
 
@@ -133,9 +154,9 @@ def log_newsletter_subscription(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Contact)
 def log_contact_submission(sender, instance, created, **kwargs):
     if created:
-        ActivityLog.objects.create(
-            user=instance.user if instance.user else None,
-            action="CONTACT_SUBMISSION"
+        log_activity(
+            "CONTACT_SUBMISSION",
+            user=instance.user if instance.user else None
         )
 
 @receiver(post_save, sender=Reply)
@@ -144,9 +165,96 @@ def log_reply_activity(sender, instance, created, **kwargs):
     Logs when a user replies to a comment.
     """
     if created:
-        ActivityLog.objects.create(
+        log_activity(
+            "REPLY",
             user=instance.user,
-            action="REPLY",
             post=instance.comment.post,  # ✅ Logs the post where the reply was made
             comment=instance.comment  # ✅ Links to the specific comment being replied to
-        )
\ No newline at end of file
+        )
+
+
+### Keep the in-memory search index current (FTS5 uses triggers) ###
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+    search.post_saved(instance)
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.post_deleted(instance.pk)
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, **kwargs):
+    # Migrations that rebuild home_post drop the FTS5 triggers along with it.
+    if sender.name == "home":
+        search.ensure_fts_triggers()
+
+
+@receiver(pre_delete, sender=Post)
+def release_post_tags(sender, instance, **kwargs):
+    # Before the cascade removes the through rows the counts are read from.
+    PostTag.objects.release(instance)
+
+
+### Resized image variants (srcset) ###
+def generate_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        variant_worker.submit(sender, instance.pk)
+
+def delete_image_variants(sender, instance, **kwargs):
+    storage = instance._meta.get_field('image').storage
+    transaction.on_commit(lambda: delete_variants(storage, instance.image_meta))
+
+for model in (Post, PostCategory):
+    post_save.connect(generate_image_variants, sender=model, dispatch_uid=f'generate_image_variants_{model.__name__}')
+    post_delete.connect(delete_image_variants, sender=model, dispatch_uid=f'delete_image_variants_{model.__name__}')
+
+
+### 🔟 Invalidate cached public responses ###
+# Which cached endpoint scopes each model's rows show up in.
+RESPONSE_CACHE_SCOPES = {
+    Post: ('posts', 'tags', 'discussions'),  # tag counts move with posts
+    Tag: ('tags',),
+    PostCategory: ('categories', 'posts'),  # posts embed categoryName
+    Comment: ('comments', 'discussions'),
+    Reply: ('replies', 'discussions', 'comments'),  # comments embed reply_count
+    CustomUser: ('posts', 'comments', 'replies', 'discussions'),  # authors/commenters are embedded
+}
+
+def invalidate_response_cache(sender, **kwargs):
+    scopes = RESPONSE_CACHE_SCOPES[sender]
+    invalidate(*scopes)
+    # Again after commit, in case a concurrent read cached the old rows
+    # between the write and the commit.
+    transaction.on_commit(lambda: invalidate(*scopes))
+
+for model in RESPONSE_CACHE_SCOPES:
+    post_save.connect(invalidate_response_cache, sender=model, dispatch_uid=f'invalidate_response_cache_{model.__name__}')
+    post_delete.connect(invalidate_response_cache, sender=model, dispatch_uid=f'invalidate_response_cache_delete_{model.__name__}')
+
+# Responses embed image_variants, which the variant worker writes with update().
+for model in (Post, PostCategory):
+    variants_generated.connect(invalidate_response_cache, sender=model, dispatch_uid=f'invalidate_response_cache_variants_{model.__name__}')
+
+
+### Evict cached token users (home/authentication.py) ###
+@receiver([post_save, post_delete], sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+    transaction.on_commit(lambda: forget_user(instance.pk))
+
+
+### Keep the in-memory token blacklist filter current (home/blacklist.py) ###
+@receiver(post_save, sender=BlacklistedToken)
+def remember_revoked_token(sender, instance, created, **kwargs):
+    if created:
+        revocation_filter.add(instance.token.jti)
+
+
+### Rebuild the hashers when PASSWORD_HASHING changes (home/hashers.py) ###
+@receiver(setting_changed)
+def reset_hashers(sender, setting, **kwargs):
+    # They read their cost once, and Django caches the instances; it only
+    # resets them for PASSWORD_HASHERS.
+    if setting == 'PASSWORD_HASHING':
+        get_hashers.cache_clear()
+        get_hashers_by_algorithm.cache_clear()
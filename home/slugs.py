@@ -0,0 +1,116 @@
+import re
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+# Room kept for a "-<n>" suffix when a slug has to be cut to fit max_length.
+SUFFIX_ROOM = 7
+
+
+def _stems(model, text, field):
+    max_length = model._meta.get_field(field).max_length
+    base = slugify(text)[:max_length].strip('-') or model._meta.model_name
+    stem = base if len(base) <= max_length - SUFFIX_ROOM else base[:max_length - SUFFIX_ROOM].rstrip('-')
+    return base, stem
+
+
+def _taken(model, base, stem, field, exclude_pk=None):
+    """
+    Every existing slug that could collide with ``base`` or ``stem-<n>``.
+    ``[stem, stem + '.')`` is an index range scan that covers ``stem`` and
+    everything starting with ``stem-`` ('-' sorts just below '.'). Kept as
+    plain ranges rather than an OR so the slug index stays usable.
+    """
+    manager = model._default_manager
+    if exclude_pk is not None:
+        manager = manager.exclude(pk=exclude_pk)
+    taken = set(manager.filter(**{f'{field}__gte': stem, f'{field}__lt': f'{stem}.'}).values_list(field, flat=True))
+    if base != stem:
+        taken.update(manager.filter(**{field: base}).values_list(field, flat=True))
+    return taken
+
+
+def _suffixes(stem, taken):
+    pattern = re.compile(rf'^{re.escape(stem)}-(\d+)$')
+    return {int(m.group(1)) for m in map(pattern.match, taken) if m}
+
+
+def _lowest_free(used, start=1):
+    counter = start
+    while counter in used:
+        counter += 1
+    return counter
+
+
+def _pick(base, stem, taken):
+    if base not in taken:
+        return base
+    return f'{stem}-{_lowest_free(_suffixes(stem, taken))}'
+
+
+def allocate_slug(model, text, field='slug', exclude_pk=None):
+    """
+    Return a free slug for ``text``: the plain slug if unused, otherwise the
+    lowest free ``-<n>`` suffix, resolved with a single prefix query.
+    """
+    base, stem = _stems(model, text, field)
+    return _pick(base, stem, _taken(model, base, stem, field, exclude_pk))
+
+
+def allocate_slugs(model, texts, field='slug'):
+    """
+    Bulk variant for import paths. One ``IN`` query checks every plain slug
+    in the batch; only titles that collide pay for a prefix query. Slugs
+    handed out in the batch are reserved so they don't collide with each
+    other either.
+    """
+    keys = [_stems(model, text, field) for text in texts]
+    existing = set(
+        model._default_manager
+        .filter(**{f'{field}__in': {base for base, _ in keys}})
+        .values_list(field, flat=True)
+    )
+    # Per colliding key: the suffix numbers in use and the lowest one that
+    # may still be free. Suffixes only get used up within a batch, so the
+    # search resumes where the previous pick left off.
+    suffixes = {}
+    slugs = []
+    for key in keys:
+        base, stem = key
+        if base not in existing:
+            existing.add(base)
+            slugs.append(base)
+            continue
+        if key not in suffixes:
+            suffixes[key] = [_suffixes(stem, _taken(model, base, stem, field)), 1]
+        used, start = suffixes[key]
+        counter = _lowest_free(used, start)
+        # Another title in the batch may slugify to exactly "stem-<n>".
+        while f'{stem}-{counter}' in existing:
+            used.add(counter)
+            counter = _lowest_free(used, counter)
+        used.add(counter)
+        suffixes[key][1] = counter + 1
+        slug = f'{stem}-{counter}'
+        existing.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def save_with_slug(instance, text, save, *args, field='slug', attempts=5, **kwargs):
+    """
+    Allocate a slug for ``instance`` and ``save`` it, retrying with a fresh
+    slug if a concurrent writer claimed the same one first.
+    """
+    model = type(instance)
+    for attempt in range(attempts):
+        slug = allocate_slug(model, text, field, exclude_pk=instance.pk)
+        setattr(instance, field, slug)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            lost_race = model._default_manager.filter(**{field: slug}).exclude(pk=instance.pk).exists()
+            if not lost_race or attempt == attempts - 1:
+                setattr(instance, field, '')
+                raise
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage that names every upload after the SHA-256 of its bytes,
+    ``blobs/ab/abcdef....jpg``, whatever name or ``upload_to`` it came with.
+
+    The hash is computed while the upload streams into a temporary file next
+    to the blob directory; if a blob with that hash already exists the copy
+    is thrown away and the existing name returned, so identical uploads are
+    stored once. Names never change meaning, so their URLs can be cached
+    forever.
+
+    Because a blob can back any number of rows, ``delete()`` leaves files in
+    place; ``manage.py gc_media`` removes blobs nothing refers to any more.
+    Files saved before this storage was in use keep their old names and are
+    served as before.
+    """
+    prefix = 'blobs'
+
+    def is_blob(self, name):
+        return name.replace('\\', '/').startswith(f'{self.prefix}/')
+
+    def blob_name(self, digest, original_name):
+        ext = os.path.splitext(original_name)[1].lower()
+        return f'{self.prefix}/{digest[:2]}/{digest}{ext}'
+
+    def blob_name_for(self, content, name):
+        """The blob name ``content`` would be stored under, without storing it."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        return self.blob_name(digest.hexdigest(), name)
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed in _save.
+        return name
+
+    def _save(self, name, content):
+        blob_root = self.path(self.prefix)
+        os.makedirs(blob_root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=blob_root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp.write(chunk)
+            blob = self.blob_name(digest.hexdigest(), name)
+            path = self.path(blob)
+            if os.path.exists(path):
+                # Touched so gc_media's grace period covers the window
+                # before the row referencing it is committed.
+                os.utime(path)
+                logger.debug("Upload %s deduplicated to existing blob %s", name, blob)
+                return blob
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            # link() fails if a concurrent upload of the same bytes won the
+            # race, which is fine: the blob it wrote is identical.
+            try:
+                os.link(temp_path, path)
+            except FileExistsError:
+                pass
+            return blob
+        finally:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, name):
+        if self.is_blob(name):
+            # Possibly shared with other rows; gc_media decides.
+            return
+        super().delete(name)
+
+    def purge(self, name):
+        """Really delete a blob. Only for gc_media, once nothing refers to it."""
+        super().delete(name)
+
+    def iter_blobs(self):
+        """
+        Yield ``(name, size, mtime)`` for every file under the blob
+        directory, including temp files a crashed upload left behind.
+        """
+        root = self.path(self.prefix)
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                name = os.path.relpath(path, self.location).replace(os.sep, '/')
+                yield name, stat.st_size, stat.st_mtime
+
@@ -0,0 +1,36 @@
+import re
+
+from django.utils.text import slugify
+
+TAG_MAX_LENGTH = 50
+
+_SPACES = re.compile(r'\s+')
+
+
+def parse_tags(value):
+    """
+    Split a comma-separated tag string into ``(slug, name)`` pairs, in
+    order, without duplicates. Tags that only differ in case or spacing
+    ("Django", " django ") share a slug and are the same tag.
+    """
+    seen = {}
+    for raw in (value or '').split(','):
+        name = _SPACES.sub(' ', raw).strip()[:TAG_MAX_LENGTH]
+        slug = slugify(name)[:TAG_MAX_LENGTH]
+        if slug and slug not in seen:
+            seen[slug] = name
+    return list(seen.items())
+
+
+def format_tags(tags, max_length=None):
+    """
+    The canonical ``Post.tags`` string for parsed ``(slug, name)`` pairs.
+    With ``max_length``, trailing tags that don't fit are dropped and the
+    pairs actually kept are returned alongside.
+    """
+    kept = list(tags)
+    text = ', '.join(name for _, name in kept)
+    while max_length is not None and len(text) > max_length:
+        kept.pop()
+        text = ', '.join(name for _, name in kept)
+    return text, kept
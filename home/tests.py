@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import types
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from . import activity, images, search, slugs
+from .activity import ActivityLogWriter, log_activity
+from .async_views import async_reads
+from .blacklist import BloomFilter, FilteredRefreshToken, TokenBlacklisted, revocation_filter
+from .counters import counter_buffer, recount
+from .hashers import ScryptPasswordHasher, hashing_gate
+from .management.commands import import_posts
+from .models import ActivityDaily, ActivityHourly, ActivityLog, ActivityRollup, Comment, CustomUser, Post, PostCategory, PostStats, Reply, Tag
+from .rollups import roll_up
+from .urls import router
+
+
+class QueryCountMixin:
+    """
+    Helpers for proving an endpoint's query count doesn't grow with its rows.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url, grow, rounds=3, page_sizes=(1, 5, 20)):
+        """
+        Request ``url`` at several page sizes, calling ``grow()`` to add rows
+        between rounds, and fail unless every request ran the same number of
+        queries.
+        """
+        counts = {}
+        for round_number in range(rounds):
+            grow()
+            separator = '&' if '?' in url else '?'
+            for page_size in page_sizes:
+                counts[(round_number, page_size)] = self.count_queries(f'{url}{separator}page_size={page_size}')
+        self.assertEqual(len(set(counts.values())), 1, f'query count varies with rows/page size: {counts}')
+        return next(iter(counts.values()))
+
+
+class QueryPlanTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = PostCategory.objects.create(name='Travel')
+        self.users = [
+            CustomUser.objects.create_user(email=f'user{i}@example.com', password='secret123', fname='Test', lname=f'User{i}')
+            for i in range(3)
+        ]
+
+    def add_posts(self, count=8):
+        for i in range(count):
+            author = self.users[i % len(self.users)]
+            post = Post.objects.create(title='Weekly update', content='...', status='publish', category=self.category, author=author)
+            stats = PostStats.objects.get(post=post)
+            stats.liked_by.add(*self.users)
+            comment = Comment.objects.create(post=post, user=author, content='Nice')
+            Reply.objects.create(comment=comment, user=self.users[0], content='Thanks')
+
+    def test_post_list(self):
+        self.assertConstantQueries('/api/posts/', self.add_posts)
+
+    def test_post_stats_list(self):
+        self.assertConstantQueries('/api/post-stats/', self.add_posts)
+
+    def test_comment_and_reply_lists(self):
+        self.assertConstantQueries('/api/comments/', self.add_posts)
+        self.assertConstantQueries('/api/replies/', self.add_posts)
+
+    def add_discussion(self, post, count=5):
+        for i in range(count):
+            comment = Comment.objects.create(post=post, user=self.users[i % len(self.users)], content='Agreed')
+            for user in self.users[:2]:
+                Reply.objects.create(comment=comment, user=user, content='Same')
+
+    def test_discussion(self):
+        post = Post.objects.create(title='Thread', content='...', status='publish', category=self.category, author=self.users[0])
+        queries = self.assertConstantQueries(f'/api/posts/{post.pk}/discussion/', lambda: self.add_discussion(post))
+        # The post's existence, the comment page with its users, every reply with theirs.
+        self.assertEqual(queries, 3)
+
+    def test_discussion_pages(self):
+        post = Post.objects.create(title='Thread', content='...', status='publish', author=self.users[0])
+        self.add_discussion(post, count=7)
+        url, seen = f'/api/posts/{post.pk}/discussion/?page_size=3', []
+        while url:
+            page = self.client.get(url).json()
+            seen += page['results']
+            url = page['next']
+        oldest_first = Comment.objects.filter(post=post).order_by('created_at', 'id').values_list('id', flat=True)
+        self.assertEqual([comment['id'] for comment in seen], list(oldest_first))
+        self.assertEqual({len(comment['replies']) for comment in seen}, {2})
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ToggleLikeTests(TransactionTestCase):
+    def setUp(self):
+        self.post = Post.objects.create(title='Viral', content='...', status='publish')
+        self.stats = PostStats.objects.get(post=self.post)
+        self.users = [
+            CustomUser.objects.create(email=f'fan{i}@example.com', fname='Fan', lname=str(i))
+            for i in range(6)
+        ]
+
+    def assertCounterConsistent(self):
+        self.stats.refresh_from_db()
+        self.assertEqual(self.stats.likes, self.stats.liked_by.count())
+
+    def test_toggle_uses_through_table(self):
+        user = self.users[0]
+        self.assertEqual(self.stats.toggle_like(user), (True, True))
+        self.assertEqual(self.stats.toggle_like(user), (False, True))
+        self.assertCounterConsistent()
+        self.assertEqual(self.stats.likes, 0)
+
+    def test_parallel_toggles_keep_counter_consistent(self):
+        def toggle(user, times):
+            try:
+                stats = PostStats.objects.get(pk=self.stats.pk)
+                for _ in range(times):
+                    stats.toggle_like(user)
+            finally:
+                connection.close()
+
+        # Several threads per user, so the same through row is raced both ways.
+        threads = [
+            threading.Thread(target=toggle, args=(user, times))
+            for user in self.users
+            for times in (3, 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertCounterConsistent()
+        # Every user toggled 7 times in total, so every user ends up liking it.
+        self.assertEqual(self.stats.likes, len(self.users))
+
+    def test_toggle_like_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.post(f'/api/post-stats/{self.stats.pk}/toggle_like/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['likes'], 1)
+        self.assertEqual(response.data['liked_by'], [self.users[0].pk])
+        response = client.post(f'/api/post-stats/{self.stats.pk}/toggle_like/')
+        self.assertEqual(response.data['likes'], 0)
+        self.assertCounterConsistent()
+
+    def test_each_like_is_logged_once(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = f'/api/post-stats/{self.stats.pk}/toggle_like/'
+        for _ in range(3):  # like, unlike, like
+            client.post(url)
+        self.stats.toggle_like(self.users[1])
+        self.assertEqual(
+            sorted(ActivityLog.objects.filter(action='LIKE_POST').values_list('user_id', 'post_id')),
+            sorted([(self.users[0].pk, self.post.pk)] * 2 + [(self.users[1].pk, self.post.pk)]),
+        )
+
+    def test_like_lost_to_concurrent_toggle_is_not_logged(self):
+        PostStats.liked_by.through.objects.create(poststats=self.stats, customuser=self.users[0])
+        with mock.patch.object(PostStats.liked_by.through.objects, 'filter') as lookup:
+            # The membership check ran before the rival's row was committed.
+            lookup.return_value.exists.return_value = False
+            self.assertEqual(self.stats.toggle_like(self.users[0]), (True, False))
+        self.assertFalse(ActivityLog.objects.filter(action='LIKE_POST').exists())
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        posts = [Post.objects.create(title=f'Page {i}', content='...', status='publish') for i in range(7)]
+        # Ties on created_at are broken by id.
+        Post.objects.filter(pk__in=[post.pk for post in posts[2:5]]).update(created_at=posts[2].created_at)
+        self.expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_walk_forward_and_back(self):
+        pages = [self.page('/api/posts/?page_size=3')]
+        while pages[-1]['next']:
+            pages.append(self.page(pages[-1]['next']))
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        self.assertEqual([post['id'] for page in pages for post in page['results']], self.expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.page(pages[2]['previous'])
+        self.assertEqual([post['id'] for post in back['results']], self.expected[3:6])
+        back = self.page(back['previous'])
+        self.assertEqual([post['id'] for post in back['results']], self.expected[:3])
+        self.assertIsNone(back['previous'])
+
+    def test_new_posts_do_not_shift_pages(self):
+        first = self.page('/api/posts/?page_size=3')
+        Post.objects.create(title='Breaking', content='...', status='publish')
+        second = self.page(first['next'])
+        self.assertEqual([post['id'] for post in second['results']], self.expected[3:6])
+
+    def test_seek_instead_of_offset(self):
+        first = self.page('/api/posts/?page_size=3')
+        with CaptureQueriesContext(connection) as ctx:
+            self.page(first['next'])
+        selects = [q['sql'] for q in ctx.captured_queries if 'FROM "home_post"' in q['sql']]
+        self.assertTrue(selects)
+        self.assertFalse([sql for sql in selects if 'OFFSET' in sql])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/posts/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ActivityWriterTests(TransactionTestCase):
+    """The tests write through their own writer, with their own settings."""
+
+    def setUp(self):
+        self.post = Post.objects.create(title='Logged', content='...', status='publish')
+        ActivityLog.objects.all().delete()
+        ActivityDaily.objects.all().delete()
+        self.writer = ActivityLogWriter()
+        self.addCleanup(self.writer.stop)
+        patcher = mock.patch.object(activity, 'activity_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            threading.Event().wait(0.025)
+        self.fail("writer did not catch up")
+
+    @override_settings(ACTIVITY_LOG_WRITER={'BATCH_SIZE': 5, 'FLUSH_INTERVAL': 0.5})
+    def test_burst_written_in_one_batch(self):
+        for _ in range(5):
+            self.writer.log('VIEW_POST', post=self.post)
+        self.wait_for(lambda: self.writer.written == 5)
+        self.assertEqual(self.writer.stats()['batches'], 1)
+        self.assertEqual(ActivityLog.objects.filter(post=self.post).count(), 5)
+        self.assertEqual(ActivityDaily.objects.get(post_id=self.post.pk, action='VIEW_POST').count, 5)
+
+    @override_settings(ACTIVITY_LOG_WRITER={'BATCH_SIZE': 1000, 'FLUSH_INTERVAL': 60})
+    def test_stop_drains_the_queue(self):
+        for _ in range(3):
+            self.writer.log('SHARE_POST', post=self.post)
+        self.assertEqual(ActivityLog.objects.count(), 0)
+        self.writer.stop()
+        self.assertEqual(ActivityLog.objects.filter(action='SHARE_POST').count(), 3)
+        self.assertEqual(self.writer.stats()['written'], 3)
+
+    @override_settings(ACTIVITY_LOG_WRITER={'BATCH_SIZE': 1000, 'FLUSH_INTERVAL': 60})
+    def test_only_committed_entries_are_queued(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.writer.log('VIEW_POST', post=self.post)
+            raise RuntimeError
+        with transaction.atomic():
+            self.writer.log('SHARE_POST', post=self.post)
+            self.assertEqual(self.writer.enqueued, 0)
+        self.assertEqual(self.writer.enqueued, 1)
+        self.writer.stop()
+        self.assertEqual(list(ActivityLog.objects.values_list('action', flat=True)), ['SHARE_POST'])
+
+    @override_settings(ACTIVITY_LOG_WRITER={'BATCH_SIZE': 1000, 'FLUSH_INTERVAL': 60})
+    def test_entry_for_deleted_post_kept_without_it(self):
+        doomed = Post.objects.create(title='Doomed', content='...', status='publish')
+        ActivityLog.objects.all().delete()
+        self.writer.log('VIEW_POST', post=self.post)
+        self.writer.log('VIEW_POST', post=doomed)
+        doomed.delete()
+        ActivityLog.objects.all().delete()
+        self.writer.stop()
+        self.assertEqual(
+            sorted(ActivityLog.objects.filter(action='VIEW_POST').values_list('post_id', flat=True), key=str),
+            sorted([self.post.pk, None], key=str),
+        )
+        self.assertEqual(self.writer.stats()['failed'], 0)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False}, POST_STATS_FLUSH_INTERVAL=0)
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        a, b, c, d = [
+            PostStats.objects.get(post=Post.objects.create(title=f'Contender {i}', content='...', status='publish'))
+            for i in range(4)
+        ]
+        a.views = 10
+        a.save()
+        counter_buffer.increment(b.pk, shares=5)
+        counter_buffer.increment(c.pk, views=5, shares=5)
+        # b and d are from an older week.
+        PostStats.objects.filter(pk__in=[b.pk, d.pk]).update(iso_year=2024, iso_week=9)
+        self.a, self.b, self.c, self.d = a.pk, b.pk, c.pk, d.pk
+
+    def board(self, **params):
+        response = self.client.get('/api/post-stats/top/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['id'] for row in response.data]
+
+    def test_all_time_by_score_then_newest(self):
+        # a and c tie on 2.0; the higher id goes first.
+        self.assertEqual(self.board(), [self.c, self.a, self.b, self.d])
+        self.assertEqual(self.board(n=2), [self.c, self.a])
+
+    def test_by_iso_week(self):
+        self.assertEqual(self.board(week='2024-W09'), [self.b, self.d])
+        self.assertEqual(self.board(week='2024-w09', n=1), [self.b])
+        self.assertEqual(self.board(week='current'), [self.c, self.a])
+        self.assertEqual(self.board(week='2024-W10'), [])
+
+    def test_bad_params(self):
+        self.assertEqual(self.client.get('/api/post-stats/top/', {'week': 'last week'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/post-stats/top/', {'n': 'ten'}).status_code, 400)
+
+    def test_board_reads_the_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.board(week='2024-W09')
+        plan = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "home_poststats"' in q['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {plan}')
+            details = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('home_stats_week_score_idx', details)
+        self.assertNotIn('TEMP B-TREE', details)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.category = PostCategory.objects.create(name='Travel')
+        self.author = CustomUser.objects.create(email='columnist@example.com', fname='Col', lname='Umnist')
+        self.post = Post.objects.create(title='Cached', content='...', status='publish', category=self.category, author=self.author)
+
+    def assertCache(self, url, outcome):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.get('X-Cache'), outcome, url)
+        return response
+
+    def test_repeat_read_is_a_hit(self):
+        miss = self.assertCache('/api/posts/', 'MISS')
+        # Only the ETag validators' aggregate; no rows are read or serialized.
+        with self.assertNumQueries(1):
+            hit = self.assertCache('/api/posts/', 'HIT')
+        self.assertEqual(hit.content, miss.content)
+        # Each URL is its own entry.
+        self.assertCache('/api/posts/?page_size=1', 'MISS')
+
+    def test_authenticated_reads_skip_the_cache(self):
+        self.client.force_authenticate(self.author)
+        self.assertIsNone(self.client.get('/api/posts/').get('X-Cache'))
+        self.assertIsNone(self.client.get('/api/posts/').get('X-Cache'))
+
+    def test_writes_invalidate_their_scopes(self):
+        urls = ['/api/posts/', '/api/categories/', '/api/comments/', f'/api/posts/{self.post.pk}/discussion/']
+        for url in urls:
+            self.assertCache(url, 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, user=self.author, content='First')
+        self.assertCache('/api/comments/', 'MISS')
+        self.assertCache(f'/api/posts/{self.post.pk}/discussion/', 'MISS')
+        self.assertCache('/api/categories/', 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Journeys'
+            self.category.save()
+        # Posts embed their category's name.
+        response = self.assertCache('/api/posts/', 'MISS')
+        self.assertEqual(response.json()['results'][0]['categoryName'], 'Journeys')
+        self.assertCache('/api/comments/', 'HIT')
+
+    def test_stats_are_admin_only(self):
+        self.assertCache('/api/posts/', 'MISS')
+        self.assertCache('/api/posts/', 'HIT')
+        self.assertIn(self.client.get('/api/cache-stats/').status_code, (401, 403))
+        admin = CustomUser.objects.create(email='admin@example.com', fname='Ad', lname='Min', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.data['posts']['hits'], 1)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.posts = [Post.objects.create(title=f'Tagged {i}', content='...', status='publish') for i in range(3)]
+
+    def test_unchanged_list_is_not_modified(self):
+        first = self.client.get('/api/posts/')
+        self.assertEqual(first.status_code, 200)
+        again = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(again['ETag'], first['ETag'])
+        since = self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+        # The query string is part of the tag.
+        self.assertNotEqual(self.client.get('/api/posts/?page_size=1')['ETag'], first['ETag'])
+
+    def test_writes_change_the_tags(self):
+        post = self.posts[0]
+        list_etag = self.client.get('/api/posts/')['ETag']
+        detail_etag = self.client.get(f'/api/posts/{post.pk}/')['ETag']
+
+        post.title = 'Retitled'
+        post.save()
+        response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], list_etag)
+        response = self.client.get(f'/api/posts/{post.pk}/', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Retitled')
+
+        # A delete doesn't move MAX(updated_at); the row count catches it.
+        list_etag = self.client.get('/api/posts/')['ETag']
+        self.posts[2].delete()
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_missing_rows_get_no_validators(self):
+        for url in ('/api/posts/0/', '/api/posts/abc/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+            self.assertIsNone(response.get('ETag'))
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False}, POST_STATS_FLUSH_INTERVAL=0)
+class PostStatsActivityTests(TestCase):
+    """Only real view/share increases reach ActivityLog, once each, with their size."""
+
+    def setUp(self):
+        author = CustomUser.objects.create(email='author@example.com', fname='Ann', lname='Author')
+        self.post = Post.objects.create(title='Tracked', content='...', status='publish', author=author)
+        PostStats.objects.filter(post=self.post).update(views=10, shares=2)
+        self.stats = PostStats.objects.get(post=self.post)
+        ActivityLog.objects.all().delete()
+
+    def count_writes(self, operation):
+        """Run ``operation`` and return its INSERT/UPDATE/DELETE count per table."""
+        with CaptureQueriesContext(connection) as ctx:
+            operation()
+        writes = Counter()
+        for query in ctx.captured_queries:
+            match = re.match(r'(INSERT INTO|UPDATE|DELETE FROM) "(\w+)"', query['sql'])
+            if match:
+                writes[match.group(2)] += 1
+        self.assertFalse(
+            [q['sql'] for q in ctx.captured_queries if re.match(r'SELECT .* FROM "home_(post|customuser)"', q['sql'])],
+            'logging fetched the post or its author',
+        )
+        return writes
+
+    def test_other_counter_changes_log_nothing(self):
+        self.stats.comments += 1
+        writes = self.count_writes(self.stats.save)
+        self.assertEqual(writes, {'home_poststats': 1})
+
+        self.stats.likes += 1
+        writes = self.count_writes(lambda: self.stats.save(update_fields=['likes']))
+        self.assertEqual(writes, {'home_poststats': 1})
+        self.assertFalse(ActivityLog.objects.exists())
+
+    def test_view_and_share_deltas_logged_once(self):
+        self.stats.views += 3
+        writes = self.count_writes(self.stats.save)
+        self.assertEqual(writes['home_poststats'], 1)
+        self.assertEqual(writes['home_activitylog'], 1)
+        self.assertEqual(
+            list(ActivityLog.objects.values_list('action', 'post_id', 'count')),
+            [('VIEW_POST', self.post.pk, 3)],
+        )
+
+        # Saving again, or after a refresh, changes nothing.
+        writes = self.count_writes(self.stats.save)
+        self.stats.refresh_from_db()
+        writes += self.count_writes(self.stats.save)
+        self.assertEqual(writes['home_activitylog'], 0)
+
+        self.stats.views += 1
+        self.stats.shares += 2
+        writes = self.count_writes(self.stats.save)
+        self.assertEqual(writes['home_activitylog'], 2)
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('action', 'count')),
+            [('SHARE_POST', 2), ('VIEW_POST', 1), ('VIEW_POST', 3)],
+        )
+
+    def test_unsaved_counter_changes_log_nothing(self):
+        self.stats.views += 5
+        writes = self.count_writes(lambda: self.stats.save(update_fields=['comments']))
+        self.assertEqual(writes['home_activitylog'], 0)
+
+    def test_flushed_increments_logged_as_deltas(self):
+        writes = self.count_writes(lambda: counter_buffer.increment(self.stats.pk, views=4, shares=1))
+        self.assertEqual(writes['home_poststats'], 1)
+        self.assertEqual(writes['home_activitylog'], 2)
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('action', 'count')),
+            [('SHARE_POST', 1), ('VIEW_POST', 4)],
+        )
+        daily = ActivityDaily.objects.filter(post_id=self.post.pk, action='VIEW_POST').values_list('count', flat=True)
+        self.assertEqual(list(daily), [4])
+
+    def test_archived_entries_keep_their_delta(self):
+        self.stats.views += 6
+        self.stats.save()
+        ActivityLog.objects.update(created_at=timezone.now() - timedelta(days=200))
+        archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive, ignore_errors=True)
+        call_command('prune_activity', '--archive', archive, stderr=StringIO())
+        [name] = os.listdir(archive)
+        with gzip.open(os.path.join(archive, name), 'rt') as lines:
+            rows = [json.loads(line) for line in lines]
+        self.assertEqual([(row['action'], row['count']) for row in rows], [('VIEW_POST', 6)])
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class PostStatsBackfillTests(TestCase):
+    def setUp(self):
+        self.posts = [Post.objects.create(title=f'Post {i}', content='...') for i in range(3)]
+        # Rows lost before the post_save receiver existed, say.
+        PostStats.objects.filter(post__in=self.posts[1:]).delete()
+
+    def test_create_missing_only_fills_gaps(self):
+        kept = PostStats.objects.get(post=self.posts[0])
+        # One anti-join plus one bulk INSERT.
+        with self.assertNumQueries(2):
+            self.assertEqual(PostStats.objects.create_missing(), 2)
+        self.assertEqual(
+            sorted(PostStats.objects.values_list('post_id', flat=True)),
+            sorted(post.pk for post in self.posts),
+        )
+        self.assertEqual(PostStats.objects.get(post=self.posts[0]).pk, kept.pk)
+        week = timezone.localtime(self.posts[1].created_at).isocalendar()
+        stats = PostStats.objects.get(post=self.posts[1])
+        self.assertEqual((stats.iso_year, stats.iso_week), (week[0], week[1]))
+
+    def test_create_missing_batches_inserts(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(PostStats.objects.create_missing(batch_size=1), 2)
+
+    def test_backfill_command_is_idempotent(self):
+        err = StringIO()
+        call_command('backfill_post_stats', stderr=err)
+        self.assertIn("Created 2 PostStats rows", err.getvalue())
+        err = StringIO()
+        call_command('backfill_post_stats', stderr=err)
+        self.assertIn("Created 0 PostStats rows", err.getvalue())
+        self.assertEqual(PostStats.objects.count(), 3)
+
+    def test_one_stats_row_per_post(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PostStats.objects.create(post=self.posts[0])
+        self.assertEqual(PostStats.objects.filter(post=self.posts[0]).count(), 1)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class PostStatsMergeMigrationTests(TransactionTestCase):
+    """0013 folds duplicate PostStats rows into one before adding the unique constraint."""
+
+    def test_0013_merges_duplicates(self):
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes()
+        try:
+            executor.migrate([('home', '0012_comment_reply_count')])
+            apps = executor.loader.project_state([('home', '0012_comment_reply_count')]).apps
+            HistoricalPost = apps.get_model('home', 'Post')
+            HistoricalStats = apps.get_model('home', 'PostStats')
+            HistoricalUser = apps.get_model('home', 'CustomUser')
+            users = [HistoricalUser.objects.create(email=f'u{i}@example.com', fname='U', lname=str(i)) for i in range(3)]
+            post = HistoricalPost.objects.create(title='Dup', slug='dup', content='...')
+            single = HistoricalPost.objects.create(title='Single', slug='single', content='...')
+            first = HistoricalStats.objects.create(post=post, views=5, shares=1, comments=2, replies=1)
+            second = HistoricalStats.objects.create(post=post, views=3, shares=2, comments=3, replies=4)
+            HistoricalStats.objects.create(post=single, views=7)
+            first.liked_by.add(users[0], users[1])
+            second.liked_by.add(users[1], users[2])
+
+            executor.loader.build_graph()
+            executor.migrate([('home', '0013_poststats_one_per_post')])
+            self.assertEqual(
+                list(PostStats.objects.filter(post_id=post.pk).values_list('id', 'views', 'shares', 'comments', 'replies', 'likes')),
+                [(first.pk, 8, 3, 3, 4, 3)],
+            )
+            merged = PostStats.objects.get(post_id=post.pk)
+            self.assertEqual(set(merged.liked_by.values_list('pk', flat=True)), {user.pk for user in users})
+            self.assertAlmostEqual(merged.engagement_score, 0.2 * 8 + 0.3 * 3 + 0.3 * 3 + 0.2 * 3)
+            self.assertEqual(PostStats.objects.get(post_id=single.pk).views, 7)
+        finally:
+            executor.loader.build_graph()
+            executor.migrate(latest)
+            search.ensure_fts_triggers()
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False}, POST_STATS_FLUSH_INTERVAL=60)
+class CounterBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.stats = [
+            PostStats.objects.get(post=Post.objects.create(title=f'Hot {i}', content='...', status='publish'))
+            for i in range(3)
+        ]
+        self.addCleanup(counter_buffer.stop)
+        self.client = APIClient()
+
+    def views(self):
+        return [stats.views for stats in PostStats.objects.order_by('id')]
+
+    def test_increments_are_buffered(self):
+        url = f'/api/post-stats/{self.stats[0].pk}/increment/'
+        for _ in range(3):
+            response = self.client.post(url, {'views': 1}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['views'], 3)
+        self.assertEqual(self.views(), [0, 0, 0])
+
+        with CaptureQueriesContext(connection) as ctx:
+            counter_buffer.flush()
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "home_poststats"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.views(), [3, 0, 0])
+
+    def increments(self, times, **amounts):
+        url = f'/api/post-stats/{self.stats[0].pk}/increment/'
+        responses = [self.client.post(url, amounts, format='json') for _ in range(times)]
+        self.assertEqual({response.status_code for response in responses}, {202})
+        return [response.data['views'] for response in responses]
+
+    def test_response_counts_every_increment_once(self):
+        self.assertEqual(self.increments(3, views=2), [2, 4, 6])
+        self.assertEqual(self.views()[0], 0)
+
+    @override_settings(POST_STATS_FLUSH_MAX_PENDING=1)
+    def test_response_counts_increments_flushed_on_threshold(self):
+        self.assertEqual(self.increments(3, views=2), [2, 4, 6])
+        self.assertEqual(self.views()[0], 6)
+
+    @override_settings(POST_STATS_FLUSH_INTERVAL=0)
+    def test_response_counts_written_through_increments(self):
+        self.assertEqual(self.increments(2, views=1), [1, 2])
+        self.assertEqual(self.views()[0], 2)
+
+    def test_bad_pk_is_not_found(self):
+        for pk in ('abc', '1.5', '999'):
+            with self.subTest(pk=pk):
+                response = self.client.post(f'/api/post-stats/{pk}/increment/', {'views': 1}, format='json')
+                self.assertEqual(response.status_code, 404)
+
+    @override_settings(POST_STATS_FLUSH_MAX_PENDING=2)
+    def test_flush_when_enough_rows_pending(self):
+        counter_buffer.increment(self.stats[0].pk, views=2)
+        counter_buffer.increment(self.stats[0].pk, views=1)
+        self.assertEqual(self.views(), [0, 0, 0])
+        counter_buffer.increment(self.stats[1].pk, views=1)
+        self.assertEqual(self.views(), [3, 1, 0])
+        self.assertEqual(counter_buffer.pending(self.stats[0].pk), {'views': 0, 'shares': 0})
+
+    @override_settings(POST_STATS_FLUSH_INTERVAL=0.05)
+    def test_flush_every_interval(self):
+        counter_buffer.increment(self.stats[2].pk, views=5, shares=1)
+        for _ in range(100):
+            if self.views()[2]:
+                break
+            threading.Event().wait(0.05)
+        self.assertEqual(self.views(), [0, 0, 5])
+
+    def test_stop_drains_the_buffer(self):
+        counter_buffer.increment(self.stats[0].pk, views=1)
+        counter_buffer.increment(self.stats[1].pk, shares=4)
+        counter_buffer.stop()
+        self.assertIsNone(counter_buffer._thread)
+        self.assertEqual(self.views(), [1, 0, 0])
+        self.assertEqual(PostStats.objects.get(pk=self.stats[1].pk).shares, 4)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ActivityRollupTests(TestCase):
+    def setUp(self):
+        self.post = Post.objects.create(title='Rolled', content='...', status='publish')
+        ActivityLog.objects.all().delete()
+        ActivityHourly.objects.all().delete()
+        ActivityDaily.objects.all().delete()
+
+    def counts(self, model, action='VIEW_POST'):
+        return sorted(model.objects.filter(action=action).values_list('post_id', 'count'))
+
+    def log_at(self, when, count=1):
+        roll_up(ActivityLog.objects.bulk_create([
+            ActivityLog(action='VIEW_POST', post_id=self.post.pk, created_at=when) for _ in range(count)
+        ]))
+
+    def test_writes_bump_post_and_site_rows(self):
+        for _ in range(3):
+            log_activity('VIEW_POST', post=self.post)
+        log_activity('VIEW_POST', count=2)
+        expected = [(ActivityRollup.SITE, 5), (self.post.pk, 3)]
+        self.assertEqual(self.counts(ActivityHourly), expected)
+        self.assertEqual(self.counts(ActivityDaily), expected)
+
+    def test_rebuild_matches_incremental_counts(self):
+        now = timezone.now()
+        self.log_at(now - timedelta(days=2), count=4)
+        self.log_at(now - timedelta(days=2, hours=3), count=2)
+        self.log_at(now, count=1)
+        incremental = {model: self.counts(model) for model in (ActivityHourly, ActivityDaily)}
+        self.assertEqual(ActivityHourly.objects.filter(post_id=self.post.pk).count(), 3)
+
+        ActivityHourly.objects.update(count=0)
+        ActivityDaily.objects.all().delete()
+        call_command('rollup_activity', stderr=StringIO())
+        self.assertEqual({model: self.counts(model) for model in (ActivityHourly, ActivityDaily)}, incremental)
+
+    @override_settings(ACTIVITY_LOG_RETENTION={'RAW_DAYS': 30, 'HOURLY_DAYS': 60})
+    def test_prune_keeps_counts_in_rollups(self):
+        now = timezone.now()
+        self.log_at(now - timedelta(days=90), count=3)
+        self.log_at(now - timedelta(days=45), count=2)
+        self.log_at(now, count=1)
+
+        out = StringIO()
+        call_command('prune_activity', '--dry-run', stdout=out)
+        self.assertIn('Would delete 5 activity log rows', out.getvalue())
+        self.assertEqual(ActivityLog.objects.count(), 6)
+
+        call_command('prune_activity', '--batch-size', '2', stderr=StringIO())
+        self.assertEqual(ActivityLog.objects.count(), 1)
+        # Hourly rows past HOURLY_DAYS go too; daily ones are kept for good.
+        self.assertEqual(self.counts(ActivityHourly), [(ActivityRollup.SITE, 1), (ActivityRollup.SITE, 2), (self.post.pk, 1), (self.post.pk, 2)])
+        self.assertEqual(sum(count for _, count in self.counts(ActivityDaily)), 12)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ActivityAnalyticsTests(TestCase):
+    url = '/api/activity-logs/analytics/'
+
+    def setUp(self):
+        self.post, other = [Post.objects.create(title=f'Charted {i}', content='...', status='publish') for i in range(2)]
+        ActivityHourly.objects.all().delete()
+        ActivityDaily.objects.all().delete()
+        roll_up([
+            ActivityLog(action='VIEW_POST', post_id=self.post.pk, created_at=datetime(2025, 3, 3, 10, 30, tzinfo=dt_timezone.utc), count=2),
+            ActivityLog(action='VIEW_POST', post_id=self.post.pk, created_at=datetime(2025, 3, 4, 23, 59, tzinfo=dt_timezone.utc)),
+            ActivityLog(action='SHARE_POST', post_id=self.post.pk, created_at=datetime(2025, 3, 10, 0, 0, tzinfo=dt_timezone.utc)),
+            ActivityLog(action='VIEW_POST', post_id=other.pk, created_at=datetime(2025, 3, 3, 11, 0, tzinfo=dt_timezone.utc)),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(email='analyst@example.com', fname='Ana', lname='Lyst', is_staff=True))
+
+    def series(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_daily_buckets(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.series(since='2025-03-03', until='2025-03-10', post=self.post.pk)
+        self.assertFalse([q for q in ctx.captured_queries if 'home_activitylog' in q['sql']], 'read the raw log')
+        self.assertEqual(len(data['buckets']), 8)
+        self.assertEqual(data['buckets'][0], '2025-03-03')
+        self.assertEqual(data['series']['VIEW_POST'], [2, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(data['series']['SHARE_POST'], [0, 0, 0, 0, 0, 0, 0, 1])
+        # The whole site by default.
+        self.assertEqual(self.series(since='2025-03-03', until='2025-03-03')['totals']['VIEW_POST'], 3)
+
+    def test_weekly_and_hourly_buckets(self):
+        data = self.series(interval='week', since='2025-03-03', until='2025-03-12', post=self.post.pk)
+        self.assertEqual(data['buckets'], ['2025-03-03', '2025-03-10'])
+        self.assertEqual(data['series']['VIEW_POST'], [3, 0])
+        self.assertEqual(data['series']['SHARE_POST'], [0, 1])
+        # Weeks are labelled by their Monday; only days from since on count.
+        data = self.series(interval='week', since='2025-03-04', until='2025-03-10', post=self.post.pk)
+        self.assertEqual(data['buckets'], ['2025-03-03', '2025-03-10'])
+        self.assertEqual(data['series']['VIEW_POST'], [1, 0])
+
+        data = self.series(interval='hour', since='2025-03-03', until='2025-03-03', action=['VIEW_POST'])
+        self.assertEqual(list(data['series']), ['VIEW_POST'])
+        self.assertEqual(len(data['buckets']), 24)
+        self.assertEqual(data['buckets'][10], '2025-03-03T10:00:00Z')
+        self.assertEqual([(hour, n) for hour, n in enumerate(data['series']['VIEW_POST']) if n], [(10, 2), (11, 1)])
+
+    def test_limits(self):
+        for params in (
+            {'interval': 'hour', 'since': '2025-01-01', 'until': '2025-03-01'},
+            {'since': '2025-03-10', 'until': '2025-03-01'},
+            {'interval': 'month'},
+            {'action': 'FLY_POST'},
+            {'post': 0},
+        ):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(self.url).status_code, (401, 403))
+        self.client.force_authenticate(CustomUser.objects.create(email='reader2@example.com', fname='Rea', lname='Der'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class SearchIndexTests(TestCase):
+    """The search index follows post writes, and hits are safe to render as HTML."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get('/api/posts/search/', {'q': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def assertFound(self, query, *posts):
+        self.assertEqual([hit['id'] for hit in self.search(query)['results']], [post.pk for post in posts])
+
+    def check_writes_reach_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Zebra crossing', content='Stripes', status='publish')
+        self.assertFound('zebra', post)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'Okapi crossing'
+            post.save()
+        self.assertFound('zebra')
+        self.assertFound('okapi', post)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFound('okapi')
+
+    def test_fts5_index_follows_writes(self):
+        if search.get_backend().name != 'fts5':
+            self.skipTest("SQLite build without FTS5")
+        self.check_writes_reach_index()
+
+    @override_settings(POST_SEARCH_BACKEND='memory')
+    def test_memory_index_follows_writes(self):
+        search.rebuild()
+        self.check_writes_reach_index()
+
+    def check_highlights_escaped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='<b>Zebra</b> & co', content='Try <script>zebra()</script> now', status='publish')
+        hit = self.search('zebra')['results'][0]['search']
+        self.assertEqual(hit['title'], '&lt;b&gt;<mark>Zebra</mark>&lt;/b&gt; &amp; co')
+        self.assertEqual(hit['snippet'], 'Try &lt;script&gt;<mark>zebra</mark>()&lt;/script&gt; now')
+
+    def test_fts5_highlights_escaped(self):
+        if search.get_backend().name != 'fts5':
+            self.skipTest("SQLite build without FTS5")
+        self.check_highlights_escaped()
+
+    @override_settings(POST_SEARCH_BACKEND='memory')
+    def test_memory_highlights_escaped(self):
+        search.rebuild()
+        self.check_highlights_escaped()
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class ImportPostsTests(TestCase):
+    def run_import(self, *records):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as out:
+            for record in records:
+                out.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+        stderr = StringIO()
+        call_command('import_posts', path, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_bad_timestamps_skip_the_line(self):
+        output = self.run_import(
+            {'title': 'Dated', 'content': '...', 'created_at': '2024-03-01T10:00:00Z'},
+            {'title': 'Garbled', 'content': '...', 'created_at': 'yesterday'},
+            {'title': 'Impossible', 'content': '...', 'updated_at': '2024-02-30T10:00:00'},
+            {'title': 'Numeric', 'content': '...', 'created_at': 1709287200},
+            {'title': 'Naive', 'content': '...', 'created_at': '2024-03-02T10:00:00'},
+        )
+        self.assertIn('Line 2: skipped', output)
+        self.assertIn('Line 3: skipped', output)
+        self.assertIn('Line 4: skipped', output)
+        self.assertIn('Imported 2 posts (3 skipped)', output)
+        self.assertEqual(
+            sorted(Post.objects.values_list('title', 'created_at__date')),
+            [('Dated', date(2024, 3, 1)), ('Naive', date(2024, 3, 2))],
+        )
+
+    def test_non_object_lines_skip_the_line(self):
+        output = self.run_import('[]', '"x"', '42', 'null', {'title': 'Kept', 'content': '...'})
+        for line_number in range(1, 5):
+            self.assertIn(f'Line {line_number}: skipped (not a JSON object)', output)
+        self.assertIn('Imported 1 posts (4 skipped)', output)
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Kept'])
+
+    def test_slug_taken_mid_import_is_reallocated(self):
+        real = import_posts.allocate_slugs
+        calls = []
+
+        def racing(model, texts):
+            slugs = real(model, texts)
+            if not calls:
+                # Someone else saves a post under the first slug right after it was handed out.
+                Post.objects.create(title='Rival', slug=slugs[0], content='...')
+            calls.append(slugs)
+            return slugs
+
+        with mock.patch.object(import_posts, 'allocate_slugs', racing):
+            self.run_import({'title': 'Race', 'content': '...'}, {'title': 'Other', 'content': '...'})
+        self.assertEqual(calls, [['race', 'other'], ['race-1', 'other']])
+        self.assertEqual(sorted(Post.objects.values_list('slug', flat=True)), ['other', 'race', 'race-1'])
+        self.assertEqual(PostStats.objects.count(), 3)
+
+    @override_settings(POST_SEARCH_BACKEND='memory')
+    def test_memory_index_sees_imported_posts(self):
+        search.rebuild()
+        self.run_import({'title': 'Imported zebra', 'content': '...', 'status': 'publish'})
+        response = APIClient().get('/api/posts/search/', {'q': 'zebra'})
+        self.assertEqual([hit['title'] for hit in response.data['results']], ['Imported zebra'])
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class SlugAllocationTests(TestCase):
+    def post(self, title, **kwargs):
+        return Post.objects.create(title=title, content='...', **kwargs)
+
+    def test_collisions_take_lowest_free_suffix(self):
+        self.assertEqual(self.post('Hello world').slug, 'hello-world')
+        self.assertEqual(self.post('Hello, World!').slug, 'hello-world-1')
+        self.post('Gap', slug='hello-world-3')
+        self.assertEqual(self.post('Hello world').slug, 'hello-world-2')
+        self.assertEqual(self.post('Hello world').slug, 'hello-world-4')
+
+    def test_one_query_per_allocation(self):
+        self.post('Hello')
+        self.post('Hello')
+        with self.assertNumQueries(1):
+            self.assertEqual(slugs.allocate_slug(Post, 'Hello'), 'hello-2')
+
+    def test_exclude_pk_keeps_own_slug(self):
+        post = self.post('Hello')
+        self.assertEqual(slugs.allocate_slug(Post, 'Hello', exclude_pk=post.pk), 'hello')
+
+    def test_long_titles_leave_room_for_suffix(self):
+        max_length = Post._meta.get_field('slug').max_length
+        title = 'a' * (max_length + 30)
+        self.assertEqual(self.post(title).slug, 'a' * max_length)
+        suffixed = self.post(title).slug
+        self.assertEqual(suffixed, 'a' * (max_length - slugs.SUFFIX_ROOM) + '-1')
+        # A cut that lands on a word boundary doesn't leave "--1".
+        cut = max_length - slugs.SUFFIX_ROOM
+        title = 'b' * (cut - 1) + ' ' + 'b' * 30
+        self.post(title)
+        self.assertEqual(self.post(title).slug, 'b' * (cut - 1) + '-1')
+
+    def test_empty_slug_falls_back_to_model_name(self):
+        self.assertEqual(self.post('!!!').slug, 'post')
+        self.assertEqual(self.post('???').slug, 'post-1')
+        self.assertEqual(PostCategory.objects.create(name='---').slug, 'postcategory')
+
+    def test_bulk_allocation_avoids_batch_and_table_collisions(self):
+        self.post('Hello')
+        self.post('Other', slug='hello-2')
+        self.assertEqual(
+            slugs.allocate_slugs(Post, ['Hello-1', 'Hello', 'Hello', 'New', 'new', '']),
+            ['hello-1', 'hello-3', 'hello-4', 'new', 'new-1', 'post'],
+        )
+
+    def test_retries_when_a_concurrent_writer_takes_the_slug(self):
+        self.post('Race')
+        real = slugs.allocate_slug
+        calls = []
+
+        def stale(*args, **kwargs):
+            # The first allocation ran before the rival row was committed.
+            calls.append(args)
+            return 'race' if len(calls) == 1 else real(*args, **kwargs)
+
+        with mock.patch.object(slugs, 'allocate_slug', stale):
+            post = self.post('Race')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(post.slug, 'race-1')
+        self.assertEqual(Post.objects.filter(slug='race-1').count(), 1)
+
+    def test_gives_up_after_attempts(self):
+        self.post('Race')
+        post = Post(title='Race', content='...')
+        with mock.patch.object(slugs, 'allocate_slug', return_value='race') as allocate:
+            with self.assertRaises(IntegrityError):
+                slugs.save_with_slug(post, post.title, post._save_row, attempts=3)
+        self.assertEqual(allocate.call_count, 3)
+        self.assertEqual(post.slug, '')
+
+    def test_other_integrity_errors_are_not_retried(self):
+        post = Post(title='Broken', content='...')
+        save = mock.Mock(side_effect=IntegrityError("NOT NULL constraint failed"))
+        with self.assertRaises(IntegrityError):
+            slugs.save_with_slug(post, post.title, save)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(post.slug, '')
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False}, PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 10})
+class StatelessAuthTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.admin = CustomUser.objects.create_user(email='editor@example.com', password='secret123', fname='Edi', lname='Tor', is_staff=True)
+        self.client = APIClient()
+        tokens = self.client.post('/api/login/', {'email': 'editor@example.com', 'password': 'secret123'}, format='json').data['tokens']
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+
+    def get(self, url, access):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_requests_trust_the_claims(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/api/cache-stats/', self.access).status_code, 200)
+        CustomUser.objects.create_user(email='plain@example.com', password='secret123', fname='Pla', lname='In')
+        plain = self.client.post('/api/login/', {'email': 'plain@example.com', 'password': 'secret123'}, format='json').data['tokens']['access']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/api/cache-stats/', plain).status_code, 403)
+
+    def test_refresh_picks_up_demotion(self):
+        CustomUser.objects.filter(pk=self.admin.pk).update(is_staff=False)
+        # Until the access token expires its claims stand.
+        self.assertEqual(self.get('/api/cache-stats/', self.access).status_code, 200)
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': self.refresh}, format='json')
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertEqual(self.get('/api/cache-stats/', refreshed.data['access']).status_code, 403)
+
+    def test_refresh_refused_for_deleted_user(self):
+        CustomUser.objects.filter(pk=self.admin.pk).delete()
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': self.refresh}, format='json').status_code, 401)
+
+    def test_profile_read_is_cached_and_evicted(self):
+        self.assertEqual(self.get('/api/current-user/', self.access).data['fname'], 'Edi')
+        with CaptureQueriesContext(connection) as ctx:
+            self.get('/api/current-user/', self.access)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'FROM "home_customuser"' in q['sql']])
+        self.admin.fname = 'Eddie'
+        self.admin.save()
+        self.assertEqual(self.get('/api/current-user/', self.access).data['fname'], 'Eddie')
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False}, TOKEN_BLACKLIST_FILTER={'SYNC_INTERVAL': 0})
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='secret123', fname='Rea', lname='Der')
+        self.client = APIClient()
+        # Ids of rows rolled back by other tests get reused; start clean.
+        revocation_filter.reset()
+        self.addCleanup(revocation_filter.reset)
+
+    def refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': str(token)}, format='json')
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'revoked-{i}')
+        self.assertTrue(all(f'revoked-{i}' in bloom for i in range(1000)))
+        false_hits = sum(f'live-{i}' in bloom for i in range(10000))
+        self.assertLess(false_hits, 300)
+
+    def test_filter_syncs_revocations_from_other_processes(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        jti = token[jwt_settings.JTI_CLAIM]
+        self.assertFalse(revocation_filter.might_be_revoked(jti))
+        # bulk_create sends no post_save, like a row written by another process.
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=jti))])
+        self.assertTrue(revocation_filter.might_be_revoked(jti))
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_rotated_token_cannot_be_replayed(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_replay_missed_by_filter_still_rejected(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        with mock.patch.object(revocation_filter, 'might_be_revoked', return_value=False):
+            self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_untracked_token_blacklisted_once(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        OutstandingToken.objects.all().delete()
+        token.blacklist()
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=token[jwt_settings.JTI_CLAIM]).exists())
+        with self.assertRaises(TokenBlacklisted):
+            token.blacklist()
+
+    def test_logout_twice(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        self.client.force_authenticate(self.user)
+        for _ in range(2):
+            response = self.client.post('/api/logout/', {'refresh': str(token)}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/api/logout/', {'refresh': 'garbage'}, format='json').status_code, 400)
+
+
+@override_settings(
+    ACTIVITY_LOG_WRITER={'ASYNC': False},
+    PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 10, 'MAX_CONCURRENT': 1, 'WAIT_TIMEOUT': 0.05},
+)
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='member@example.com', password='secret123', fname='Mem', lname='Ber')
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post('/api/login/', {'email': 'member@example.com', 'password': 'secret123'}, format='json')
+
+    def hold_slot(self):
+        """Keep the only hashing slot taken until the test ends."""
+        taken, release = threading.Event(), threading.Event()
+
+        def hold():
+            with hashing_gate.slot():
+                taken.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        taken.wait()
+
+    def assertShed(self, response):
+        self.assertEqual(response.status_code, 503, response.content)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_busy_gate_sheds_every_hashing_view(self):
+        self.hold_slot()
+        self.assertShed(self.login())
+        self.assertShed(self.client.post('/api/register/', {
+            'email': 'newcomer@example.com', 'password': 'secret123', 'fname': 'New', 'lname': 'Comer',
+        }, format='json'))
+        self.client.force_authenticate(self.user)
+        self.assertShed(self.client.patch(f'/api/users/{self.user.pk}/', {'password': 'another123'}, format='json'))
+        self.assertFalse(CustomUser.objects.filter(email='newcomer@example.com').exists())
+
+    def test_login_rehashes_outdated_hashes(self):
+        self.user.password = make_password('secret123', hasher='pbkdf2_sha256')
+        self.user.save(update_fields=['password'])
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$1024$'))
+
+        with override_settings(PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 11}):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$2048$'))
+
+    def test_maxmem_fits_hashes_past_openssl_default(self):
+        # 128 * N * r = 32 MiB, past OpenSSL's default scrypt limit.
+        with override_settings(PASSWORD_HASHING={'SCRYPT_WORK_FACTOR': 2 ** 15}):
+            encoded = make_password('secret123')
+        self.assertTrue(encoded.startswith('scrypt$32768$'))
+        # A costlier hash than the current setting still verifies.
+        self.assertTrue(check_password('secret123', encoded))
+        self.assertGreaterEqual(ScryptPasswordHasher().maxmem, 2 * 128 * 2 ** 15 * 8)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class TagMigrationTests(TransactionTestCase):
+    """0010 adds Post.tag_set without rebuilding home_post (and dropping its FTS5 triggers)."""
+
+    def fts_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'home_post_fts_%'")
+            return sorted(name for name, in cursor.fetchall())
+
+    def setUp(self):
+        if search.get_backend().name != 'fts5':
+            self.skipTest("SQLite build without FTS5")
+
+    def test_0010_keeps_fts_triggers(self):
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes()
+        try:
+            executor.migrate([('home', '0009_post_fts')])
+            self.assertEqual(len(self.fts_triggers()), 3)
+            executor.loader.build_graph()
+            executor.migrate([('home', '0010_tags')])
+            self.assertEqual(len(self.fts_triggers()), 3)
+        finally:
+            executor.loader.build_graph()
+            executor.migrate(latest)
+            search.ensure_fts_triggers()
+
+    def test_post_created_after_migrations_is_searchable(self):
+        self.assertEqual(len(self.fts_triggers()), 3)
+        Post.objects.create(title='Zebra migration', content='...', status='publish')
+        response = APIClient().get('/api/posts/search/', {'q': 'zebra'})
+        self.assertEqual(response.data['count'], 1)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class TagCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def counts(self):
+        return dict(Tag.objects.values_list('slug', 'post_count'))
+
+    def test_counts_follow_status(self):
+        post = Post.objects.create(title='One', content='...', tags='Django, ORM', status='draft')
+        self.assertEqual(self.counts(), {'django': 0, 'orm': 0})
+        post.status = 'publish'
+        post.save()
+        self.assertEqual(self.counts(), {'django': 1, 'orm': 1})
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self.counts(), {'django': 0, 'orm': 0})
+
+    def test_counts_follow_tag_changes(self):
+        post = Post.objects.create(title='One', content='...', tags='django, orm', status='publish')
+        Post.objects.create(title='Two', content='...', tags='Django', status='publish')
+        self.assertEqual(self.counts(), {'django': 2, 'orm': 1})
+        post.tags = 'orm, python'
+        post.save()
+        self.assertEqual(self.counts(), {'django': 1, 'orm': 1, 'python': 1})
+        self.assertEqual(post.tags, 'orm, python')
+
+    def test_counts_follow_delete(self):
+        post = Post.objects.create(title='One', content='...', tags='django', status='publish')
+        Post.objects.create(title='Two', content='...', tags='django', status='draft').delete()
+        self.assertEqual(self.counts(), {'django': 1})
+        post.delete()
+        self.assertEqual(self.counts(), {'django': 0})
+
+    def test_tag_filter(self):
+        both = Post.objects.create(title='Both', content='...', tags='django, orm', status='publish')
+        django = Post.objects.create(title='Django', content='...', tags='django', status='publish')
+        Post.objects.create(title='Draft', content='...', tags='django, orm', status='draft')
+
+        def titles(params):
+            return sorted(p['title'] for p in self.client.get('/api/posts/', params).data['results'])
+
+        self.assertEqual(titles({'tag': 'django'}), sorted([both.title, django.title]))
+        self.assertEqual(titles({'tag': ['django', 'orm']}), [both.title])
+        self.assertEqual(titles({'tag': ['orm', 'missing']}), [])
+        self.assertEqual(titles({'tag': ['orm', 'missing'], 'tag_match': 'any'}), [both.title])
+
+    def test_tags_endpoint(self):
+        Post.objects.create(title='One', content='...', tags='django, orm', status='publish')
+        Post.objects.create(title='Two', content='...', tags='django', status='publish')
+        Post.objects.create(title='Draft', content='...', tags='unused', status='draft')
+        response = self.client.get('/api/tags/')
+        self.assertEqual(
+            [(t['slug'], t['post_count']) for t in response.data['results']],
+            [('django', 2), ('orm', 1)],
+        )
+        self.assertEqual(self.client.get('/api/tags/orm/').data['post_count'], 1)
+        self.assertEqual(self.client.get('/api/tags/unused/').status_code, 404)
+
+    def test_recount_repairs_queryset_update_drift(self):
+        Post.objects.create(title='One', content='...', tags='django, orm', status='publish')
+        Post.objects.create(title='Two', content='...', tags='django', status='draft')
+        self.assertEqual(self.client.get('/api/tags/').data['results'][0]['post_count'], 1)
+        # Bypasses save(), so the counts don't move.
+        Post.objects.update(status='publish')
+        self.assertEqual(self.counts(), {'django': 1, 'orm': 1})
+        self.assertEqual(recount(dry_run=True)['tag.post_count'], 1)
+
+        out = StringIO()
+        call_command('recount_stats', stdout=out, stderr=StringIO())
+        self.assertIn("tag.post_count: 1 rows repaired", out.getvalue())
+        self.assertEqual(self.counts(), {'django': 2, 'orm': 1})
+        self.assertEqual(self.client.get('/api/tags/').data['results'][0]['post_count'], 2)
+
+
+@override_settings(
+    ACTIVITY_LOG_WRITER={'ASYNC': False},
+    IMAGE_VARIANTS={'WIDTHS': (32,), 'FORMATS': ('WEBP', 'JPEG', 'PNG'), 'QUALITY': 80, 'ASYNC': True},
+)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = APIClient()
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (64, 48), (255, 0, 0, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile('dot.png', buffer.getvalue(), content_type='image/png')
+
+    def test_every_format_from_rgba_source(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            post = Post.objects.create(title='Pic', content='...', status='publish', image=self.upload())
+        meta = images.generate(Post, post.pk)
+        self.assertEqual(
+            sorted((v['type'], v['width'], v['height']) for v in meta['variants']),
+            [('image/jpeg', 32, 24), ('image/png', 32, 24), ('image/webp', 32, 24)],
+        )
+
+    def test_generated_variants_reach_cached_and_conditional_reads(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            # Keep the worker from running, as if it were still busy.
+            post = Post.objects.create(title='Pic', content='...', status='publish', image=self.upload())
+        url = f'/api/posts/{post.pk}/'
+        before = self.client.get(url)
+        self.assertIsNone(before.json()['image_variants'])
+
+        images.generate(Post, post.pk)
+        after = self.client.get(url)
+        self.assertIsNotNone(after.json()['image_variants'])
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag']).status_code, 200)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class MediaBlobTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = Post._meta.get_field('image').storage
+        self.post = Post.objects.create(title='Pic', content='...', status='publish')
+
+    def blob(self, data, name='pic.png'):
+        return self.storage.save(f'post_images/{name}', ContentFile(data))
+
+    def blobs_on_disk(self):
+        return {name for name, _, _ in self.storage.iter_blobs()}
+
+    def gc_media(self, *args):
+        err = StringIO()
+        call_command('gc_media', '--grace', '0', *args, stderr=err)
+        return err.getvalue()
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.blob(b'same bytes', 'a.png')
+        second = self.blob(b'same bytes', 'b.PNG')
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/'))
+        self.assertTrue(first.endswith('.png'))
+        self.assertEqual(self.blobs_on_disk(), {first})
+        self.assertNotEqual(self.blob(b'other bytes'), first)
+
+    def test_delete_leaves_shared_blob(self):
+        name = self.blob(b'shared')
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_gc_removes_only_unreferenced_blobs(self):
+        image, variant, category_image, orphan = (self.blob(data) for data in (b'image', b'variant', b'category', b'orphan'))
+        Post.objects.filter(pk=self.post.pk).update(
+            image=image, image_meta={'source': image, 'variants': [{'name': variant, 'width': 32}]},
+        )
+        category = PostCategory.objects.create(name='Photos')
+        PostCategory.objects.filter(pk=category.pk).update(image=category_image)
+
+        output = self.gc_media()
+        self.assertIn("Removed 1 blobs", output)
+        self.assertEqual(self.blobs_on_disk(), {image, variant, category_image})
+        self.assertFalse(self.storage.exists(orphan))
+
+    def test_gc_grace_period_keeps_recent_uploads(self):
+        orphan = self.blob(b'orphan')
+        err = StringIO()
+        call_command('gc_media', stderr=err)
+        self.assertTrue(self.storage.exists(orphan))
+        self.assertIn("Removed 0 blobs", err.getvalue())
+
+    def test_gc_dry_run_deletes_nothing(self):
+        orphan = self.blob(b'orphan')
+        output = self.gc_media('--dry-run')
+        self.assertIn("Would remove 1 blobs", output)
+        self.assertTrue(self.storage.exists(orphan))
+
+    def legacy(self, name, data):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return name
+
+    def test_adopt_moves_legacy_files_into_blobs(self):
+        image = self.legacy('post_images/old.png', b'legacy image')
+        variant = self.legacy('post_images/variants/old-32.webp', b'legacy variant')
+        other = Post.objects.create(title='Same pic', content='...', status='publish')
+        meta = {'source': image, 'variants': [{'name': variant, 'width': 32}]}
+        Post.objects.filter(pk__in=[self.post.pk, other.pk]).update(image=image, image_meta=meta)
+
+        output = self.gc_media('--adopt')
+        self.assertIn("Adopted 2 legacy files into 2 blobs across 2 rows", output)
+        self.assertIn("Removed 0 blobs", output)
+
+        rows = list(Post.objects.filter(pk__in=[self.post.pk, other.pk]).values_list('image', 'image_meta'))
+        self.assertEqual(rows[0], rows[1])
+        new_image, new_meta = rows[0]
+        new_variant = new_meta['variants'][0]['name']
+        self.assertTrue(self.storage.is_blob(new_image))
+        self.assertTrue(self.storage.is_blob(new_variant))
+        self.assertEqual(new_meta['source'], new_image)
+        self.assertEqual(new_meta['variants'][0]['width'], 32)
+        with self.storage.open(new_image) as f:
+            self.assertEqual(f.read(), b'legacy image')
+        with self.storage.open(new_variant) as f:
+            self.assertEqual(f.read(), b'legacy variant')
+        self.assertFalse(self.storage.exists(image))
+        self.assertFalse(self.storage.exists(variant))
+
+    def test_adopt_dry_run_changes_nothing(self):
+        image = self.legacy('post_images/old.png', b'legacy image')
+        Post.objects.filter(pk=self.post.pk).update(image=image)
+
+        output = self.gc_media('--adopt', '--dry-run')
+        self.assertIn("Would adopt 1 legacy files into 1 blobs across 1 rows", output)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image.name, image)
+        self.assertTrue(self.storage.exists(image))
+        self.assertEqual(self.blobs_on_disk(), set())
+
+    def test_adopt_leaves_missing_files_alone(self):
+        Post.objects.filter(pk=self.post.pk).update(image='post_images/gone.png')
+        output = self.gc_media('--adopt')
+        self.assertIn("Missing file post_images/gone.png", output)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image.name, 'post_images/gone.png')
+
+
+class MediaServingTests(TestCase):
+    body = bytes(range(256)) * 4  # 1024 bytes
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.media = os.path.join(root, 'media')
+        os.mkdir(self.media)
+        # A file right next to MEDIA_ROOT, for the traversal checks.
+        with open(os.path.join(root, 'secret.txt'), 'w') as f:
+            f.write('secret')
+        with open(os.path.join(self.media, 'clip.bin'), 'wb') as f:
+            f.write(self.body)
+        override = override_settings(MEDIA_ROOT=self.media, MEDIA_SERVING={})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = '/media/clip.bin'
+
+    def content(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.body)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'])
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.content(response), self.body[100:200])
+
+    def test_suffix_and_open_ended_ranges(self):
+        for header, start in (('bytes=-24', 1000), ('bytes=1000-', 1000), ('bytes=-5000', 0), ('bytes=1000-9999', 1000)):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-1023/1024')
+                self.assertEqual(self.content(response), self.body[start:])
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=1024-', 'bytes=-0', 'bytes=500-400'):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], 'bytes */1024')
+        # Forms we don't serve (several ranges) get the whole file.
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.body)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.content(response), b'')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_head(self):
+        response = self.client.head(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(self.content(response), b'')
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_blobs_are_immutable(self):
+        digest = 'ab' * 32
+        os.makedirs(os.path.join(self.media, 'blobs', 'ab'))
+        with open(os.path.join(self.media, 'blobs', 'ab', f'{digest}.png'), 'wb') as f:
+            f.write(b'png')
+        response = self.client.get(f'/media/blobs/ab/{digest}.png')
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertNotIn('immutable', self.client.get(self.url)['Cache-Control'])
+
+    def test_delegated_to_front_server(self):
+        with override_settings(MEDIA_SERVING={'ACCEL_REDIRECT': '/protected/'}):
+            response = self.client.get('/media/clip.bin', HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/clip.bin')
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_SERVING={'SENDFILE': True}):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media, 'clip.bin'))
+        self.assertEqual(response.content, b'')
+
+    def test_nothing_outside_media_root(self):
+        for url in ('/media/../secret.txt', '/media/%2e%2e/secret.txt', '/media/clip.bin/../../secret.txt', '/media/missing.bin'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class DiscussionCounterTests(TestCase):
+    """PostStats.comments/replies and Comment.reply_count through create, delete and cascade."""
+
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create(email=f'talker{i}@example.com', fname='Talker', lname=str(i))
+            for i in range(2)
+        ]
+        self.post = Post.objects.create(title='Thread', content='...', status='publish')
+        self.comments = [Comment.objects.create(post=self.post, user=user, content='Hi') for user in self.users]
+        for comment in self.comments:
+            for user in self.users:
+                Reply.objects.create(comment=comment, user=user, content='Hello')
+
+    def assertCounters(self, comments, replies, reply_counts):
+        stats = PostStats.objects.get(post=self.post)
+        self.assertEqual((stats.comments, stats.replies), (comments, replies))
+        self.assertEqual(list(Comment.objects.order_by('pk').values_list('reply_count', flat=True)), reply_counts)
+        self.assertAlmostEqual(stats.engagement_score, stats.compute_engagement_score())
+
+    def test_counts_follow_creates(self):
+        self.assertCounters(2, 4, [2, 2])
+
+    def test_reply_and_comment_deletes(self):
+        Reply.objects.filter(comment=self.comments[0]).first().delete()
+        self.assertCounters(2, 3, [1, 2])
+        # Cascades to the comment's remaining reply.
+        self.comments[1].delete()
+        self.assertCounters(1, 1, [1])
+
+    def test_user_delete_cascades_through_comments_and_replies(self):
+        # user 0's comment (and both its replies) plus user 0's reply on user 1's comment.
+        self.users[0].delete()
+        self.assertCounters(1, 1, [1])
+
+    def test_post_delete_takes_stats_along(self):
+        self.post.delete()
+        self.assertFalse(PostStats.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_replies_do_not_move_engagement_score(self):
+        before = PostStats.objects.get(post=self.post).engagement_score
+        Reply.objects.create(comment=self.comments[0], user=self.users[0], content='More')
+        self.assertEqual(PostStats.objects.get(post=self.post).engagement_score, before)
+
+    def test_recount_repairs_drift(self):
+        PostStats.objects.filter(post=self.post).update(comments=9, replies=0, likes=3, engagement_score=0)
+        Comment.objects.filter(pk=self.comments[0].pk).update(reply_count=7)
+        self.assertEqual(recount(dry_run=True), {
+            'comment.reply_count': 1,
+            'poststats.comments/replies/likes': 1,
+            'poststats.engagement_score': 1,
+            'tag.post_count': 0,
+        })
+        recount()
+        self.assertCounters(2, 4, [2, 2])
+        self.assertEqual(PostStats.objects.get(post=self.post).likes, 0)
+        self.assertEqual(set(recount(dry_run=True).values()), {0})
+
+    def test_comment_reads_see_new_reply_count(self):
+        client = APIClient()
+        comment = self.comments[0]
+        url = f'/api/comments/{comment.pk}/'
+        before = client.get(url)
+        self.assertEqual(before.json()['reply_count'], 2)
+        client.get('/api/comments/')
+
+        Reply.objects.create(comment=comment, user=self.users[1], content='Again')
+        after = client.get(url)
+        self.assertEqual(after.json()['reply_count'], 3)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        listed = {row['id']: row['reply_count'] for row in client.get('/api/comments/').json()['results']}
+        self.assertEqual(listed[comment.pk], 3)
+
+
+@override_settings(ACTIVITY_LOG_WRITER={'ASYNC': False})
+class AsyncReadParityTests(TestCase):
+    HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary', 'X-Cache')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The API routed as core/asgi.py gets it; the test run itself is WSGI.
+        with override_settings(ASYNC_PUBLIC_READS=True):
+            api = async_reads(router.urls)
+        cls.urlconf = types.ModuleType('async_urls')
+        cls.urlconf.urlpatterns = [path('api/', include(api))]
+
+    def setUp(self):
+        category = PostCategory.objects.create(name='Travel')
+        author = CustomUser.objects.create(email='writer@example.com', fname='Wri', lname='Ter')
+        post = Post.objects.create(title='Parity', content='...', status='publish', category=category, author=author)
+        comment = Comment.objects.create(post=post, user=author, content='Nice')
+        Reply.objects.create(comment=comment, user=author, content='Thanks')
+        self.paths = [
+            '/api/posts/', f'/api/posts/{post.pk}/', f'/api/posts/{post.pk}/discussion/',
+            '/api/categories/', f'/api/categories/{category.pk}/', '/api/post-stats/post_of_the_week/',
+        ]
+        override = override_settings(ROOT_URLCONF=self.urlconf)
+        override.enable()
+        self.addCleanup(override.disable)
+        caches['default'].clear()
+
+    def get(self, mode, path, **extra):
+        with override_settings(ASYNC_PUBLIC_READS=mode == 'async'):
+            return self.client.get(path, **extra)
+
+    def headers(self, response):
+        return {name: response.get(name) for name in self.HEADERS}
+
+    def test_wsgi_routes_are_left_sync(self):
+        with override_settings(ROOT_URLCONF='core.urls'):
+            self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/posts/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/posts/').func))
+
+    def test_same_body_and_headers_both_ways(self):
+        for path_ in self.paths:
+            with self.subTest(path=path_):
+                responses = {}
+                for mode in ('sync', 'async'):
+                    caches['default'].clear()
+                    responses[mode] = self.get(mode, path_)
+                self.assertEqual(responses['async'].status_code, 200)
+                self.assertEqual(responses['async'].content, responses['sync'].content)
+                self.assertEqual(self.headers(responses['async']), self.headers(responses['sync']))
+
+    def test_cache_and_etags_are_shared(self):
+        for first, second in (('sync', 'async'), ('async', 'sync')):
+            for path_ in self.paths:
+                with self.subTest(path=path_, first=first):
+                    caches['default'].clear()
+                    filled = self.get(first, path_)
+                    reused = self.get(second, path_)
+                    self.assertEqual(reused.content, filled.content)
+                    self.assertEqual(reused.get('X-Cache'), filled.get('X-Cache') and 'HIT')
+                    if filled.has_header('ETag'):
+                        self.assertEqual(self.get(second, path_, HTTP_IF_NONE_MATCH=filled['ETag']).status_code, 304)
@@ -1,18 +1,28 @@
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from .serializers import (
     UserSerializer, CategorySerializer, PostSerializer,
-    CommentSerializer, ReplySerializer, PostStatsSerializer, ContactSerializer, NewsletterSerializer
+    CommentSerializer, ReplySerializer, PostStatsSerializer, ContactSerializer, NewsletterSerializer,
+    ActivityLogSerializer, AnalyticsQuerySerializer, CounterIncrementSerializer, TagSerializer, DiscussionCommentSerializer
 )
-from .models import CustomUser, PostCategory, Post, Comment, Reply, PostStats, Contact, NewsLetter
+from .models import CustomUser, PostCategory, Post, Comment, Reply, PostStats, Contact, NewsLetter, ActivityLog, Tag
+from .pagination import KeysetPagination, DiscussionPagination, SearchPagination
+from .prefetch import QueryPlanMixin
+from .counters import counter_buffer
+from .activity import activity_writer
+from .cache import CachedResponseMixin, cache_stats
+from .conditional import ConditionalGetMixin
+from .search import SearchResults
+from .authentication import add_user_claims, load_user
+from .hashers import HashingBusy
+from .blacklist import FilteredRefreshToken, TokenBlacklisted
+from .analytics import time_series
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import F, ExpressionWrapper, FloatField
-from django.db.models.functions import ExtractWeek, Now
+from django.utils import timezone
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAdminUser
@@ -23,9 +33,7 @@ from django.db import transaction
 logger = logging.getLogger(__name__)
 
 def get_tokens_for_user(user):
-    refresh = RefreshToken.for_user(user)
-    refresh['is_superuser'] = user.is_superuser
-    refresh['is_staff'] = user.is_staff
+    refresh = add_user_claims(FilteredRefreshToken.for_user(user), user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -47,6 +55,9 @@ class RegisterView(APIView):
                 "user": UserSerializer(user).data,
                 "tokens": tokens
             }, status=status.HTTP_201_CREATED)
+        except HashingBusy:
+            # A 503 with Retry-After, not a failed registration.
+            raise
         except Exception as e:
             logger.error(f"Registration failed: {str(e)}")
             return Response({"error": f"Registration failed: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
@@ -66,6 +77,8 @@ class LoginView(APIView):
         except CustomUser.DoesNotExist:
             return Response({"error": "Invalid credentials"}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Also rehashes the password if it was stored with an older hasher
+        # or cost (settings.PASSWORD_HASHERS / PASSWORD_HASHING).
         if not user.check_password(password):
             return Response({"error": "Invalid credentials"}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -89,9 +102,12 @@ class LogoutView(APIView):
         if not refresh_token:
             return Response({"error": "Refresh token required"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
-            logger.info(f"User {request.user.email} logged out successfully")
+            logger.info(f"User {load_user(request.user.pk).email} logged out successfully")
+            return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
+        except TokenBlacklisted:
+            # Already revoked, e.g. a retried logout: the outcome is the same.
             return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Logout failed: {str(e)}")
@@ -102,24 +118,44 @@ class CurrentUserView(APIView):
     
     def get(self, request):
         try:
-            user = request.user
+            # request.user only carries the token's claims; the profile is the row.
+            user = load_user(request.user.pk)
             return Response(UserSerializer(user).data)
         except Exception as e:
             logger.error(f"Current user fetch failed: {str(e)}")
             return Response({"detail": str(e)}, status=500)
 
-class CategoryViewset(ModelViewSet):
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats())
+
+class CategoryViewset(CachedResponseMixin, QueryPlanMixin, ModelViewSet):
     queryset = PostCategory.objects.all()
     serializer_class = CategorySerializer
+    cache_scope = 'categories'
+    permission_classes = [AllowAny]
+
+class TagViewset(CachedResponseMixin, QueryPlanMixin, ReadOnlyModelViewSet):
+    """Tag cloud: tags in use by published posts, most used first."""
+    queryset = Tag.objects.filter(post_count__gt=0)
+    serializer_class = TagSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-post_count', 'slug')
+    lookup_field = 'slug'
+    cache_scope = 'tags'
     permission_classes = [AllowAny]
 
-class UserViewset(ModelViewSet):
+class UserViewset(QueryPlanMixin, ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
-class PostViewset(ModelViewSet):
+class PostViewset(ConditionalGetMixin, CachedResponseMixin, QueryPlanMixin, ModelViewSet):
     serializer_class = PostSerializer
+    pagination_class = KeysetPagination
+    cache_scope = 'posts'
     parser_classes = (MultiPartParser, FormParser)
     
     def get_permissions(self):
@@ -129,46 +165,105 @@ class PostViewset(ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        print(f"User: {user}, Is Authenticated: {user.is_authenticated}, Is Superuser: {user.is_superuser}")
         if user.is_authenticated and user.is_superuser:
-            return Post.objects.all().order_by('-created_at')
-        return Post.objects.filter(status='publish').order_by('-created_at')
+            queryset = Post.objects.all().order_by('-created_at')
+        else:
+            queryset = Post.objects.filter(status='publish').order_by('-created_at')
+        # ?tag=django&tag=orm: posts with every tag; add ?tag_match=any for either.
+        tags = self.request.query_params.getlist('tag')
+        if tags:
+            match = 'any' if self.request.query_params.get('tag_match') == 'any' else 'all'
+            queryset = queryset.tagged(tags, match=match)
+        return queryset
     
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # By id: request.user is the token's claims, not a CustomUser row.
+        serializer.save(author_id=self.request.user.pk)
     
     def perform_update(self, serializer):
         serializer.save()
 
-class CommentViewset(ModelViewSet):
-    queryset = Comment.objects.all()
+    @action(detail=True, methods=['get'])
+    def discussion(self, request, pk=None):
+        """
+        The post's comments, oldest first, each with its replies and both
+        authors embedded. Cursor-paginated over the comments (``?page_size=``
+        up to 2000); a page costs one query for the comments and their users
+        and one for all of their replies and theirs.
+        """
+        return self.cached_response_for('discussions', self.load_discussion, request, pk=pk)
+
+    def load_discussion(self, request, pk=None):
+        if not self.get_queryset().filter(pk=pk).exists():
+            raise NotFound()
+        comments = self.plan_queryset(Comment.objects.filter(post_id=pk), DiscussionCommentSerializer)
+        paginator = DiscussionPagination()
+        page = paginator.paginate_queryset(comments, request, view=self)
+        serializer = DiscussionCommentSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked full-text search over title, content and tags: ``?q=`` with
+        ``?limit=`` / ``?offset=`` paging. Every term must match; each hit
+        carries its score plus a highlighted title and content snippet.
+        """
+        if not request.query_params.get('q', '').strip():
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+        return self.cached_response(self.run_search, request)
+
+    def run_search(self, request):
+        user = request.user
+        results = SearchResults(
+            request.query_params['q'],
+            published_only=not (user.is_authenticated and user.is_superuser),
+        )
+        paginator = SearchPagination()
+        hits = paginator.paginate_queryset(results, request, view=self)
+        posts = self.plan_queryset(Post.objects.all()).in_bulk([hit['id'] for hit in hits])
+        data = []
+        for hit in hits:
+            post = posts.get(hit['id'])
+            if post is None:
+                continue
+            item = self.get_serializer(post).data
+            item['search'] = {'score': hit['score'], 'title': hit['title'], 'snippet': hit['snippet']}
+            data.append(item)
+        return paginator.get_paginated_response(data)
+
+class CommentViewset(ConditionalGetMixin, CachedResponseMixin, QueryPlanMixin, ModelViewSet):
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    cache_scope = 'comments'
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAuthenticated()]
         return [AllowAny()] 
 
+    def get_queryset(self):
+        queryset = Comment.objects.all()
+        post_id = self.request.query_params.get('post', None)
+        if post_id is not None:
+            queryset = queryset.filter(post_id=post_id)
+        return queryset
+
     def perform_create(self, serializer):
+        # PostStats.comments is moved by the Comment signals (home/counters.py).
         with transaction.atomic():
-            comment = serializer.save(user=self.request.user)
-            # Increment PostStats comments count
-            post_stats, created = PostStats.objects.get_or_create(post=comment.post)
-            post_stats.comments = F('comments') + 1
-            post_stats.save(update_fields=['comments'])
+            comment = serializer.save(user_id=self.request.user.pk)
             logger.info(f"Comment created for post {comment.post.title}, stats updated")
 
-    def destroy(self, request, *args, **kwargs):
+    def perform_destroy(self, instance):
         with transaction.atomic():
-            comment = self.get_object()
-            post_stats = PostStats.objects.get(post=comment.post)
-            post_stats.comments = F('comments') - 1
-            post_stats.save(update_fields=['comments'])
-            logger.info(f"Comment deleted for post {comment.post.title}, stats updated")
-            return super().destroy(request, *args, **kwargs)
-
-class ReplyViewset(ModelViewSet):
+            instance.delete()
+            logger.info(f"Comment deleted for post {instance.post.title}, stats updated")
+
+class ReplyViewset(ConditionalGetMixin, CachedResponseMixin, QueryPlanMixin, ModelViewSet):
     serializer_class = ReplySerializer
+    pagination_class = KeysetPagination
+    cache_scope = 'replies'
     
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -183,9 +278,15 @@ class ReplyViewset(ModelViewSet):
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # In one transaction with the counter updates from the Reply signals.
+        with transaction.atomic():
+            serializer.save(user_id=self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
 
-class PostStatsViewset(ModelViewSet):
+class PostStatsViewset(QueryPlanMixin, ModelViewSet):
     queryset = PostStats.objects.all()
     serializer_class = PostStatsSerializer
     permission_classes = [AllowAny]
@@ -196,49 +297,96 @@ class PostStatsViewset(ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def post_of_the_week(self, request):
-        current_week = ExtractWeek(Now())
-        post_of_week = (
-            PostStats.objects.annotate(
-                engagement_score=ExpressionWrapper(
-                    0.2 * F('views') + 0.3 * F('likes') + 0.3 * F('comments') + 0.2 * F('shares'),
-                    output_field=FloatField()
-                )
-            )
-            .filter(post__created_at__week=current_week)
-            .order_by('-engagement_score')
-            .first()
-        )
-        if not post_of_week:
-            post_of_week = (
-                PostStats.objects.annotate(
-                    engagement_score=ExpressionWrapper(
-                        0.2 * F('views') + 0.3 * F('likes') + 0.3 * F('comments') + 0.2 * F('shares'),
-                        output_field=FloatField()
-                    )
-                )
-                .order_by('-engagement_score')
-                .first()
-            )
+        year, week, _ = timezone.localdate().isocalendar()
+        leaderboard = self.plan_queryset(PostStats.objects.all())
+        post_of_week = leaderboard.leaderboard(week=(year, week)).first() or leaderboard.leaderboard().first()
         if post_of_week:
             serializer = self.get_serializer(post_of_week)
             return Response(serializer.data)
         return Response({"message": "No post found for this week"}, status=status.HTTP_404_NOT_FOUND)
-   
+
+    @action(detail=False, methods=['get'])
+    def top(self, request):
+        """
+        Leaderboard read straight off the engagement_score index.
+        ``?n=`` caps the size (default 10, max 100); ``?week=`` is an ISO
+        week like ``2025-W09`` or ``current``; without it the board is all-time.
+        """
+        try:
+            n = min(max(int(request.query_params.get('n', 10)), 1), 100)
+        except ValueError:
+            return Response({"error": "n must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        week = request.query_params.get('week')
+        if week == 'current':
+            week = timezone.localdate().isocalendar()[:2]
+        elif week:
+            try:
+                year, number = week.upper().split('-W')
+                week = (int(year), int(number))
+            except ValueError:
+                return Response({"error": "week must look like 2025-W09"}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.plan_queryset(PostStats.objects.all()).leaderboard(week=week)[:n]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def toggle_like(self, request, pk=None):
         post_stat = self.get_object()
-        user = request.user
-        if user in post_stat.liked_by.all():
-            post_stat.liked_by.remove(user)
-            post_stat.likes = max(0, post_stat.likes - 1)
-        else:
-            post_stat.liked_by.add(user)
-            post_stat.likes += 1
-        post_stat.save()
+        post_stat.toggle_like(request.user)
+        # Picks up the new counters and drops the prefetched liked_by.
+        post_stat.refresh_from_db()
         serializer = self.get_serializer(post_stat)
         return Response(serializer.data)
-    
-class ContactViewSet(ModelViewSet):
+
+    @action(detail=True, methods=['post'])
+    def increment(self, request, pk=None):
+        """
+        Queue view/share increments in the write-behind buffer; they reach the
+        database on the next flush instead of rewriting the row per hit.
+        """
+        try:
+            pk = int(pk)
+        except ValueError:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        serializer = CounterIncrementSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not PostStats.objects.filter(pk=pk).exists():
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        counter_buffer.increment(pk, **serializer.validated_data)
+        # Read after the increment, in one piece: it may have been flushed
+        # already (write-through, a full buffer, the background flusher).
+        counts = counter_buffer.snapshot(pk)
+        if counts is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"id": pk, **counts}, status=status.HTTP_202_ACCEPTED)
+
+class ActivityLogViewset(QueryPlanMixin, ReadOnlyModelViewSet):
+    queryset = ActivityLog.objects.all()
+    serializer_class = ActivityLogSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False, methods=['get'], url_path='writer-stats')
+    def writer_stats(self, request):
+        return Response(activity_writer.stats())
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Event counts over time from the hourly/daily rollups, never the raw
+        log: ``?interval=hour|day|week&since=&until=`` (UTC dates, inclusive),
+        ``post=<id>`` for one post instead of the whole site, and repeated
+        ``action=`` to narrow the series.
+        """
+        query = AnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        return Response(time_series(
+            params['interval'], params['since'], params['until'],
+            post_id=params.get('post'), actions=params.get('action') or None,
+        ))
+
+class ContactViewSet(QueryPlanMixin, ModelViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
 
@@ -259,7 +407,7 @@ class ContactViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return Response({"message": "DELETE method not allowed"}, status=status.HTTP_403_FORBIDDEN)
 
-class NewsLetterViewSet(ModelViewSet):
+class NewsLetterViewSet(QueryPlanMixin, ModelViewSet):
     queryset = NewsLetter.objects.all()
     serializer_class = NewsletterSerializer
 